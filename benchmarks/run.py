@@ -0,0 +1,375 @@
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import lhe_classification
+import lhe_columnar
+import lhe_compression
+import lhe_kinematics
+import lhe_output
+import lhefile_methods
+from benchmarks import synthetic_lhe
+
+DEFAULT_EVENTS = 10000
+DEFAULT_WEIGHTS = 20 #reweighting weights per event in the files with <rwgt> blocks
+DEFAULT_BATCHSIZE = 1000
+
+#The MELA-free stages, in the order they run on each batch of events
+STAGES = ("read", "parse", "weights", "classify", "classify_batch", "kinematics", "write")
+#The stages that need MELA (and ROOT): iterating with the LHEFile_* class, setInputEvent, and the MELA call in MELA_CALLS
+MELA_STAGES = ("lhefile", "setInputEvent", "mela")
+#The MELA function called for each topology, and the production process it takes (a TVar name), if any
+MELA_CALLS = {
+    "Hwithdecay": ("computeDecayAngles", None),
+    "HwithdecayOnly": ("computeDecayAngles", None),
+    "StableHiggs": ("computeVBFAngles", None),
+    "VH": ("computeVHAngles", "Had_ZH"),
+    "VHwithdecay": ("computeDecayAngles", None),
+    "ZHHAWK": ("computeVHAngles", "Lep_ZH"),
+    "ttH": (None, None),
+    "Offshell4l": ("computeDecayAngles", None),
+}
+#The output formats tried when none is given, with the module each one needs
+_FORMATS = (("uproot", "uproot"), ("parquet", "pyarrow"), ("hdf5", "h5py"), ("root", "ROOT"))
+#ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def _available(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def default_format():
+    """The first output format whose library is installed, or None"""
+    return next((name for name, module in _FORMATS if _available(module)), None)
+
+
+def _checkcategories(topology, batch, categories):
+    """Makes sure that the synthetic events classify into the numbers of particles the topology promises"""
+    expected = synthetic_lhe.TOPOLOGIES[topology].ncategories
+    if expected is None:
+        return
+    eventindex = np.repeat(np.arange(len(batch.nparticles)), batch.nparticles)
+    for k, n in enumerate(expected):
+        counts = np.bincount(eventindex[categories == k], minlength=len(batch.nparticles))
+        if np.any(counts != n):
+            raise ValueError("{} events have {} {} instead of {}".format(topology, counts[counts != n][0], lhe_classification.CATEGORIES[k], n))
+
+
+def measure_stages(filename, topology, nweights, batchsize=DEFAULT_BATCHSIZE, outputformat=None, outputfile=None):
+    """Times the MELA-free stages on an LHE file, a batch of events at a time
+
+    Parameters
+    ----------
+    filename : str
+        The LHE file, one of synthetic_lhe.TOPOLOGIES
+    topology : str
+        Its topology
+    nweights : int
+        The number of reweighting weights in each event (0 skips the weights stage)
+    batchsize : int, optional
+        The number of events read at once, by default DEFAULT_BATCHSIZE
+    outputformat : str, optional
+        One of lhe_output.BACKENDS for the write stage, by default None (skip it)
+    outputfile : str, optional
+        The file the write stage writes
+
+    Returns
+    -------
+    Tuple[int, dict, dict]
+        The number of events, the seconds spent in each stage that ran, and the reason each other stage was skipped
+    """
+    rule = getattr(lhe_classification, synthetic_lhe.TOPOLOGIES[topology].classificationrule)
+    seconds = collections.OrderedDict((stage, 0.) for stage in STAGES)
+    skipped = collections.OrderedDict()
+    if not nweights:
+        skipped["weights"] = "no <rwgt> blocks"
+
+    writer = None
+    if outputformat is None:
+        skipped["write"] = "no output format available"
+    else:
+        columns = [("ptH", "f4", ()), ("etaH", "f4", ()), ("mH", "f4", ()), ("weight", "f4", ())]
+        if nweights:
+            columns.append(("weights", "f4", (nweights,)))
+        try:
+            writer = lhe_output.open_writer(outputformat, outputfile, columns, chunksize=batchsize)
+        except ImportError as e:
+            skipped["write"] = str(e)
+    weightparser = lhefile_methods.WeightParser(synthetic_lhe.weight_ids(nweights)) if nweights else None
+
+    clock = time.perf_counter
+    nevents = 0
+    with lhe_compression.open_lhe(filename) as f:
+        eventblocks = lhefile_methods.iter_event_blocks(f)
+        while True:
+            start = clock()
+            chunk = list(itertools.islice(eventblocks, batchsize))
+            if not chunk:
+                break
+            linenumbers, events = zip(*chunk)
+            seconds["read"] += clock() - start
+            nevents += len(events)
+
+            start = clock()
+            batch = lhe_columnar.parse_event_batch(events, linenumbers)
+            seconds["parse"] += clock() - start
+
+            if weightparser is not None:
+                start = clock()
+                weights = np.empty((len(events), nweights))
+                for event, out in zip(events, weights):
+                    weightparser.parse(event.decode(), out)
+                seconds["weights"] += clock() - start
+
+            #one event at a time, the way LHEEvent classifies its particles
+            start = clock()
+            ids, statuses, mother1s, mother2s = batch.id.tolist(), batch.status.tolist(), batch.mother1.tolist(), batch.mother2.tolist()
+            for first, last in zip(batch.offsets[:-1].tolist(), batch.offsets[1:].tolist()):
+                particles = lhe_classification.ParticleColumns(ids[first:last], statuses[first:last], mother1s[first:last], mother2s[first:last])
+                lhe_classification.classify_particles(rule, particles)
+            seconds["classify"] += clock() - start
+
+            start = clock()
+            categories = lhe_classification.classify_batch(rule, batch)
+            seconds["classify_batch"] += clock() - start
+            _checkcategories(topology, batch, categories)
+
+            #the four-vector of the sum of the daughters of each event
+            start = clock()
+            eventindex = np.repeat(np.arange(len(events)), batch.nparticles)
+            isdaughter = categories == lhe_classification.CATEGORIES.index("daughters")
+            higgs = np.stack([
+                np.bincount(eventindex[isdaughter], column[isdaughter], minlength=len(events))
+                for column in (batch.px, batch.py, batch.pz, batch.E)
+            ], axis=-1)
+            pt, eta, mass = lhe_kinematics.pt(higgs), lhe_kinematics.eta(higgs), lhe_kinematics.mass(higgs)
+            seconds["kinematics"] += clock() - start
+
+            if writer is not None:
+                start = clock()
+                views = writer.views()
+                for i in range(len(events)):
+                    views["ptH"][0], views["etaH"][0], views["mH"][0], views["weight"][0] = pt[i], eta[i], mass[i], batch.weight[i]
+                    if nweights:
+                        views["weights"][:] = weights[i]
+                    writer.fill()
+                seconds["write"] += clock() - start
+
+    if writer is not None:
+        start = clock()
+        writer.close()
+        seconds["write"] += clock() - start
+    return nevents, collections.OrderedDict((stage, t) for stage, t in seconds.items() if stage not in skipped), skipped
+
+
+def measure_mela_stages(filename, topology):
+    """Times reading an LHE file with its LHEFile_* class, setInputEvent and a MELA call for every event.
+    This needs ROOT and MELA.
+
+    Parameters
+    ----------
+    filename : str
+        The LHE file
+    topology : str
+        Its topology, one of synthetic_lhe.TOPOLOGIES
+
+    Returns
+    -------
+    Tuple[int, dict]
+        The number of events and the seconds spent in each of MELA_STAGES
+    """
+    import lhefile
+    from mela import TVar
+
+    function, process = MELA_CALLS[topology]
+    arguments = (getattr(TVar, process),) if process is not None else ()
+    seconds = collections.OrderedDict((stage, 0.) for stage in MELA_STAGES)
+    clock = time.perf_counter
+    nevents = 0
+    with getattr(lhefile, synthetic_lhe.TOPOLOGIES[topology].lhefileclass)(filename) as f:
+        events = iter(f)
+        while True:
+            start = clock()
+            try:
+                event = next(events)
+            except StopIteration:
+                break
+            event.particles
+            seconds["lhefile"] += clock() - start
+            nevents += 1
+
+            start = clock()
+            event.setupmelainput()
+            seconds["setInputEvent"] += clock() - start
+
+            if function is not None:
+                start = clock()
+                getattr(event, function)(*arguments)
+                seconds["mela"] += clock() - start
+    if function is None:
+        del seconds["mela"]
+    return nevents, seconds
+
+
+def run_case(case):
+    """Generates the file for one benchmark case and measures it.  This runs in its own process, so that the peak memory is the case's own.
+
+    Parameters
+    ----------
+    case : dict
+        topology, nevents, nweights, seed, batchsize, format, mela and workdir
+
+    Returns
+    -------
+    dict
+        The results, see main
+    """
+    filename = os.path.join(case["workdir"], "{}_{}.lhe".format(case["topology"], case["nweights"]))
+    start = time.perf_counter()
+    filebytes = synthetic_lhe.write_lhe_file(filename, case["topology"], case["nevents"], case["nweights"], case["seed"])
+    generateseconds = time.perf_counter() - start
+
+    outputfile = os.path.splitext(filename)[0] + {"root": ".root", "uproot": ".root", "parquet": ".parquet", "arrow": ".arrow", "hdf5": ".h5"}.get(case["format"], "")
+    nevents, seconds, skipped = measure_stages(filename, case["topology"], case["nweights"], case["batchsize"], case["format"], outputfile)
+    if case["mela"]:
+        _, melaseconds = measure_mela_stages(filename, case["topology"])
+        seconds.update(melaseconds)
+    else:
+        skipped.update((stage, "MELA is not available") for stage in MELA_STAGES)
+
+    return collections.OrderedDict((
+        ("topology", case["topology"]),
+        ("rwgt", bool(case["nweights"])),
+        ("nweights", case["nweights"]),
+        ("events", nevents),
+        ("file_bytes", filebytes),
+        ("generate_seconds", generateseconds),
+        ("stages", collections.OrderedDict(
+            (stage, {"seconds": t, "events_per_second": nevents / t if t else None}) for stage, t in seconds.items()
+        )),
+        ("skipped", skipped),
+        ("peak_memory_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT),
+    ))
+
+
+def environment():
+    """What the results depend on besides the code: the versions and the machine"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return collections.OrderedDict((
+        ("commit", commit),
+        ("python", platform.python_version()),
+        ("numpy", np.__version__),
+        ("platform", platform.platform()),
+        ("processor", platform.processor() or platform.machine()),
+        ("cpus", os.cpu_count()),
+    ))
+
+
+def compare(results, previous):
+    """Lines comparing the events per second of each stage with an earlier run
+
+    Parameters
+    ----------
+    results : dict
+        The results of this run
+    previous : dict
+        The results of the earlier run, in the same format
+
+    Returns
+    -------
+    list[str]
+        One line per stage that both runs measured, with the ratio (above 1 is faster now)
+    """
+    before = {(case["topology"], case["rwgt"]): case["stages"] for case in previous["results"]}
+    lines = []
+    for case in results["results"]:
+        stages = before.get((case["topology"], case["rwgt"]), {})
+        for stage, result in case["stages"].items():
+            if stage in stages and stages[stage]["events_per_second"] and result["events_per_second"]:
+                lines.append("{:15} {:5} {:15} {:6.2f}x".format(
+                    case["topology"], "rwgt" if case["rwgt"] else "", stage, result["events_per_second"] / stages[stage]["events_per_second"]
+                ))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reading, classifying, computing kinematics and writing synthetic LHE files of every topology")
+    parser.add_argument("--events", type=int, default=DEFAULT_EVENTS, help="events per file")
+    parser.add_argument("--topologies", default=",".join(synthetic_lhe.TOPOLOGIES), help="comma separated, from " + ", ".join(synthetic_lhe.TOPOLOGIES))
+    parser.add_argument("--rwgt", choices=("both", "with", "without"), default="both", help="files with <rwgt> blocks, without, or both")
+    parser.add_argument("--weights", type=int, default=DEFAULT_WEIGHTS, help="reweighting weights per event in the files with <rwgt> blocks")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCHSIZE)
+    parser.add_argument("--format", choices=lhe_output.BACKENDS, help="output format for the write stage, by default the first one that is installed")
+    parser.add_argument("--no-mela", action="store_true", help="skip the MELA stages even if MELA is available")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="where the LHE and output files go, by default a temporary directory that is removed afterwards")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="PREVIOUS.json", help="compare the events per second with an earlier --output")
+    args = parser.parse_args()
+
+    topologies = [_.strip() for _ in args.topologies.split(",") if _.strip()]
+    for topology in topologies:
+        if topology not in synthetic_lhe.TOPOLOGIES:
+            raise ValueError("Unknown topology {}, choose from {}".format(topology, ", ".join(synthetic_lhe.TOPOLOGIES)))
+    nweights = {"both": (0, args.weights), "with": (args.weights,), "without": (0,)}[args.rwgt]
+    outputformat = args.format or default_format()
+    mela = not args.no_mela and _available("ROOT") and _available("mela")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="lhe2root_benchmark_")
+    try:
+        results = collections.OrderedDict((
+            ("environment", environment()),
+            ("settings", collections.OrderedDict((
+                ("events", args.events), ("batch_size", args.batch_size), ("format", outputformat), ("mela", mela), ("seed", args.seed),
+            ))),
+            ("results", []),
+        ))
+        #a fresh process for every case, so that each one's peak memory is its own
+        context = multiprocessing.get_context("spawn")
+        for topology in topologies:
+            for n in nweights:
+                case = {
+                    "topology": topology, "nevents": args.events, "nweights": n, "seed": args.seed,
+                    "batchsize": args.batch_size, "format": outputformat, "mela": mela, "workdir": workdir,
+                }
+                with context.Pool(1, maxtasksperchild=1) as pool:
+                    result = pool.apply(run_case, (case,))
+                results["results"].append(result)
+                print("{:15} {:5} {:6.1f} MB peak, ".format(topology, "rwgt" if n else "", result["peak_memory_bytes"] / 1e6) + ", ".join(
+                    "{} {:.0f}/s".format(stage, _["events_per_second"]) for stage, _ in result["stages"].items() if _["events_per_second"]
+                ), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(results, json.load(f)):
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import collections
+import gzip
+
+import numpy as np
+
+import lhe_kinematics
+
+#Particle masses used in the synthetic events, in GeV
+HIGGS_MASS = 125.
+Z_MASS = 91.1876
+W_MASS = 80.379
+TOP_MASS = 173.
+BOTTOM_MASS = 4.7
+BEAM_ENERGY = 6500.
+
+#One particle line of an event: the id, the status, the (1-based) mothers and the four-momentum (px, py, pz, E)
+Particle = collections.namedtuple("Particle", "id status mother1 mother2 momentum")
+
+#A synthetic topology.
+#  lhefileclass: the name of the lhefile.LHEFile_* class that reads it
+#  classificationrule: the name of the lhe_classification rule that sorts its particles
+#  ncategories: the number of daughters, associated particles and mothers that the rule finds in every event,
+#               None for counts that change from event to event (i.e. an optional photon)
+#  generate: a function of a numpy.random.Generator that returns the particles of one event
+Topology = collections.namedtuple("Topology", "lhefileclass classificationrule ncategories generate")
+
+
+def _boost(momenta, parent):
+    """Boosts four-vectors from the rest frame of parent to the frame parent is given in"""
+    beta = parent[:3] / parent[3]
+    beta2 = beta @ beta
+    if not beta2:
+        return momenta
+    gamma = 1 / np.sqrt(1 - beta2)
+    betap = momenta[..., :3] @ beta
+    spatial = momenta[..., :3] + ((gamma - 1) * betap / beta2 + gamma * momenta[..., 3])[..., None] * beta
+    energy = gamma * (momenta[..., 3] + betap)
+    return np.concatenate((spatial, energy[..., None]), axis=-1)
+
+
+def _twobody(rng, parent, m1, m2):
+    """Decays parent isotropically into two particles with masses m1 and m2"""
+    mass = lhe_kinematics.mass(parent)
+    p = np.sqrt(max((mass**2 - (m1 + m2)**2) * (mass**2 - (m1 - m2)**2), 0)) / (2 * mass)
+    costheta, phi = rng.uniform(-1, 1), rng.uniform(-np.pi, np.pi)
+    sintheta = np.sqrt(1 - costheta**2)
+    direction = np.array((sintheta * np.cos(phi), sintheta * np.sin(phi), costheta))
+    rest = np.array((
+        np.append(p * direction, np.hypot(p, m1)),
+        np.append(-p * direction, np.hypot(p, m2)),
+    ))
+    return _boost(rest, parent)
+
+
+def _production(rng, masses):
+    """Four-vectors of two incoming massless partons along the beam and outgoing particles with the given masses,
+    with random pt and rapidity, balanced in the transverse plane"""
+    outgoing = np.zeros((len(masses), 4))
+    for i, mass in enumerate(masses):
+        pt, eta, phi = rng.exponential(40.), rng.uniform(-2.5, 2.5), rng.uniform(-np.pi, np.pi)
+        outgoing[i, :3] = pt * np.cos(phi), pt * np.sin(phi), pt * np.sinh(eta)
+    outgoing[-1, :2] -= outgoing[:, :2].sum(axis=0)
+    outgoing[:, 3] = np.sqrt((outgoing[:, :3]**2).sum(axis=1) + np.asarray(masses)**2)
+    energy, pz = outgoing[:, 3].sum(), outgoing[:, 2].sum()
+    incoming = np.array(((0, 0, (energy + pz) / 2, (energy + pz) / 2), (0, 0, -(energy - pz) / 2, (energy - pz) / 2)))
+    return incoming, outgoing
+
+
+def _leptonpair(rng):
+    flavor = rng.choice((11, 13))
+    return flavor, -flavor
+
+
+def _zstar(rng, higgs):
+    """Masses of the Z and Z* in H -> ZZ*"""
+    return Z_MASS, rng.uniform(12., min(lhe_kinematics.mass(higgs) - Z_MASS, 60.))
+
+
+def _hzz4l(rng, higgs, higgsindex, first, status=1):
+    """The Z bosons (from position first on, 1-based) and leptons of H -> ZZ -> 4l"""
+    zmasses = _zstar(rng, higgs) if lhe_kinematics.mass(higgs) < 2 * Z_MASS else (Z_MASS, Z_MASS)
+    z1, z2 = _twobody(rng, higgs, *zmasses)
+    particles = [Particle(23, 2, higgsindex, higgsindex, z1), Particle(23, 2, higgsindex, higgsindex, z2)]
+    for zindex, z in zip((first, first + 1), (z1, z2)):
+        l1, l2 = _leptonpair(rng)
+        p1, p2 = _twobody(rng, z, 0, 0)
+        particles += [Particle(l1, status, zindex, zindex, p1), Particle(l2, status, zindex, zindex, p2)]
+    return particles
+
+
+def _hwithdecay(rng):
+    incoming, (higgs,) = _production(rng, (HIGGS_MASS,))
+    particles = [Particle(21, -1, 0, 0, incoming[0]), Particle(21, -1, 0, 0, incoming[1]), Particle(25, 2, 1, 2, higgs)]
+    return particles + _hzz4l(rng, higgs, 3, 4)
+
+
+def _hwithdecayonly(rng):
+    _, (higgs,) = _production(rng, (HIGGS_MASS,))
+    particles = [Particle(25, 2, 0, 0, higgs)] + _hzz4l(rng, higgs, 1, 2)
+    if rng.uniform() < 0.2:
+        #final state radiation, collinear with one of the leptons
+        i = rng.integers(3, len(particles))
+        fraction = rng.uniform(0.01, 0.2)
+        lepton = particles[i]
+        particles[i] = lepton._replace(momentum=lepton.momentum * (1 - fraction))
+        particles.append(Particle(22, 1, lepton.mother1, lepton.mother2, lepton.momentum * fraction))
+    return particles
+
+
+def _stablehiggs(rng):
+    incoming, (higgs, jet1, jet2) = _production(rng, (HIGGS_MASS, 0, 0))
+    return [
+        Particle(2, -1, 0, 0, incoming[0]), Particle(1, -1, 0, 0, incoming[1]),
+        Particle(25, 1, 1, 2, higgs), Particle(2, 1, 1, 2, jet1), Particle(1, 1, 1, 2, jet2),
+    ]
+
+
+def _vdecay(rng):
+    """The decay products of the Z in ZH, leptons or quarks"""
+    if rng.uniform() < 0.5:
+        return _leptonpair(rng)
+    flavor = int(rng.integers(1, 6))
+    return flavor, -flavor
+
+
+def _vh(rng):
+    incoming, (z, higgs) = _production(rng, (Z_MASS, HIGGS_MASS))
+    f1, f2 = _vdecay(rng)
+    p1, p2 = _twobody(rng, z, 0, 0)
+    return [
+        Particle(2, -1, 0, 0, incoming[0]), Particle(-2, -1, 0, 0, incoming[1]),
+        Particle(23, 2, 1, 2, z), Particle(25, 1, 1, 2, higgs),
+        Particle(f1, 1, 3, 3, p1), Particle(f2, 1, 3, 3, p2),
+    ]
+
+
+def _vhwithdecay(rng):
+    particles = _vh(rng)
+    higgs = particles[3] = particles[3]._replace(status=2)
+    return particles + _hzz4l(rng, higgs.momentum, 4, 7)
+
+
+def _zhhawk(rng):
+    incoming, (higgs, zstar) = _production(rng, (HIGGS_MASS, Z_MASS))
+    l1, l2 = _leptonpair(rng)
+    p1, p2 = _twobody(rng, zstar, 0, 0)
+    particles = [
+        Particle(2, -1, 0, 0, incoming[0]), Particle(-2, -1, 0, 0, incoming[1]),
+        Particle(25, 1, 1, 2, higgs), Particle(l1, 1, 1, 2, p1), Particle(l2, 1, 1, 2, p2),
+    ]
+    if rng.uniform() < 0.3:
+        fraction = rng.uniform(0.01, 0.2)
+        particles[3] = particles[3]._replace(momentum=p1 * (1 - fraction))
+        particles.append(Particle(22, 1, 1, 2, p1 * fraction))
+    return particles
+
+
+def _tth(rng):
+    incoming, (higgs, top, antitop) = _production(rng, (HIGGS_MASS, TOP_MASS, TOP_MASS))
+    particles = [
+        Particle(21, -1, 0, 0, incoming[0]), Particle(21, -1, 0, 0, incoming[1]),
+        Particle(25, 1, 1, 2, higgs), Particle(6, 2, 1, 2, top), Particle(-6, 2, 1, 2, antitop),
+    ]
+    quarks = []
+    for topindex, sign, t in ((4, 1, top), (5, -1, antitop)):
+        w, b = _twobody(rng, t, W_MASS, BOTTOM_MASS)
+        particles += [Particle(24 * sign, 2, topindex, topindex, w), Particle(5 * sign, 1, topindex, topindex, b)]
+        q1, q2 = _twobody(rng, w, 0, 0)
+        quarks.append((len(particles) - 1, sign, q1, q2))
+    for windex, sign, q1, q2 in quarks:
+        particles += [Particle(2 * sign, 1, windex, windex, q1), Particle(-1 * sign, 1, windex, windex, q2)]
+    return particles
+
+
+def _offshell4l(rng):
+    mass = rng.uniform(200., 800.)
+    incoming, (system,) = _production(rng, (mass,))
+    particles = [Particle(21, -1, 0, 0, incoming[0]), Particle(21, -1, 0, 0, incoming[1])]
+    for z in _twobody(rng, system, Z_MASS, Z_MASS):
+        l1, l2 = _leptonpair(rng)
+        p1, p2 = _twobody(rng, z, 0, 0)
+        particles += [Particle(l1, 1, 1, 2, p1), Particle(l2, 1, 1, 2, p2)]
+    return particles
+
+
+TOPOLOGIES = collections.OrderedDict((
+    ("Hwithdecay", Topology("LHEFile_Hwithdecay", "HWITHDECAY", (4, 0, 2), _hwithdecay)),
+    ("HwithdecayOnly", Topology("LHEFile_HwithdecayOnly", "HWITHDECAYONLY", None, _hwithdecayonly)),
+    ("StableHiggs", Topology("LHEFile_JHUGenVBFVH", "STABLEHIGGS", (1, 2, 2), _stablehiggs)),
+    ("VH", Topology("LHEFile_StableHiggsVH", "STABLEHIGGSVH", (1, 2, 2), _vh)),
+    ("VHwithdecay", Topology("LHEFile_VHHiggsdecay", "VHHIGGSDECAY", (4, 2, 2), _vhwithdecay)),
+    ("ZHHAWK", Topology("LHEFile_StableHiggsZHHAWK", "STABLEHIGGSZHHAWK", None, _zhhawk)),
+    ("ttH", Topology("LHEFile_JHUGenttH", "STABLEHIGGS", (1, 6, 2), _tth)),
+    ("Offshell4l", Topology("LHEFile_Offshell4l", "OFFSHELL4L", (4, 0, 2), _offshell4l)),
+))
+
+
+def weight_ids(nweights):
+    """The ids of the synthetic reweighting weights"""
+    return ["rwgt_{}".format(i) for i in range(1, nweights + 1)]
+
+
+def header(nweights=0, crosssection=1., error=0.01):
+    """Everything before the first event: the header with the generator tags and <initrwgt>, and the <init> block"""
+    lines = [
+        '<LesHouchesEvents version="3.0">',
+        "<header>",
+        '<generator name="lhe2root-synthetic" version="1.0">benchmarks.synthetic_lhe</generator>',
+    ]
+    if nweights:
+        lines.append("<initrwgt>")
+        lines.append("<weightgroup name='synthetic' combine='none'>")
+        lines += ["<weight id='{0}'> synthetic weight {0} </weight>".format(weightid) for weightid in weight_ids(nweights)]
+        lines.append("</weightgroup>")
+        lines.append("</initrwgt>")
+    lines += [
+        "</header>",
+        "<init>",
+        " 2212 2212 {0:.8E} {0:.8E} 0 0 263000 263000 3 1".format(BEAM_ENERGY),
+        " {:.8E} {:.8E} {:.8E} 1".format(crosssection, error, 1.),
+        "</init>",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def format_event(particles, weight=1., weights=None, scale=HIGGS_MASS):
+    """The text of one <event> block
+
+    Parameters
+    ----------
+    particles : list[Particle]
+        The particles, in order
+    weight : float, optional
+        The event weight, by default 1
+    weights : list[float], optional
+        The reweighting weights, written in an <rwgt> block with the ids from weight_ids, by default None (no <rwgt> block)
+    scale : float, optional
+        The scale, by default HIGGS_MASS
+
+    Returns
+    -------
+    str
+        Everything from <event> to </event>, with a newline at the end
+    """
+    lines = ["<event>", "{:3d} {:6d} {:+.10E} {:.8E} {:.8E} {:.8E}".format(len(particles), 1, weight, scale, 0.0078125, 0.118)]
+    for particle in particles:
+        color = (501, 0) if 0 < particle.id <= 6 else (0, 501) if -6 <= particle.id < 0 else (0, 0)
+        lines.append("{:9d} {:2d} {:4d} {:4d} {:4d} {:4d} {:+.10E} {:+.10E} {:+.10E} {:.10E} {:.10E} 0.0000E+00 9.0000E+00".format(
+            particle.id, particle.status, particle.mother1, particle.mother2, color[0], color[1],
+            *particle.momentum, lhe_kinematics.mass(particle.momentum),
+        ))
+    if weights is not None:
+        lines.append("<rwgt>")
+        lines += ["<wgt id='{}'> {:+.7E} </wgt>".format(weightid, value) for weightid, value in zip(weight_ids(len(weights)), weights)]
+        lines.append("</rwgt>")
+    lines.append("</event>")
+    return "\n".join(lines) + "\n"
+
+
+def generate_events(topology, nevents, nweights=0, seed=0):
+    """Generates synthetic events
+
+    Parameters
+    ----------
+    topology : str
+        One of TOPOLOGIES
+    nevents : int
+        The number of events
+    nweights : int, optional
+        The number of reweighting weights in each event, by default 0 (no <rwgt> blocks)
+    seed : int, optional
+        The random seed, by default 0, so that the same arguments give the same events
+
+    Yields
+    ------
+    str
+        The text of each event
+    """
+    generate = TOPOLOGIES[topology].generate
+    rng = np.random.default_rng(seed)
+    for _ in range(nevents):
+        weight = rng.uniform(0.5, 1.5)
+        weights = (weight * rng.uniform(0.5, 1.5, nweights)).tolist() if nweights else None
+        yield format_event(generate(rng), weight, weights)
+
+
+def write_lhe_file(filename, topology, nevents, nweights=0, seed=0):
+    """Writes a synthetic LHE file, compressed with gzip if filename ends with .gz
+
+    Parameters
+    ----------
+    filename : str
+        The file to write
+    topology : str
+        One of TOPOLOGIES
+    nevents : int
+        The number of events
+    nweights : int, optional
+        The number of reweighting weights in each event, declared in <initrwgt>, by default 0
+    seed : int, optional
+        The random seed, by default 0
+
+    Returns
+    -------
+    int
+        The size of the file in bytes
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "wt") as f:
+        f.write(header(nweights))
+        for event in generate_events(topology, nevents, nweights, seed):
+            f.write(event)
+        f.write("</LesHouchesEvents>\n")
+    with open(filename, "rb") as f:
+        return f.seek(0, 2)
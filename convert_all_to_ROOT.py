@@ -1,4 +1,5 @@
 import os
+import sys
 import argparse
 import lhe_constants
 import lhe2root_methods
@@ -33,7 +34,12 @@ if __name__ == '__main__':
     parser.add_argument('-w', '--write', default="CrossSections.csv",
                         help='Option to write out cross sections to the file named here. Enter "" if you do not want a file written.')
 
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="The number of files to convert at the same time (largest files are started first)")
+
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
     
     current_directory = args.currentDirectory
     exceptions = set(args.exceptions).union(exceptions)
@@ -41,5 +47,9 @@ if __name__ == '__main__':
     if not lhe2root_methods.check_for_MELA():
         raise FileNotFoundError("MELA path not found!")
     
-    file_cross_sections = lhe2root_methods.recursively_convert(current_directory, args.output, args.argument, verbose=args.verbose, 
-                                                                exceptions=exceptions, write=args.write)
\ No newline at end of file
+    try:
+        file_cross_sections = lhe2root_methods.recursively_convert(current_directory, args.output, args.argument, verbose=args.verbose, 
+                                                                    exceptions=exceptions, write=args.write, workers=args.workers)
+    except RuntimeError as e:
+        lhe_constants.print_msg_box(str(e), title="Conversion summary")
+        sys.exit(1)
\ No newline at end of file
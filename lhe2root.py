@@ -1,8 +1,651 @@
 #!/usr/bin/env python
-import abc
 import collections
-import re
-import argparse, os
+import argparse, fnmatch, json, os, signal
+import multiprocessing
+import numpy as np
+
+import ROOT
+
+import lhe_classification
+import lhe_constants
+import lhe_hypotheses
+import lhe_kinematics
+import lhe_melacache
+import lhe_modes
+import lhe_output
+import lhe_profile
+import lhe_timing
+import lhefile_methods
+from mela import Mela, SimpleParticle_t, TVar
+from pythonmelautils import MultiDimensionalCppArray, SelfDParameter, SelfDCoupling
+
+
+def tlvfromptetaphim(pt, eta, phi, m):
+  result = ROOT.TLorentzVector()
+  result.SetPtEtaPhiM(pt, eta, phi, m)
+  return result
+
+
+BRANCHNAMES_PROBABILITIES = ("pg1", "pg4","pg2","pg1g2","pg1g4","pg2za","pg4za","pg1g2za","pg1g4za","pg2aa","pg4aa","pg1g2aa","pg1g4aa","D0minus","D0hplus", "DCP", "Dint","D0minus_za","D0hplus_za","Dint_za","DCP_za")
+BRANCHNAMES_DAUGHTERS = "LHEDaughterId","LHEDaughterPt","LHEDaughterEta","LHEDaughterPhi","LHEDaughterMass"
+BRANCHNAMES_ASSOCIATED = "LHEAssociatedParticleId","LHEAssociatedParticlePt","LHEAssociatedParticleEta","LHEAssociatedParticlePhi","LHEAssociatedParticleMass"
+BRANCHNAMES_MOTHERS = "LHEMotherId","LHEMotherPz","LHEMotherE"
+MELACALC = "MELAcalc" #the group of LHEDaughter*, LHEAssociatedParticle* and LHEMother* branches in fillkinematics
+
+def convert(args, outputfile, shard):
+  """
+  Convert the events in shard, a list of (inputfile, start, stop) event ranges with start = stop = None
+  meaning the whole file, into the tree called "tree" in outputfile
+  """
+  checkpointfile = checkpointfilename(outputfile)
+  checkpoint = None
+  if args.resume and os.path.exists(checkpointfile):
+    with open(checkpointfile) as f:
+      checkpoint = json.load(f)
+    if checkpoint["shard"] != [list(_) for _ in shard]:
+      raise ValueError(checkpointfile+" is for different input events, can't resume")
+    if checkpoint["done"]:
+      print(outputfile, "is already finished")
+      return None
+
+  resuming = checkpoint is not None
+
+  mode = lhe_modes.selected_mode(args)
+
+  weightids = None
+  if mode.readweights:
+    weightids = sorted(lhefile_methods.get_weight_ids(shard[0][0])) if shard else [] #sorted by id, the column order of older outputs
+  columns = outputcolumns(args, mode, len(weightids or ()))
+  #with --branches, --drop-branches and --add-to, only some of the branches are written, and only the work they need is done
+  wanted = selectbranches(args, columns)
+  plan = buildworkplan(args, mode, wanted)
+  written = wanted if wanted is not None else {name for name, _, _ in columns}
+
+  #scratch columns, which aren't written: the four-vectors that fillkinematics computes the kinematic branches from
+  columns += [("_pH", "f8", (4,)), ("_daughters", "f8", (4, 4)), ("_jets", "f8", (2, 4)), ("_LHEAssociated", "f8", (2, 4)), ("_LHEDaughters", "f8", (4, 4))]
+
+  writer = lhe_output.open_writer(args.format, outputfile, columns, written, args.chunk_size, metadata=outputmetadata(args), resume=resuming)
+  writer.prepare = lambda chunk: fillkinematics(plan.kinematics, chunk)
+  #the values of each event are set in these arrays, which are views into the writer's buffer
+  branches = writer.views()
+
+  remaining = shard
+  if resuming:
+    remaining = skipevents(shard, writer.entries)
+    print("Resuming {} after {} entries (last checkpoint: {} event {}, {} bytes read)".format(outputfile, writer.entries, checkpoint["inputfile"], checkpoint["event"], checkpoint["offset"]))
+
+  cache = lhe_melacache.MelaCache(args.mela_cache, args.mela_cache_entries) if args.mela_cache else None
+  #with --timing, every stage of the event loop is timed; without it, timer is None and nothing is timed
+  timer = None
+  if args.timing:
+    nevents = knowneventcount(remaining)
+    timer = lhe_timing.StageTimer(nevents, args.progress_every, label=os.path.basename(outputfile) if args.jobs > 1 else "")
+  #the steps that every event goes through, chosen once here from the mode and the work plan
+  steps = buildpipeline(mode, plan, branches, cache, timer)
+  state = {"process": getattr(TVar, mode.process) if isinstance(mode.process, str) else None, "eventkey": None}
+
+  #checkpoints are only written for formats that can be resumed from them (see lhe_output.OutputWriter.supportsresume),
+  #the others are deleted on failure as there is nothing to continue from
+  checkpointing = writer.supportsresume
+  #SIGTERM (i.e. from the batch system) stops the conversion after the current event and saves a checkpoint
+  terminated = []
+  if checkpointing:
+    previoussigtermhandler = signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+
+  #with --profile, the events in the --profile-events window are profiled as they are read, see lhe_profile
+  profiler = None
+  if args.profile:
+    profiler = lhe_profile.EventWindowProfiler(args.profile, *args.profile_events, sampling=args.profile_sampling, interval=args.profile_interval)
+
+  try:
+    if timer is not None:
+      timer.start()
+    for inputfile, start, stop in remaining:
+      print(inputfile)
+      photonmerger = mode.photonmerger(args) if mode.photonmerger is not None else None
+      if photonmerger is not None:
+        print ("Algorithm will automaticaly merge associated FSR photons to the leptons")
+    
+      with mode.lhefileclass(inputfile,isgen=args.use_flavor,photonmerger=photonmerger,profiler=profiler)  as f:
+        if mode.readweights:
+          if sorted(f.weightids) != weightids: raise ValueError(inputfile+" has different weights from "+shard[0][0])
+          f.weightids = weightids
+        for i, event in enumerate(f if start is None else f.islice(start, stop)):
+          if timer is not None:
+            timer.lap("parse")
+          for step in steps:
+            step(event, state)
+          if timer is not None:
+            timer.mark()
+          writer.fill()
+          if checkpointing and (terminated or args.checkpoint_every and writer.entries % args.checkpoint_every == 0):
+            nextevent = (start or 0) + i + 1
+            writer.checkpoint()
+            writecheckpoint(checkpointfile, shard, writer.entries, inputfile, nextevent, f.tell())
+            if terminated:
+              writer.close()
+              raise ConversionInterrupted("Stopped by SIGTERM after {} entries, run again with --resume to continue".format(writer.entries))
+          if timer is not None:
+            #fill includes writing the chunks, the kinematic branches computed for each chunk, and the checkpoints
+            timer.lap("fill")
+            timer.event()
+        # print("Processed", i+1, "events")
+  finally:
+    if checkpointing:
+      signal.signal(signal.SIGTERM, previoussigtermhandler)
+    if profiler is not None:
+      profiler.close()
+    #the results computed so far are kept even if the conversion fails or is stopped
+    if cache is not None:
+      cache.close()
+
+  if profiler is not None:
+    for line in profiler.report():
+      print(line)
+    print("Profile written to", args.profile)
+  writer.close()
+  if checkpointing:
+    writecheckpoint(checkpointfile, shard, None, None, None, None, done=True)
+  if cache is not None:
+    print(cache.summary())
+  if timer is not None:
+    timer.finish()
+  return timer
+
+
+def outputcolumns(args, mode, nweights=0):
+  """
+  (name, type, shape) of every output column for the mode and options, each name once.  nweights is the size of the weights array.
+  """
+  branchnames_float = "costheta1", "costheta2", "Phi1", "costhetastar", "Phi", "HJJpz","M4L","MZ1","MZ2","costheta1d","costheta2d","Phid","costhetastard","Phi1d"
+  if args.calc_prodprob or args.calc_decayprob :
+    branchnames_float += BRANCHNAMES_PROBABILITIES
+  branchnames_float += mode.branches
+  branchnames_float += (
+    
+    "ptH", "pxH",  "pyH",  "pzH",  "EH","rapH","rapHJJ","decayMode","qfl1","qfl2","qfl1mom","qfl2mom",
+    "pxj1", "pyj1", "pzj1", "Ej1",
+    "pxj2", "pyj2", "pzj2", "Ej2",
+    "pxph1","pyph1","pzph1","Eph1",
+    "weight",
+    "ptdau1","pxdau1","pydau1","pzdau1","Edau1","flavdau1", 
+    "ptdau2","pxdau2","pydau2","pzdau2","Edau2","flavdau2",
+    "ptdau3","pxdau3","pydau3","pzdau3","Edau3","flavdau3",
+    "ptdau4","pxdau4","pydau4","pzdau4","Edau4","flavdau4",
+    
+  )
+
+  branchnames_int = ()
+
+  columns = [(name, "f4", ()) for name in dict.fromkeys(branchnames_float)]
+  columns += [(name, "i4", ()) for name in branchnames_int]
+  if mode.readweights:
+    columns += [("weights", "f4", (nweights,))]
+  if args.MELAcalc:
+    columns += [(name, "f4", (4,)) for name in BRANCHNAMES_DAUGHTERS]
+    columns += [(name, "f4", (2,)) for name in BRANCHNAMES_ASSOCIATED]
+    columns += [(name, "f4", (2,)) for name in BRANCHNAMES_MOTHERS]
+  return columns
+
+def matchbranches(names, globs, option):
+  """
+  The names that match any of globs, a comma separated string of shell-style patterns
+  """
+  matched = set()
+  for glob in globs.split(","):
+    glob = glob.strip()
+    if not glob: continue
+    matches = fnmatch.filter(names, glob)
+    if not matches: raise ValueError("{} {} doesn't match any branch".format(option, glob))
+    matched.update(matches)
+  return matched
+
+def selectbranches(args, columns):
+  """
+  The set of branches that are written, from --branches, --drop-branches and --add-to, or None if it is all of them
+  """
+  names = [name for name, _, _ in columns]
+  selected = set(names)
+  if args.branches:
+    selected = matchbranches(names, args.branches, "--branches")
+  if args.drop_branches:
+    selected -= matchbranches(names, args.drop_branches, "--drop-branches")
+  if args.add_to:
+    existingbranchnames, _ = readexistingtree(args.add_to)
+    selected -= existingbranchnames
+    if not selected: raise ValueError(args.add_to+" already has all of the selected branches")
+  if not selected: raise ValueError("No branches are selected")
+  return None if len(selected) == len(names) else selected
+
+#What convert computes for each event, see buildworkplan
+#  wanted: the branches that are written, None for all of them
+#  angles: the lhe_modes.Angles that are computed
+#  decayplan, prodplan: the lhe_hypotheses.HypothesisPlans for the decay and production probabilities, or None
+#  discriminants: the lhe_hypotheses.DISCRIMINANTS computed after each plan
+#  kinematics: the groups of kinematic branches, see fillkinematics
+#  weights: whether the weight (or the weights array) is read
+WorkPlan = collections.namedtuple("WorkPlan", "wanted angles decayplan prodplan discriminants kinematics weights")
+
+def buildworkplan(args, mode, wanted):
+  """
+  Work out which MELA calls and kinematic calculations are needed for the wanted branches (None for all of them),
+  following the dependencies: discriminants need probabilities, interference terms need the pure terms, and rapHJJ, Dphijj and ptV need the jets
+  """
+  def needed(names): return wanted is None or not wanted.isdisjoint(names)
+
+  angles = tuple(angles for angles in mode.angles if needed(angles.names))
+
+  probabilities = BRANCHNAMES_PROBABILITIES if wanted is None else wanted
+  decayterms = lhe_hypotheses.select_terms(lhe_hypotheses.DECAY_TERMS, probabilities) if args.calc_decayprob else ()
+  productionterms = lhe_hypotheses.select_terms(lhe_hypotheses.PRODUCTION_TERMS, probabilities) if args.calc_prodprob else ()
+  decayplan = lhe_hypotheses.HypothesisPlan(decayterms, "computeP", TVar) if decayterms else None
+  prodplan = lhe_hypotheses.HypothesisPlan(productionterms, "computeProdP", TVar) if productionterms else None
+  discriminants = tuple(name for name in lhe_hypotheses.DISCRIMINANTS if needed((name,))) if decayplan or prodplan else ()
+
+  kinematics = {group for group in mode.kinematics if needed(lhe_modes.KINEMATIC_BRANCHES[group])}
+  for group in list(kinematics):
+    kinematics.update(lhe_modes.KINEMATIC_DEPENDENCIES.get(group, ()))
+  if args.MELAcalc and needed(BRANCHNAMES_DAUGHTERS + BRANCHNAMES_ASSOCIATED + BRANCHNAMES_MOTHERS):
+    kinematics.add(MELACALC)
+
+  weights = needed(("weights",) if mode.readweights else ("weight",))
+  return WorkPlan(wanted, angles, decayplan, prodplan, discriminants, frozenset(kinematics), weights)
+
+def describeworkplan(plan, mode, columns):
+  """
+  The work plan as printable lines: what is computed for every event, and what is skipped
+  """
+  lines = ["Work plan: {} of {} branches".format(len(plan.wanted) if plan.wanted is not None else len(columns), len(columns))]
+  for angles in plan.angles:
+    lines.append("  {}: {}".format(angles.function, ", ".join(angles.names)))
+  for name, hypothesisplan in ("decay probabilities", plan.decayplan), ("production probabilities", plan.prodplan):
+    if hypothesisplan is not None:
+      lines.append("  {}: {}".format(name, hypothesisplan.summary()))
+  if plan.discriminants:
+    lines.append("  discriminants: " + ", ".join(plan.discriminants))
+  if plan.kinematics:
+    lines.append("  kinematics: " + ", ".join(sorted(plan.kinematics)))
+  if plan.weights:
+    lines.append("  " + ("weights" if mode.readweights else "weight"))
+  skipped = [angles.function for angles in mode.angles if angles not in plan.angles]
+  skipped += sorted(mode.kinematics - plan.kinematics)
+  if not plan.weights:
+    skipped.append("weights" if mode.readweights else "weight")
+  if skipped:
+    lines.append("  skipped: " + ", ".join(skipped))
+  return lines
+
+def buildpipeline(mode, plan, branches, cache, timer=None):
+  """
+  Assemble the steps that convert runs on every event, step(event, state), for the mode and the work plan (see buildworkplan).
+  state["process"] is the TVar production process and state["eventkey"] the MELA cache key of the event.
+  With a lhe_timing.StageTimer, every step is timed under its name, and the MELA calls are counted.
+  """
+  steps = []
+  usesprocess = plan.prodplan is not None or any(angles.needsprocess for angles in plan.angles)
+
+  if isinstance(mode.process, tuple) and usesprocess:
+    ### Automatically detect Had or Lep associated for VH production###
+    hadronic, leptonic = (getattr(TVar, _) for _ in mode.process)
+    def detectprocess(event, state):
+      associated = event.particles[1]
+      if not associated: return
+      associated_flavor = abs(associated[-1][0])
+      if associated_flavor in lhe_classification.QUARKS:
+        state["process"] = hadronic
+      elif associated_flavor in lhe_classification.LEPTONS:
+        state["process"] = leptonic
+    steps.append(detectprocess)
+
+  if cache is not None and (plan.decayplan or plan.prodplan or plan.angles):
+    #after the photon merging, since the key is the particle content MELA sees
+    def eventkey(event, state):
+      state["eventkey"] = lhe_melacache.event_key(event.inputevent)
+    steps.append(eventkey)
+
+  if timer is not None and (plan.decayplan or plan.prodplan or plan.angles):
+    #setInputEvent otherwise happens inside the first MELA call, so this times it on its own
+    def setInputEvent(event, state):
+      event.setupmelainput()
+    steps.append(setInputEvent)
+
+  if plan.decayplan is not None:
+    # decayP works only for the process below 
+    #everytime you call a compute Prob function all the couplings
+    #are reset and have to be redefined. 
+    def decayprobabilities(event, state):
+      for name, value in evaluateplan(plan.decayplan, event, TVar.ZZINDEPENDENT, cache, state["eventkey"], timer).items():
+        branches[name][0] = value
+      filldiscriminants(branches, plan.discriminants, 2.55497301342, 1.66326995046)
+    steps.append(decayprobabilities)
+
+  if plan.prodplan is not None:
+    #the pure terms are computed once and reused for the interference terms, see lhe_hypotheses
+    constants = {TVar.Had_ZH: (0.104503154335, 0.130395173298), TVar.JJVBF: (0.297979440554, 0.271880048944), TVar.ZZGG: (2.55497301342, 1.66326995046)}
+    def productionprobabilities(event, state):
+      for name, value in evaluateplan(plan.prodplan, event, state["process"], cache, state["eventkey"], timer).items():
+        branches[name][0] = value
+      filldiscriminants(branches, plan.discriminants, *constants.get(state["process"], (1, 1)))
+    steps.append(productionprobabilities)
+
+  for angles in plan.angles:
+    def computeangles(event, state, angles=angles):
+      arguments = (state["process"],) if angles.needsprocess else ()
+      fillbranches(branches, angles.names, lambda: melacall(event, cache, state["eventkey"], angles.function, *arguments, timer=timer))
+    computeangles.__name__ = angles.function #the name its timings are reported under
+    steps.append(computeangles)
+
+  #the four-vectors go into the scratch columns, and the kinematic branches are computed from them a chunk at a time in fillkinematics.
+  #A scratch column is only set when its branches are, so that the branches keep the previous event's values otherwise.
+  kinematics = plan.kinematics
+  def fourvectors(event, state):
+    daughters, associated, mothers = event.particles
+    daughterids, daughtermomenta = lhe_kinematics.fourvectors(daughters)
+    associatedids, associatedmomenta = lhe_kinematics.fourvectors(associated)
+    branches["_pH"][:] = daughtermomenta.sum(axis=0)
+    if lhe_modes.HJJPZ in kinematics:
+      branches["HJJpz"][0] = daughtermomenta[:, lhe_kinematics.PZ].sum() + associatedmomenta[:, lhe_kinematics.PZ].sum()
+    if lhe_modes.DAUGHTERS in kinematics:
+      branches["_daughters"][:] = daughtermomenta[:4]
+      for k in range(4):
+        branches["flavdau{}".format(k+1)][0] = daughterids[k]
+    if lhe_modes.PHOTON in kinematics and len(associatedids) > 0:
+      #add FSR photon to the root file 
+      for name, value in zip(("pxph1", "pyph1", "pzph1", "Eph1"), associatedmomenta[0]):
+        branches[name][0] = value
+    if lhe_modes.JETS in kinematics:
+      branches["_jets"][:] = associatedmomenta[:2]
+  if kinematics - {MELACALC}:
+    steps.append(fourvectors)
+
+  if MELACALC in kinematics:
+    def melacalc(event, state):
+      daughters, associated, mothers = event.particles
+      if len(associated) > 0:
+        associatedids, associatedmomenta = lhe_kinematics.fourvectors(associated, 2)
+        branches["_LHEAssociated"][:] = associatedmomenta
+        branches["LHEAssociatedParticleId"][:] = associatedids
+      if len(daughters) >= 4:
+        daughterids, daughtermomenta = lhe_kinematics.fourvectors(daughters, 4)
+        branches["_LHEDaughters"][:] = daughtermomenta
+        branches["LHEDaughterId"][:] = daughterids
+      else:
+        branches["_LHEDaughters"][:] = 0
+        branches["LHEDaughterId"][:] = (11, -11, 11, -11)
+      if mothers is not None and len(mothers) >= 2:
+        motherids, mothermomenta = lhe_kinematics.fourvectors(mothers, 2)
+        branches["LHEMotherId"][:] = motherids
+        branches["LHEMotherPz"][:] = mothermomenta[:, lhe_kinematics.PZ]
+        branches["LHEMotherE"][:] = mothermomenta[:, lhe_kinematics.E]
+      else:
+        branches["LHEMotherId"][:] = 21
+        branches["LHEMotherPz"][:] = 0
+        branches["LHEMotherE"][:] = 0
+    steps.append(melacalc)
+
+  if plan.weights and mode.readweights:
+    #the weights are parsed straight into the output buffer
+    weightsbuffer = branches["weights"]
+    def weights(event, state):
+      event.readweights(weightsbuffer)
+    steps.append(weights)
+  elif plan.weights:
+    def weight(event, state):
+      branches["weight"][0] = event.weight
+    steps.append(weight)
+
+  if timer is not None:
+    steps = [timer.wrap(step.__name__, step) for step in steps]
+  return steps
+
+def filldiscriminants(branches, discriminants, c_0minus, c_0hplus):
+  """
+  Compute the discriminants (some of D0minus, D0hplus, DCP and Dint) from the probabilities in branches, with the given normalization constants
+  """
+  if "D0minus" in discriminants:
+    branches["D0minus"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0minus*c_0minus*branches["pg4"][0])
+  if "D0hplus" in discriminants:
+    branches["D0hplus"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0hplus*c_0hplus*branches["pg2"][0])
+  if "DCP" in discriminants:
+    branches["DCP"][0] = branches["pg1g4"][0] / (2 * (branches["pg1"][0] * branches["pg4"][0]) ** 0.5)
+  if "Dint" in discriminants:
+    branches["Dint"][0] = branches["pg1g2"][0] / (2 * (branches["pg1"][0] * branches["pg2"][0]) ** 0.5)
+  #branches["DCP_old"][0] = branches["pg1g4"][0] / (branches["pg1"][0] + branches["pg4"][0])
+
+class ConversionInterrupted(Exception):
+  pass
+
+def checkpointfilename(outputfile):
+  return outputfile + ".checkpoint"
+
+def timingfilename(outputfile):
+  return outputfile + ".timing.json"
+
+def writecheckpoint(checkpointfile, shard, entries, inputfile, event, offset, done=False):
+  """
+  Record how far the conversion of shard got: the number of tree entries that were autosaved,
+  and the input file, event number of the next event and how many (decompressed) bytes of the input were read.
+  Only entries is needed to resume; the rest is for people.  done=True means the output is complete.
+  """
+  checkpoint = {"shard": [list(_) for _ in shard], "entries": entries, "inputfile": inputfile, "event": event, "offset": offset, "done": done}
+  with open(checkpointfile + ".tmp", "w") as f:
+    json.dump(checkpoint, f)
+  os.replace(checkpointfile + ".tmp", checkpointfile)
+
+def skipevents(shard, nskip):
+  """
+  The (inputfile, start, stop) ranges left in shard after the first nskip events
+  """
+  remaining = []
+  for inputfile, start, stop in shard:
+    if start is None:
+      start, stop = 0, countevents([inputfile])
+    if nskip >= stop - start:
+      nskip -= stop - start
+      continue
+    remaining.append((inputfile, start + nskip, stop))
+    nskip = 0
+  return remaining
+
+def fillkinematics(kinematics, chunk):
+  """
+  Compute the kinematic branches of a chunk of events (a structured array of rows, see lhe_output) from the four-vectors
+  in its scratch columns, for all of the events at once.  kinematics is the set of groups of branches to fill, see lhe_modes.
+  """
+  pH = chunk["_pH"]
+  if lhe_modes.HIGGS in kinematics:
+    for name, component in zip(("pxH", "pyH", "pzH", "EH"), range(4)):
+      chunk[name] = pH[:, component]
+    chunk["ptH"] = lhe_kinematics.pt(pH)
+    chunk["rapH"] = lhe_kinematics.rapidity(pH)
+
+  if lhe_modes.DAUGHTERS in kinematics:
+    daughters = chunk["_daughters"]
+    for k in range(4):
+      for name, component in zip(("px", "py", "pz", "E"), range(4)):
+        chunk["{}dau{}".format(name, k+1)] = daughters[:, k, component]
+      chunk["ptdau{}".format(k+1)] = lhe_kinematics.pt(daughters[:, k])
+
+  if lhe_modes.JETS in kinematics:
+    jets = chunk["_jets"]
+    for k in range(2):
+      for name, component in zip(("px", "py", "pz", "E"), range(4)):
+        chunk["{}j{}".format(name, k+1)] = jets[:, k, component]
+    if lhe_modes.RAPHJJ in kinematics:
+      chunk["rapHJJ"] = lhe_kinematics.rapidity(pH + jets.sum(axis=1))
+    if lhe_modes.DPHIJJ in kinematics:
+      #the azimuthal angle from the subleading to the leading jet
+      leadingfirst = lhe_kinematics.pt(jets[:, 0]) > lhe_kinematics.pt(jets[:, 1])
+      chunk["Dphijj"] = np.where(leadingfirst, lhe_kinematics.deltaphi(jets[:, 0], jets[:, 1]), lhe_kinematics.deltaphi(jets[:, 1], jets[:, 0]))
+    if lhe_modes.PTV in kinematics:
+      chunk["ptV"] = lhe_kinematics.pt(jets.sum(axis=1))
+
+  if MELACALC in kinematics:
+    #the associated particle with the larger pz comes first (the ids stay in file order)
+    associated = chunk["_LHEAssociated"]
+    associated = np.where((associated[:, 0, lhe_kinematics.PZ] > associated[:, 1, lhe_kinematics.PZ])[:, None, None], associated, associated[:, ::-1])
+    for prefix, particles in ("LHEAssociatedParticle", associated), ("LHEDaughter", chunk["_LHEDaughters"]):
+      chunk[prefix+"Pt"] = lhe_kinematics.pt(particles)
+      chunk[prefix+"Eta"] = lhe_kinematics.eta(particles)
+      chunk[prefix+"Phi"] = lhe_kinematics.phi(particles)
+      chunk[prefix+"Mass"] = lhe_kinematics.mass(particles)
+
+def outputmetadata(args):
+  """
+  The key-value metadata stored with the output: the mode and options it was made with, the input files and their cross sections.
+  The values are strings (JSON for the lists), which is what every output format can store.
+  """
+  crosssections = []
+  for inputfile in args.inputfile:
+    try:
+      crosssections.append(lhefile_methods.get_cross_section(inputfile))
+    except (IOError, ValueError):
+      crosssections.append(None)
+  return {
+    "mode": ",".join(option for option in lhe_constants.lhe_2_root_options if getattr(args, option.replace("-", "_"), False)),
+    "inputfiles": json.dumps(args.inputfile),
+    "cross_sections": json.dumps(crosssections),
+  }
+
+def fillbranches(branches, names, compute):
+  """
+  Set branches[name][0] for each of names to the values returned by compute
+  """
+  values = tuple(compute())
+  if len(values) != len(names): raise ValueError("Expected {} values for {}, got {}".format(len(names), ", ".join(names), len(values)))
+  for name, value in zip(names, values):
+    branches[name][0] = value
+
+def readexistingtree(filename):
+  """
+  The set of branch names and the number of entries of the tree in an existing lhe2root.py output
+  """
+  f = ROOT.TFile.Open(filename)
+  if not f or f.IsZombie(): raise IOError("Couldn't open "+filename)
+  try:
+    t = f.Get("tree")
+    if not t: raise IOError(filename+" doesn't have a tree called tree")
+    return {branch.GetName() for branch in t.GetListOfBranches()}, t.GetEntries()
+  finally:
+    f.Close()
+
+def countevents(inputfiles):
+  """
+  The total number of events in inputfiles, from their .lheidx event indices if they have them, otherwise by streaming the files
+  """
+  return sum(lhefile_methods.count_events(inputfile) for inputfile in inputfiles)
+
+def knowneventcount(shard):
+  """
+  The number of events in shard if it is known without reading the input files, from the event ranges
+  or from up to date .lheidx event indices, otherwise None
+  """
+  nevents = 0
+  for inputfile, start, stop in shard:
+    if start is not None:
+      nevents += stop - start
+      continue
+    count = lhefile_methods.count_events(inputfile, stream=False)
+    if count is None: return None
+    nevents += count
+  return nevents
+
+def melacall(event, cache, eventkey, function, *arguments, timer=None):
+  """
+  Call a MELA function on event, going through the MELA result cache if there is one.
+  With a lhe_timing.StageTimer, the calls that actually reach MELA are counted.
+  """
+  def call():
+    if timer is not None: timer.countmela(function)
+    return getattr(event, function)(*arguments)
+  if cache is None: return call()
+  return cache.lookup(eventkey, (function,) + tuple(int(_) for _ in arguments), call)
+
+def evaluateplan(plan, event, process, cache, eventkey, timer=None):
+  """
+  HypothesisPlan.evaluate, going through the MELA result cache if there is one.
+  Each MELA call is cached on its own, by hypothesis, couplings and process, so that a run with different terms
+  only calls MELA for the configurations it hasn't seen.  The interference terms are combined after the lookups.
+  With a lhe_timing.StageTimer, the MELA calls that are actually made are counted for each hypothesis.
+  """
+  def call(i):
+    if timer is not None: timer.countmela(plan.calllabels[i])
+    return plan.call(event, process, plan.configurations[i])
+  results = []
+  for i, (hypothesis, couplings) in enumerate(plan.configurations):
+    if cache is None:
+      results.append(call(i))
+    else:
+      results.append(cache.lookup(eventkey, (plan.compute, int(plan.matrixelement), int(hypothesis), couplings, int(process)), lambda: call(i)))
+  return plan.combine(results)
+
+def splitinputs(inputfiles, njobs):
+  """
+  Split the events in inputfiles into njobs contiguous shards of (inputfile, start, stop) ranges, in input order,
+  using the .lheidx event index to count the events in each file
+  """
+  nevents = [len(lhefile_methods.load_event_index(inputfile).offsets) for inputfile in inputfiles]
+  pershard = -(-sum(nevents) // njobs)
+  shards = [[] for _ in range(njobs)]
+  ishard = neventsinshard = 0
+  for inputfile, n in zip(inputfiles, nevents):
+    start = 0
+    while start < n:
+      stop = min(n, start + pershard - neventsinshard)
+      shards[ishard].append((inputfile, start, stop))
+      neventsinshard += stop - start
+      start = stop
+      if neventsinshard == pershard:
+        ishard += 1
+        neventsinshard = 0
+  return [shard for shard in shards if shard]
+
+def _convertshard(convertargs):
+  args, outputfile, shard = convertargs
+  return convert(args, outputfile, shard)
+
+def convertparallel(args, outputfile, njobs):
+  """
+  Convert args.inputfile with njobs worker processes, each with its own Mela, and merge the trees they write into outputfile in input order.
+  Returns the combined lhe_timing.StageTimer of the jobs with --timing, otherwise None.
+  """
+  shards = splitinputs(args.inputfile, njobs)
+  if len(shards) < 2:
+    return convert(args, outputfile, shards[0] if shards else [])
+  base, extension = os.path.splitext(outputfile)
+  shardfiles = ["{}_job{}{}".format(base, i, extension) for i in range(len(shards))]
+  for _ in shardfiles:
+    if os.path.exists(_) and not (args.resume and os.path.exists(checkpointfilename(_))): raise IOError(_+" already exists")
+
+  try:
+    with multiprocessing.get_context("spawn").Pool(len(shards)) as pool:
+      timers = pool.map(_convertshard, [(args, shardfile, shard) for shardfile, shard in zip(shardfiles, shards)], chunksize=1)
+
+    lhe_output.merge_outputs(args.format, outputfile, shardfiles, chunksize=args.chunk_size)
+  except:
+    #shards with a checkpoint are kept for --resume
+    for shardfile in shardfiles:
+      if not os.path.exists(checkpointfilename(shardfile)):
+        try:
+          os.remove(shardfile)
+        except:
+          pass
+    raise
+
+  for shardfile in shardfiles:
+    for _ in shardfile, checkpointfilename(shardfile):
+      try:
+        os.remove(_)
+      except:
+        pass
+
+  timers = [_ for _ in timers if _ is not None]
+  if not timers: return None
+  timer = timers[0]
+  timer.label = ""
+  for _ in timers[1:]:
+    timer.combine(_)
+  return timer
 
 
 if __name__ == "__main__":
@@ -10,764 +653,82 @@ if __name__ == "__main__":
   parser.add_argument("outputfile")
   parser.add_argument("inputfile", nargs="+")
   g = parser.add_mutually_exclusive_group(required=True)
-  g.add_argument("--vbf", action="store_true")
-  g.add_argument("--vbf_withdecay", action="store_true")
-  g.add_argument("--zh", action="store_true")
-  g.add_argument("--zh_withdecay", action="store_true")
-  g.add_argument("--zh_lep", action="store_true")
-  g.add_argument("--zh_lep_hawk", action="store_true")
-  g.add_argument("--wh_withdecay", action="store_true")
-  g.add_argument("--wh_lep", action="store_true")
-  g.add_argument("--wh", action="store_true")
-  g.add_argument("--ggH4l", action="store_true") # for ggH 4l JHUGen and prophecy  
-  g.add_argument("--ggH4lMG", action="store_true") # for ggH4l Madgraph with weights
+  #one flag per production mode in lhe_modes (ggH4l is for ggH 4l JHUGen and prophecy, ggH4lMG for ggH4l Madgraph with weights)
+  for name in lhe_modes.MODES:
+    g.add_argument("--"+name, action="store_true")
   parser.add_argument("--use-flavor", action="store_true")
   parser.add_argument("--merge_photon", action="store_true") # for ggH 4l JHUGen and prophecy
   parser.add_argument("--calc_prodprob", action="store_true")
   parser.add_argument("--calc_decayprob", action="store_true")
+  parser.add_argument("--fsr-deltar", type=float, help="with --merge_photon or --zh_lep_hawk, only merge photons into leptons within this DeltaR (by default, into the nearest lepton however far it is)")
   parser.add_argument("--CJLST", action="store_true")
   parser.add_argument("--MELAcalc", action="store_true")
   parser.add_argument("--reweight-to", choices="fa3-0.5")
+  parser.add_argument("--jobs", type=int, default=1, help="number of worker processes, each converting a contiguous range of the input events")
+  parser.add_argument("--add-to", metavar="EXISTING.root", help="existing lhe2root.py output for the same input files: only the branches it doesn't have are computed, and they are written to outputfile as a friend tree with the same entries")
+  parser.add_argument("--branches", metavar="GLOBS", help="comma separated shell-style patterns (e.g. 'pg*,D0minus,M4L'): only write the branches that match, and only do the MELA calls and kinematic calculations they need")
+  parser.add_argument("--drop-branches", metavar="GLOBS", help="comma separated shell-style patterns of branches not to write, applied after --branches")
+  parser.add_argument("--checkpoint-every", type=int, default=100000, help="autosave the tree and record the position in the input every this many events (0 to only do it on SIGTERM), only with --format root")
+  parser.add_argument("--resume", action="store_true", help="continue a conversion that was stopped, from its last checkpoint (only with --format root)")
+  parser.add_argument("--format", "--output-backend", dest="format", choices=lhe_output.BACKENDS, help="output format (and library that writes it): root (PyROOT), uproot, parquet, arrow or hdf5, by default from the extension of outputfile. lhe2root.py still needs ROOT and MELA to read the events with any of them")
+  parser.add_argument("--chunk-size", type=int, default=lhe_output.DEFAULT_CHUNKSIZE, help="number of events buffered in memory and written to the output at once")
+  parser.add_argument("--timing", action="store_true", help="time each stage of the event loop (parsing, setInputEvent, each MELA calculation, filling the output), count the MELA calls, print a progress line with the rate and ETA to stderr, and write a JSON summary to outputfile.timing.json")
+  parser.add_argument("--progress-every", type=float, default=lhe_timing.DEFAULT_PROGRESS_INTERVAL, metavar="SECONDS", help="with --timing, seconds between progress lines (0 for none)")
+  parser.add_argument("--profile", metavar="OUTPUT", help="profile the conversion of the --profile-events window and write the profile to OUTPUT (pstats, or collapsed stacks with --profile-sampling), then print the top functions in LHE parsing, MELA and ROOT I/O")
+  parser.add_argument("--profile-events", type=lhe_profile.parse_window, default=(0, None), metavar="START:STOP", help="with --profile, the events to profile, i.e. 1000:6000 to skip the warm-up (default: all of them)")
+  parser.add_argument("--profile-sampling", action="store_true", help="with --profile, sample the stack with SIGPROF instead of recording every call, which slows the conversion down much less")
+  parser.add_argument("--profile-interval", type=float, default=lhe_profile.DEFAULT_INTERVAL, metavar="SECONDS", help="with --profile-sampling, seconds of CPU time between samples")
+  parser.add_argument("--mela-cache", help="sqlite file to keep MELA probabilities and angles in, so that re-running on the same events skips MELA")
+  parser.add_argument("--mela-cache-entries", type=int, default=lhe_melacache.DEFAULT_MAXENTRIES, help="maximum number of results kept in the MELA cache, the least recently used ones are removed")
   args = parser.parse_args()
+  args.format = args.format or lhe_output.backend_for_filename(args.outputfile)
 
-  if os.path.exists(args.outputfile): raise IOError(args.outputfile+" already exists")
+  if args.profile and args.jobs > 1: raise ValueError("--profile only works with --jobs 1")
+  if args.resume and not lhe_output.supports_resume(args.format): raise ValueError("--format {} can't be resumed, only --format root can".format(args.format))
+  if args.add_to and args.format not in ("root", "uproot"): raise ValueError("--add-to writes a friend tree, so the output has to be a ROOT file")
+  if os.path.exists(args.outputfile) and not (args.resume and os.path.exists(checkpointfilename(args.outputfile))):
+    raise IOError(args.outputfile+" already exists")
   for _ in args.inputfile:
     if not os.path.exists(_) and not args.CJLST: raise IOError(_+" doesn't exist")
     
-  bad = False
-
-
-  try:
-    newf = ROOT.TFile(args.outputfile, "RECREATE")
-    t = ROOT.TTree("tree", "tree")
-
-    branchnames_float = "costheta1", "costheta2", "Phi1", "costhetastar", "Phi", "HJJpz","M4L","MZ1","MZ2","costheta1d","costheta2d","Phid","costhetastard","Phi1d"
-    if args.calc_prodprob or args.calc_decayprob :
-      branchnames_float += ("pg1", "pg4","pg2","pg1g2","pg1g4","pg2za","pg4za","pg1g2za","pg1g4za","pg2aa","pg4aa","pg1g2aa","pg1g4aa","D0minus","D0hplus", "DCP", "Dint","D0minus_za","D0hplus_za","Dint_za","DCP_za")
-    if args.zh or args.wh or args.zh_withdecay or args.wh_withdecay or args.zh_lep or args.wh_lep or args.zh_lep_hawk:
-      branchnames_float += ("mV", "mVstar",    "pxj1", "pyj1", "pzj1", "Ej1",
-      "pxj2", "pyj2", "pzj2", "Ej2", "ptV")
-      
-    if args.ggH4lMG:
-      branchnames_float_array=("weights",)
-      num_weights=30
-    if args.vbf or args.vbf_withdecay:
-      branchnames_float += ("q2V1", "q2V2","Dphijj")
-    if args.MELAcalc:
-      branchnames_daughters = "LHEDaughterId","LHEDaughterPt","LHEDaughterEta","LHEDaughterPhi","LHEDaughterMass"
-      branchnames_associated = "LHEAssociatedParticleId","LHEAssociatedParticlePt","LHEAssociatedParticleEta","LHEAssociatedParticlePhi","LHEAssociatedParticleMass"
-      branchnames_mothers = "LHEMotherId","LHEMotherPz","LHEMotherE"
-
-      branches_daughters = {name: array("f", [0,0,0,0]) for name in branchnames_daughters}
-      branches_associated = {name: array("f", [0,0]) for name in branchnames_associated}
-      branches_mothers = {name: array("f", [0,0]) for name in branchnames_mothers}
-
-    branchnames_float += (
-      
-      "ptH", "pxH",  "pyH",  "pzH",  "EH","rapH","rapHJJ","decayMode","qfl1","qfl2","qfl1mom","qfl2mom",
-      "pxj1", "pyj1", "pzj1", "Ej1",
-      "pxj2", "pyj2", "pzj2", "Ej2",
-      "pxph1","pyph1","pzph1","Eph1",
-      "weight",
-      "ptdau1","pxdau1","pydau1","pzdau1","Edau1","flavdau1", 
-      "ptdau2","pxdau2","pydau2","pzdau2","Edau2","flavdau2",
-      "ptdau3","pxdau3","pydau3","pzdau3","Edau3","flavdau3",
-      "ptdau4","pxdau4","pydau4","pzdau4","Edau4","flavdau4",
-      
-    )
-
-    branchnames_int = ()
-
-    branches = {name: array("f", [0]) for name in branchnames_float}
-    branches_int = {name: array("i", [0]) for name in branchnames_int}
-    if args.ggH4lMG:
-      branches_float = {name: array("f",[0]*num_weights) for name in branchnames_float_array}
-      print(branches_float,branchnames_float_array,"here")
-      for name in branches_float:
-        t.Branch(name, branches_float[name], name+"[30]/F")
-      branches.update(branches_float)
-    for name in branchnames_float:
-      t.Branch(name, branches[name], name+"/F")
-    for name in branchnames_int:
-      t.Branch(name, branches_int[names], name+"/I")
-    if args.MELAcalc:
-      for name in branchnames_daughters:
-        t.Branch(name, branches_daughters[name], name+"[4]/F")
-      for name in branchnames_associated:
-        t.Branch(name, branches_associated[name], name+"[2]/F")
-      for name in branchnames_mothers:
-        t.Branch(name, branches_mothers[name], name+"[2]/F")
-      branches.update(branches_daughters)
-      branches.update(branches_associated)
-      branches.update(branches_mothers)
-
-    branches.update(branches_int)
-    g4 = 0
-    if args.zh:
-      g4 = 0.144057
-    if args.wh:
-      g4 = 0.1236136
-    if args.vbf:
-      g4 = 0.297979
-    
-    
-    for inputfile in args.inputfile:
-      print(inputfile)
-      inputfclass = LHEFile_Hwithdecay(inputfile,isgen=args.use_flavor)
-      if args.ggH4l : 
-        inputfclass = LHEFile_HwithdecayOnly(inputfile,isgen=args.use_flavor)
-      if args.vbf or args.zh_lep or args.wh_lep  :
-        inputfclass = LHEFile_StableHiggs(inputfile,isgen=args.use_flavor)
-      if args.zh or args.wh:
-        inputfclass = LHEFile_StableHiggsVH(inputfile,isgen=args.use_flavor)
-      if args.zh_withdecay or args.wh_withdecay  :
-        inputfclass = LHEFile_VHHiggsdecay(inputfile,isgen=args.use_flavor)
-      if args.zh_lep_hawk :
-        print ("Algorithm will automaticaly merge associated FSR photons to the leptons")
-        inputfclass = LHEFile_StableHiggsZHHAWK(inputfile,isgen=args.use_flavor)
-
-      #inputfclass = LHEFile_Hwithdecay(inputfile,isgen=args.use_flavor)
-      
-      with inputfclass  as f:
-        for i, event in enumerate(f):
-          #print "here"
-          #debugging purposes
-          #if i > 1000000 : 
-            #break
-          
-          #if( i % 100 == 0): 
-          #  print ("Processed", i, " events",end="\r")
-          
-          
-    ### Automatically detect Had or Lep associated for VH production###
-          associated_flavor = 0
-          for a in event.associated:
-            associated_flavor=abs(a.first)
-            #print associated_flavor
-          if associated_flavor in [1,2,3,4,5,6]:
-            if args.zh or args.zh_withdecay:
-              process = TVar.Had_ZH
-            elif args.wh or args.wh_withdecay:
-              process = TVar.Had_WH
-          if associated_flavor in [11,12,13,14,15,16]:
-            if args.zh or args.zh_withdecay:
-              process = TVar.Lep_ZH
-            elif args.wh or args.wh_withdecay:
-              process = TVar.Lep_WH
-          if args.vbf or args.vbf_withdecay:
-            process = TVar.JJVBF
-          if args.zh_lep or args.zh_lep_hawk :
-            process = TVar.Lep_ZH
-          if args.wh_lep :
-            process = TVar.Lep_WH
-          if args.ggH4l :
-            process = TVar.ZZGG
-
-          #print i,"---- 1st -----------------------------"
-          # for n,ll in enumerate(event.daughters):
-          # #  print("daughter", n, ll.second.Px(), ll.second.Py(), ll.second.Pz(), ll.second.E())
-          #  print("daughter", n, (ll.second + ll.first).M())
-          #  print("daughter", n, (ll.third + ll.fourth).M())
-          
-          # print("Z1:", (event.daughters[0].second + event.daughters[1].second).M())
-  #        print("Z1:", (event.daughters[0].second + event.daughters[1].second).M())
-  #        print("Z2:", (event.daughters[2].second + event.daughters[3].second).M())
-            
-          flav4l = 1;
-          for d in event.daughters: 
-            flav4l = flav4l*d.first
-            #print "init :",d.first,d.second.Px(),d.second.Py(),d.second.Pz(),d.second.E()
-          # this section merges the EW emitted photon to the closest lepton and updates the daugthers collection for Prophecy
-          # and associated for HAWK ZH, before the calculation of angles and probabilities for decay by MELA. The photon is
-          #still stored in  the associated collection for references for Prophecy. For HAWK it is deleted.  
-
-
-          if (args.zh_lep_hawk)  :   
-
-            for ipho, p in enumerate(event.associated):
-
-              if not (  p.first == 22)  :
-                continue
-              k = p.second
-              mindr = 9999
-              newlep = ROOT.TLorentzVector()
-
-              photonvector = ROOT.TLorentzVector()
-              lepp = ROOT.TLorentzVector()
-              photonvector.SetPtEtaPhiM(k.Pt(), k.Eta(),k.Phi(), k.M())
-              #print "photon:",p.first,p.second.Px(),p.second.Py(),p.second.Pz(),p.second.E()
-              i_newlep = 0        
-              for ilep, d in enumerate(event.associated):
-                if not( d.first == 22 )  : 
-                  lep = d.second
-                  d_lor = ROOT.TLorentzVector()            
-                  d_lor.SetPtEtaPhiM(lep.Pt(), lep.Eta(),lep.Phi(), lep.M())
-                  dr =  k.DeltaR(d_lor)
-                  if dr < mindr :
-                    lepp.SetPtEtaPhiM(lep.Pt(), lep.Eta(),lep.Phi(), lep.M())
-                    mindr = dr
-                    i_newlep = ilep                  
-              newlep = lepp  + photonvector 
-              event.associated.pop_back()
-              event.associated[i_newlep].second = newlep
-              # re-initiate the event with the new associated particles  this only works for HAWK events!!!
-              eventt = event
-              event.mela.setInputEvent(eventt.daughters, eventt.associated, eventt.mothers)
-
-
-
-
-          if (args.merge_photon and args.ggH4l)  :   
-
-            for p in event.associated:
-
-              if not (  p.first == 22)  :
-                continue
-              k = p.second
-              mindr = 9999
-              newlep = ROOT.TLorentzVector()
-
-              photonvector = ROOT.TLorentzVector()
-              lepp = ROOT.TLorentzVector()
-              photonvector.SetPtEtaPhiM(k.Pt(), k.Eta(),k.Phi(), k.M())
-              #print "photon:",p.first,p.second.Px(),p.second.Py(),p.second.Pz(),p.second.E()
-              i_newlep = 0        
-              for ilep, d in enumerate(event.daughters): 
-                lep = d.second
-                d_lor = ROOT.TLorentzVector()            
-                d_lor.SetPtEtaPhiM(lep.Pt(), lep.Eta(),lep.Phi(), lep.M())
-                dr =  k.DeltaR(d_lor)
-                if dr < mindr :
-                  lepp.SetPtEtaPhiM(lep.Pt(), lep.Eta(),lep.Phi(), lep.M())
-                  mindr = dr
-                  i_newlep = ilep  
-
-              newlep = lepp  + photonvector 
-              event.daughters[i_newlep].second = newlep
-              # re-initiate the event with the new daughters this only works for Prophecy events!!!
-              eventt = event
-              event.mela.setInputEvent(eventt.daughters, eventt.associated, eventt.mothers)
-    
-                  
-          #Probabilities
-          #event.setProcess(TVar. HSMHiggs,TVar.JHUGen,process)
-          if args.calc_decayprob : 
-            # decayP works only for the process below 
-            #everytime you call a compute Prob function all the couplings
-            #are reset and have to be redefined. 
-
-            process = TVar.ZZINDEPENDENT
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz2 = 1
-            branches["pg2"][0] = event.computeP()
-                    
-            event.setProcess(TVar.HSMHiggs,TVar.JHUGen,process)
-            event.ghz1 = 2      
-            branches["pg1"][0] = event.computeP()
-          
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz4 = 1
-            branches["pg4"][0] = event.computeP()
-                              
-            event.setProcess(TVar.SelfDefine_spin0, TVar.JHUGen, process)
-            event.ghz1 = 1
-            event.ghz4 = 1
-            branches["pg1g4"][0] = event.computeP() - branches["pg1"][0] - branches["pg4"][0]
-          
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 1
-            event.ghz2 = 1        
-            branches["pg1g2"][0] = event.computeP() - branches["pg1"][0] - branches["pg2"][0]
-
-
-            
-
-            
-            c_0hplus = 1
-            c_0minus = 1 
-            if ( process ==  TVar.ZZINDEPENDENT  ) : 
-              c_0minus = 2.55497301342
-              c_0hplus = 1.66326995046
-
-
-              
-            branches["D0minus"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0minus*c_0minus*branches["pg4"][0])
-            branches["D0hplus"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0hplus*c_0hplus*branches["pg2"][0])
-            branches["DCP"][0] = branches["pg1g4"][0] / (2 * (branches["pg1"][0] * branches["pg4"][0]) ** 0.5)
-            branches["Dint"][0] = branches["pg1g2"][0] / (2 * (branches["pg1"][0] * branches["pg2"][0]) ** 0.5)
-            #branches["DCP_old"][0] = branches["pg1g4"][0] / (branches["pg1"][0] + branches["pg4"][0])
-
-          if args.calc_prodprob :
-            
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 0
-            event.ghz2 = 1
-            branches["pg2"][0] = event.computeProdP()
-            #print "g2 :",event.ghz2,branches["pg2"][0]
-            
-            
-            event.setProcess(TVar. HSMHiggs,TVar.JHUGen,process)
-            event.ghz1 = 1
-            branches["pg1"][0] = event.computeProdP()
-            #print "g1 :",branches["pg1"][0]
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz4 = 1
-            branches["pg4"][0] = event.computeProdP()
-            #print "g4 :",branches["pg4"][0]
-
-                      
-            event.setProcess(TVar.SelfDefine_spin0, TVar.JHUGen, process)
-            event.ghz1 = 1
-            event.ghz4 = 1
-            branches["pg1g4"][0] = event.computeProdP() - branches["pg1"][0] - branches["pg4"][0]
-            #print "g1g4 :",branches["pg1g4"][0]
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 1
-            event.ghz2 = 1        
-            branches["pg1g2"][0] = event.computeProdP() - branches["pg1"][0] - branches["pg2"][0]
-            #print "g1g2 :",branches["pg1g2"][0]
-
-            #added zgamma discr Prod
-            
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 0
-            event.ghzgs2 = 1        
-            branches["pg2za"][0] = event.computeProdP()
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 0
-            event.ghzgs4 = 1        
-            branches["pg4za"][0] = event.computeProdP()
-            
-
-            
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 1
-            event.ghzgs2 = 1        
-            branches["pg1g2za"][0] = event.computeProdP() - branches["pg1"][0] - branches["pg2za"][0]
-            
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 1
-            event.ghzgs4 = 1        
-            branches["pg1g4za"][0] = event.computeProdP() - branches["pg1"][0] - branches["pg4za"][0]
-            
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 0
-            event.ghgsgs2 = 1
-            branches["pg2aa"][0] = event.computeProdP()
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 0
-            event.ghgsgs4 = 1
-            branches["pg4aa"][0] = event.computeProdP()
-
-
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 1
-            event.ghgsgs2 = 1
-            branches["pg1g2aa"][0] = event.computeProdP() - branches["pg1"][0] - branches["pg2aa"][0]
-
-
-            event.setProcess(TVar.SelfDefine_spin0,TVar.JHUGen,process)
-            event.ghz1 = 1
-            event.ghgsgs4 = 1
-            branches["pg1g4aa"][0] = event.computeProdP() - branches["pg1"][0] - branches["pg4aa"][0]
-
-
-
-            c_0hplus = 1
-            c_0minus = 1 
-            if ( process == TVar.Had_ZH ) :
-              c_0hplus = 0.130395173298
-              c_0minus = 0.104503154335
-              c_0hplusza = 0.130395173298
-              c_0minusza = 0.104503154335
-            if ( process == TVar.JJVBF  ) :   
-              c_0minus = 0.297979440554
-              c_0hplus = 0.271880048944
-            if ( process ==  TVar.ZZGG  ) : 
-              c_0minus = 2.55497301342
-              c_0hplus = 1.66326995046
-
-
-              
-            branches["D0minus"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0minus*c_0minus*branches["pg4"][0])
-            branches["D0hplus"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0hplus*c_0hplus*branches["pg2"][0])
-            branches["DCP"][0] = branches["pg1g4"][0] / (2 * (branches["pg1"][0] * branches["pg4"][0]) ** 0.5)
-            branches["Dint"][0] = branches["pg1g2"][0] / (2 * (branches["pg1"][0] * branches["pg2"][0]) ** 0.5)
-
-            '''
-            branches["D0minus_za"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0minusza*c_0minusza*branches["pg4za"][0])
-            branches["D0hplus_za"][0] = branches["pg1"][0] / (branches["pg1"][0] + c_0hplusza*c_0hplusza*branches["pg2za"][0])
-            branches["DCP_za"][0] = branches["pg1g4za"][0] / (2 * (branches["pg1"][0] * branches["pg4za"][0]) ** 0.5)
-            branches["Dint_za"][0] = branches["pg1g2za"][0] / (2 * (branches["pg1"][0] * branches["pg2za"][0]) ** 0.5)
-            ''' 
-
-
-            #branches["DCP_old"][0] = branches["pg1g4"][0] / (branches["pg1"][0] + branches["pg4"][0])
-    
-
-
+  if args.add_to:
+    _, nexisting = readexistingtree(args.add_to)
+    nevents = countevents(args.inputfile)
+    if nevents != nexisting: raise ValueError("{} has {} entries, but the input files have {} events".format(args.add_to, nexisting, nevents))
 
+  mode = lhe_modes.selected_mode(args)
+  nweights = len(lhefile_methods.get_weight_ids(args.inputfile[0])) if mode.readweights and os.path.exists(args.inputfile[0]) else 0
+  columns = outputcolumns(args, mode, nweights)
+  for line in describeworkplan(buildworkplan(args, mode, selectbranches(args, columns)), mode, columns):
+    print(line)
 
+  bad = False
 
-            
-          if args.zh or args.wh or args.zh_lep or args.wh_lep or args.zh_lep_hawk:
-            branches["mV"][0], branches["mVstar"][0], branches["costheta1"][0], branches["costheta2"][0], branches["Phi"][0], branches["costhetastar"][0], branches["Phi1"][0]= event.computeVHAngles(process)
-          elif args.zh_withdecay or args.wh_withdecay :
-            branches["mV"][0], branches["mVstar"][0], branches["costheta1"][0], branches["costheta2"][0], branches["Phi"][0], branches["costhetastar"][0], branches["Phi1"][0]= event.computeVHAngles(process)
-            branches["M4L"][0], branches["MZ1"][0], branches["MZ2"][0], branches["costheta1d"][0],branches["costheta2d"][0], branches["Phid"][0], branches["costhetastard"][0], branches["Phi1d"][0]= event.computeDecayAngles()
-            #branches["mV"][0] = sum((particle.second for particle in event.associated), ROOT.TLorentzVector()).M()
-            #branches["mVstar"][0] = sum((particle.second for particle in itertools.chain(event.daughters, event.associated)), ROOT.TLorentzVector()).M()
-          elif args.vbf:
-            branches["q2V1"][0], branches["q2V2"][0], branches["costheta1"][0], branches["costheta2"][0], branches["Phi"][0], branches["costhetastar"][0], branches["Phi1"][0]= event.computeVBFAngles()
-            branches["HJJpz"][0] = sum((particle.second for particle in itertools.chain(event.daughters, event.associated)), ROOT.TLorentzVector()).Pz()
-
-            pj1 = event.associated[0].second
-            pj2 = event.associated[1].second
-            if pj1.Pt() > pj2.Pt() :
-              branches["Dphijj"][0] = pj1.DeltaPhi(pj2)
-            else:
-              branches["Dphijj"][0] = pj2.DeltaPhi(pj1)
-          elif args.vbf_withdecay:
-            branches["q2V1"][0], branches["q2V2"][0], branches["costheta1"][0], branches["costheta2"][0], branches["Phi"][0], branches["costhetastar"][0], branches["Phi1"][0]= event.computeVBFAngles()
-            branches["HJJpz"][0] = sum((particle.second for particle in itertools.chain(event.daughters, event.associated)), ROOT.TLorentzVector()).Pz()
-            branches["M4L"][0], branches["MZ1"][0], branches["MZ2"][0], branches["costheta1d"][0],branches["costheta2d"][0], branches["Phid"][0], branches["costhetastard"][0], branches["Phi1d"][0]= event.computeDecayAngles()
-            pj1 = event.associated[0].second
-            branches["pxj1"][0] = pj1.Px()
-            branches["pyj1"][0] = pj1.Py()
-            branches["pzj1"][0] = pj1.Pz()
-            branches["Ej1"][0] = pj1.E()
-            pj2 = event.associated[1].second
-            branches["pxj2"][0] = pj2.Px()
-            branches["pyj2"][0] = pj2.Py()
-            branches["pzj2"][0] = pj2.Pz()
-            branches["Ej2"][0] = pj2.E()
-
-
-
-          elif args.ggH4l or args.ggH4lMG:
-            branches["M4L"][0], branches["MZ1"][0], branches["MZ2"][0], branches["costheta1d"][0],branches["costheta2d"][0], branches["Phid"][0], branches["costhetastard"][0], branches["Phi1d"][0]= event.computeDecayAngles()
-          #print i,branches["M4L"][0], branches["MZ1"][0], branches["MZ2"][0],len(event.associated)
-          pH = sum((particle.second for particle in event.daughters), ROOT.TLorentzVector())
-          if args.ggH4l:
-            if( len(event.associated) > 0):
-              ph1 = event.associated[0].second
-              pHph = pH + ph1 
-              branches["pxph1"][0] = pHph.Px()
-              branches["pyph1"][0] = pHph.Py()
-              branches["pzph1"][0] = pHph.Pz()
-              branches["Eph1"][0]  = pHph.E()
-
-          else:     
-            branches["ptH"][0] = pH.Pt()
-            branches["pxH"][0] = pH.Px()
-            branches["pyH"][0] = pH.Py()
-            branches["pzH"][0] = pH.Pz()
-            branches["EH"][0] = pH.E()
-            branches["rapH"][0] = pH.Rapidity()
-                  
-          if not args.vbf and not args.zh and not args.wh and not args.zh_lep and not args.wh_lep and not args.zh_lep_hawk: 
-            pdau1 = event.daughters[0].second
-            branches["ptdau1"][0] = pdau1.Pt()
-            branches["pxdau1"][0] = pdau1.Px()
-            branches["pydau1"][0] = pdau1.Py()
-            branches["pzdau1"][0] = pdau1.Pz()
-            branches["Edau1"][0] = pdau1.E()
-            branches["flavdau1"][0] = event.daughters[0].first
-            
-            
-            pdau2 = event.daughters[1].second
-            branches["ptdau2"][0] = pdau2.Pt()
-            branches["pxdau2"][0] = pdau2.Px()
-            branches["pydau2"][0] = pdau2.Py()
-            branches["pzdau2"][0] = pdau2.Pz()
-            branches["Edau2"][0] = pdau2.E()
-            branches["flavdau2"][0] = event.daughters[1].first
-            
-            pdau3 = event.daughters[2].second
-            branches["ptdau3"][0] = pdau3.Pt()
-            branches["pxdau3"][0] = pdau3.Px()
-            branches["pydau3"][0] = pdau3.Py()
-            branches["pzdau3"][0] = pdau3.Pz()
-            branches["Edau3"][0] = pdau3.E()
-            branches["flavdau3"][0] = event.daughters[2].first
-            
-            
-            pdau4 = event.daughters[3].second
-            branches["ptdau4"][0] = pdau4.Pt()
-            branches["pxdau4"][0] = pdau4.Px()
-            branches["pydau4"][0] = pdau4.Py()
-            branches["pzdau4"][0] = pdau4.Pz()
-            branches["Edau4"][0] = pdau4.E()
-            branches["flavdau4"][0] = event.daughters[3].first
-            
-          
-
-          if args.ggH4l:
-            #add FSR photon to the root file 
-            if( len(event.associated) > 0):
-              ph1 = event.associated[0].second
-              branches["pxph1"][0] = ph1.Px()
-              branches["pyph1"][0] = ph1.Py()
-              branches["pzph1"][0] = ph1.Pz()
-              branches["Eph1"][0] = ph1.E()
-
-          if args.vbf or args.zh or args.wh  or args.zh_lep_hawk:     
-            pj1 = event.associated[0].second
-            branches["pxj1"][0] = pj1.Px()
-            branches["pyj1"][0] = pj1.Py()
-            branches["pzj1"][0] = pj1.Pz()
-            branches["Ej1"][0] = pj1.E()          
-            pj2 = event.associated[1].second
-            branches["pxj2"][0] = pj2.Px()
-            branches["pyj2"][0] = pj2.Py()
-            branches["pzj2"][0] = pj2.Pz()
-            branches["Ej2"][0] = pj2.E()
-            phjj = pH + pj1 + pj2
-            branches["rapHJJ"][0] = phjj.Rapidity()
-
-          if args.MELAcalc:
-            if len(event.associated) > 0:
-              if event.associated[0].second.Pz() > event.associated[1].second.Pz():
-                pj1 = event.associated[0].second
-                pj2 = event.associated[1].second
-              else:
-                pj2 = event.associated[0].second
-                pj1 = event.associated[1].second
-              branches["LHEAssociatedParticleId"][0] = event.associated[0].first
-              branches["LHEAssociatedParticlePt"][0] = pj1.Pt()
-              branches["LHEAssociatedParticleEta"][0] = pj1.Eta() #np.log(np.tan(np.arccos(pj1.Pz()/np.sqrt(pj1.Px()**2 + pj1.Py()**2 + pj1.Pz()**2))/2))
-              branches["LHEAssociatedParticlePhi"][0] = pj1.Phi() #np.arctan2(pj1.Py(),pj1.Px())
-              map1 = pj1.M()
-              if map1 > 0:
-                branches["LHEAssociatedParticleMass"][0] = pj1.M()
-              else:
-                branches["LHEAssociatedParticleMass"][0] = 0
-              branches["LHEAssociatedParticleId"][1] = event.associated[1].first
-              branches["LHEAssociatedParticlePt"][1] = pj2.Pt()
-              branches["LHEAssociatedParticleEta"][1] = pj2.Eta()
-              branches["LHEAssociatedParticlePhi"][1] = pj2.Phi()
-              map2 = pj2.M()
-              if map2 > 0:
-                branches["LHEAssociatedParticleMass"][1] = pj2.M()
-              else:
-                branches["LHEAssociatedParticleMass"][1] = 0
-            try:
-              pdau1 = event.daughters[0].second
-              branches["LHEDaughterId"][0] = event.daughters[0].first
-              branches["LHEDaughterPt"][0] = pdau1.Pt()
-              branches["LHEDaughterEta"][0] = pdau1.Eta()
-              branches["LHEDaughterPhi"][0] = pdau1.Phi()
-              ml1 = pdau1.M()
-              if ml1 > 0:
-                branches["LHEDaughterMass"][0] = ml1
-              else:
-                branches["LHEDaughterMass"][0] = 0
-              pdau2 = event.daughters[1].second
-              branches["LHEDaughterId"][1] = event.daughters[1].first
-              branches["LHEDaughterPt"][1] = pdau2.Pt()
-              branches["LHEDaughterEta"][1] = pdau2.Eta()
-              branches["LHEDaughterPhi"][1] = pdau2.Phi()
-              ml2 = pdau2.M()
-              if ml2 > 0:
-                branches["LHEDaughterMass"][1] = ml2
-              else:
-                branches["LHEDaughterMass"][1] = 0
-              pdau3 = event.daughters[2].second
-              branches["LHEDaughterId"][2] = event.daughters[2].first
-              branches["LHEDaughterPt"][2] = pdau3.Pt()
-              branches["LHEDaughterEta"][2] = pdau3.Eta()
-              branches["LHEDaughterPhi"][2] = pdau3.Phi()
-              ml3 = pdau3.M()
-              if ml3 > 0:
-                branches["LHEDaughterMass"][2] = ml3
-              else:
-                branches["LHEDaughterMass"][2] = 0
-              pdau4 = event.daughters[3].second
-              branches["LHEDaughterId"][3] = event.daughters[3].first
-              branches["LHEDaughterPt"][3] = pdau4.Pt()
-              branches["LHEDaughterEta"][3] = pdau4.Eta()
-              branches["LHEDaughterPhi"][3] = pdau4.Phi()
-              ml4 = pdau4.M()
-              if ml4 > 0:
-                branches["LHEDaughterMass"][3] = ml4
-              else:
-                branches["LHEDaughterMass"][3] = 0
-            except:
-              branches["LHEDaughterId"][0] = 11
-              branches["LHEDaughterPt"][0] = 0
-              branches["LHEDaughterEta"][0] = 0
-              branches["LHEDaughterPhi"][0] = 0
-              branches["LHEDaughterMass"][0] = 0
-              branches["LHEDaughterId"][1] = -11
-              branches["LHEDaughterPt"][1] = 0
-              branches["LHEDaughterEta"][1] = 0
-              branches["LHEDaughterPhi"][1] = 0          
-              branches["LHEDaughterMass"][1] = 0
-              branches["LHEDaughterId"][2] = 11
-              branches["LHEDaughterPt"][2] = 0
-              branches["LHEDaughterEta"][2] = 0
-              branches["LHEDaughterPhi"][2] = 0                      
-              branches["LHEDaughterMass"][2] = 0
-              branches["LHEDaughterId"][3] = -11
-              branches["LHEDaughterPt"][3] = 0
-              branches["LHEDaughterEta"][3] = 0
-              branches["LHEDaughterPhi"][3] = 0
-              branches["LHEDaughterMass"][3] = 0
-            try:
-              pmom1 = event.mothers[0].second
-              branches["LHEMotherId"][0] = event.mothers[0].first
-              branches["LHEMotherPz"][0] = pmom1.Pz()
-              branches["LHEMotherE"][0] = pmom1.E()
-              pmom2 = event.mothers[1].second
-              branches["LHEMotherId"][1] = event.mothers[1].first
-              branches["LHEMotherPz"][1] = pmom2.Pz()
-              branches["LHEMotherE"][1] = pmom2.E()
-            except:
-              #pmom1 = event.mothers[0].second
-              branches["LHEMotherId"][0] = 21
-              branches["LHEMotherPz"][0] = 0
-              branches["LHEMotherE"][0] = 0
-              #pmom2 = event.mothers[1].second
-              branches["LHEMotherId"][1] = 21
-              branches["LHEMotherPz"][1] = 0
-              branches["LHEMotherE"][1] = 0
-
-          if args.zh or args.wh or args.zh_lep_hawk:
-            branches["ptV"][0] = np.sqrt((pj1.Px()+pj2.Px())**2+(pj1.Py()+pj2.Py())**2)
-          
-          if args.ggH4lMG:
-            key_sorted=sorted(event.weights)
-            list_weights=[]
-            for key in key_sorted:
-              list_weights.append(event.weights.get(key,None))
-            for j in range(len(list_weights)):
-              branches["weights"][j] = list_weights[j]
-            print(branches["weights"])
-          else:
-            branches["weight"][0] = event.weight
-                # print "FIlling!"
-          t.Fill()
-        # print("Processed", i+1, "events")
 
-    newf.Write()
+  try:
+    if args.jobs > 1:
+      timer = convertparallel(args, args.outputfile, args.jobs)
+    else:
+      timer = convert(args, args.outputfile, [(inputfile, None, None) for inputfile in args.inputfile])
+    if timer is not None:
+      timer.write(timingfilename(args.outputfile))
+      print(timer.progressline())
+      print("Timings written to", timingfilename(args.outputfile))
+    if args.add_to:
+      _, nwritten = readexistingtree(args.outputfile)
+      if nwritten != nexisting: raise ValueError("Wrote {} entries, but {} has {}".format(nwritten, args.add_to, nexisting))
+      print("To read the new branches together with the old ones: tree.AddFriend(\"tree\", \"{}\")".format(args.outputfile))
   except:
     bad = True
     raise
   finally:
-    if bad:
+    checkpointfile = checkpointfilename(args.outputfile)
+    if bad and os.path.exists(checkpointfile):
+      print("Keeping", args.outputfile, "and", checkpointfile+", run again with --resume to continue")
+    elif bad:
       try:
         os.remove(args.outputfile)
       except:
         pass
-
-
-from array import array
-import itertools
-import numpy as np
-
-import ROOT
-
-from lhefile import LHEFile_JHUGenVBFVH, LHEFile_Hwithdecay, LHEFile_VHHiggsdecay,LHEFile_HwithdecayOnly, LHEFile_Offshell4l,LHEFile_StableHiggs,LHEFile_StableHiggsZHHAWK,LHEFile_StableHiggsVH
-from mela import Mela, SimpleParticle_t, SimpleParticleCollection_t, TVar
-from pythonmelautils import MultiDimensionalCppArray, SelfDParameter, SelfDCoupling
-
-
-def tlvfromptetaphim(pt, eta, phi, m):
-  result = ROOT.TLorentzVector()
-  result.SetPtEtaPhiM(pt, eta, phi, m)
-  return result
-
-class Event(object):
-  doneinit = False
-  def __init__(self, mela, daughters, associated, mothers, isgen, weight=1):
-    self.daughters = daughters
-    self.associated = associated
-    self.mothers = mothers
-    self.isgen = isgen
-    self.weight = weight
-    self.mela = mela
-    self.mela.setInputEvent(daughters, associated, mothers, isgen)
-    self.doneinit = True
-
-  def __getattr__(self, attr):
-    return getattr(self.mela, attr)
-
-  def __setattr__(self, attr, value):
-    if self.doneinit:
-      return setattr(self.mela, attr, value)
-    return super(Event, self).__setattr__(attr, value)
-
-
-
-class LHEEvent(object, metaclass=abc.ABCMeta):
-  def __init__(self, event, isgen):
-    lines = event.split("\n")
-
-    self.weights = {}
-    for line in lines:
-      if "<wgt" not in line: continue
-      match = re.match("<wgt id='(.*)'>([0-9+Ee.-]*)</wgt>", line)
-      if match: self.weights[match.group(1)] = float(match.group(2))
-    lines = [line for line in lines if not ("<" in line or ">" in line or not line.split("#")[0].strip())]
-    nparticles, _, weight, _, _, _ = lines[0].split()
-
-    nparticles = int(nparticles)
-    self.weight = float(weight)
-    if nparticles != len(lines)-1:
-      raise ValueError("Wrong number of particles! Should be {}, have {}".format(nparticles, len(lines)-1))
-
-    daughters, associated, mothers = (SimpleParticleCollection_t(_) for _ in self.extracteventparticles(lines[1:], isgen))
-    if not list(mothers): mothers = None
-    self.daughters, self.associated, self.mothers, self.isgen = self.inputevent = InputEvent(daughters, associated, mothers, isgen)
-
-  @abc.abstractmethod
-  def extracteventparticles(cls, lines, isgen): "has to be a classmethod that returns daughters, associated, mothers"
-
-  def __iter__(self):
-    return iter(self.inputevent)
-
-
-class LHEEvent_Offshell4l(LHEEvent):
-  @classmethod
-  def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-        line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      if status == -1:
-        mothers.append(line)
-
-      if ( abs(id) in ( 25) or abs(id) in (25)  ) and status == 1:
-        daughters.append(line)
-        print("added daught")
-        flav4l = flav4l*abs(id)
-
-        #      if ( abs(id) in (11, 12, 13, 14, 15, 16) or abs(id) in (1, 2, 3, 4, 5)  ) and status == 1:
-        #       daughters.append(line)
-        #       flav4l = flav4l*abs(id)
-      #if abs(id) in (0, 1, 2, 3, 4, 5, 21) and status == 1:
-      #  associated.append(line)
-      #if abs(id) in (0, 1, 2, 3, 4, 5, 21) and status == 1:
-      #  associated.append(line)
-
-    #if len(daughters) == 4:
-      #print "flavour comp:",flav4l
-    #if len(daughters) != 4:
-    #  raise ValueError("Wrong number of daughters (expected {}, found {})\n\n".format(4, len(daughters))+"\n".join(lines))
-    if cls.nassociatedparticles is not None and len(associated) != cls.nassociatedparticles:
-      raise ValueError("Wrong number of associated particles (expected {}, found {})\n\n".format(cls.nassociatedparticles, len(associated))+"\n".join(lines))
-    if len(mothers) != 2:
-      raise ValueError("{} mothers in the event??\n\n".format(len(mothers))+"\n".join(lines))
-
-    if not isgen: mothers = None
-    return daughters, associated, mothers
-
-  nassociatedparticles = None
\ No newline at end of file
+    elif os.path.exists(checkpointfile):
+      os.remove(checkpointfile)
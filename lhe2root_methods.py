@@ -1,9 +1,12 @@
 import os
-import re
+import sys
+import time
+import subprocess
 import uproot
 import pandas as pd
 import numpy as np
 import mplhep as hep
+import lhe_compression
 import lhe_constants
 import lhefile_methods
 import matplotlib as mpl
@@ -36,7 +39,8 @@ def scale(counts, scaleto):
 
 
 def get_cross_section_from_LHE_file(LHE_file_path):
-    """Gets the cross section and its uncertainty from a given LHE file using regular expressions
+    """Gets the cross section and its uncertainty from the <init> block of a given LHE file.
+    Only the header is read (see lhefile_methods.read_header), and the processes of files with several are summed.
 
     Parameters
     ----------
@@ -48,21 +52,8 @@ def get_cross_section_from_LHE_file(LHE_file_path):
     Tuple[str, str]
         A tuple of strings containing the cross section and its uncertainty
     """
-    
-    cross_section = uncertainty = ""
-    
-    with open(LHE_file_path) as getting_cross_section:
-        head = getting_cross_section.read()
-        
-        #This regex was made by the very very helpful https://pythex.org/ (shoutout professor Upsorn Praphamontripong)
-        cross_finder = re.compile(r'<init>\n.+\n.+(\d+\.\d+E(\+|-)\d{2})\s+(\d+\.\d+E(\+|-)\d{2})\s+(\d+\.\d+E(\+|-)\d{2})(\d|\s)+</init>')
-        cross_section_match = re.search(cross_finder,head)
-        
-        cross_section = cross_section_match.group(1)
-        
-        uncertainty = cross_section_match.group(3)
-        
-    return cross_section, uncertainty #returns the cross section and its uncertainty        
+    cross_section, uncertainty = lhefile_methods.get_cross_section(LHE_file_path)
+    return "{:.8E}".format(cross_section), "{:.8E}".format(uncertainty) #returns the cross section and its uncertainty
 
 def check_for_MELA():
     """A function that checks whether or not you have the environment variables for MELA set up within your terminal
@@ -84,7 +75,129 @@ def check_for_MELA():
     return True
 
 
-def recursively_convert(current_directory, output_directory, argument, clean=False, verbose=False, exceptions=set(), write=""):
+def find_conversions(current_directory, output_directory, clean=False, exceptions=set()):
+    """This function will recurse through every directory and subdirectory in the place you call it,
+    and find every LHE file that should be converted to a ROOT file
+
+    Parameters
+    ----------
+    current_directory : str
+        The directory to start recursing downwards from
+    output_directory : str
+        The directory the ROOT files will be written to (ending in '/')
+    clean : bool, optional
+        If True, this function will remove any ROOT files it comes across, by default False
+    exceptions : set, optional
+        Any absolute path with this string in it will be ignored, by default set()
+
+    Returns
+    -------
+    list[Tuple[str, str]]
+        A list of (LHE file, output ROOT file) pairs
+    """
+    conversions = []
+
+    for candidate in os.listdir(current_directory):
+        candidate = os.fsdecode(candidate)
+
+        uncompressed = lhe_compression.strip_compression_suffix(candidate) #x.lhe.gz is converted like x.lhe
+        candidate_filename = uncompressed[:uncompressed.rfind('.')]
+
+        candidate = current_directory + '/' + candidate
+
+        is_exempt = False
+        for exemption in exceptions:
+            if exemption in candidate:
+                is_exempt = True
+
+        if (os.path.isdir(candidate)) and (not is_exempt): #convert all the LHE files in every directory below you
+            conversions += find_conversions(candidate, output_directory, clean, exceptions)
+
+        if not uncompressed.endswith('.lhe'):
+            if clean and candidate.split('.')[-1] == 'root':
+                lhe_constants.print_msg_box("Removing " + candidate, title="Cleaning directory " + current_directory)
+                os.remove(candidate)
+
+            continue
+
+        conversions.append((candidate, output_directory + 'LHE_' + candidate_filename + '.root'))
+
+    return conversions
+
+
+def run_conversions(conversions, argument, workers=1, verbose=False, poll_interval=1):
+    """This function runs lhe2root on a list of LHE files using a bounded pool of processes, largest files first.
+    A line is printed every time a conversion starts (with the number of events in its LHE file) or finishes, and the running conversions are shown
+    on a single updating line when the output is a terminal.
+
+    Parameters
+    ----------
+    conversions : list[Tuple[str, str]]
+        A list of (LHE file, output ROOT file) pairs, as given by find_conversions
+    argument : str
+        the lhe2root argument to use (see lhe_2_root_options in lhe_constants)
+    workers : int, optional
+        The maximum number of conversions to run at the same time, by default 1
+    verbose : bool, optional
+        If true, the output of lhe2root is shown, by default False
+    poll_interval : float, optional
+        The number of seconds between checks on the running conversions, by default 1
+
+    Returns
+    -------
+    dict
+        A dictionary of the exit code of every conversion that failed, with the LHE file as the key
+
+    Raises
+    ------
+    ValueError
+        If workers is less than 1
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1, not {}".format(workers))
+    pending = sorted(conversions, key=lambda conversion: os.path.getsize(conversion[0]), reverse=True)
+    running = {}
+    failures = {}
+    ntotal = len(pending)
+    ndone = 0
+    lhe2root_output = None if verbose else subprocess.DEVNULL
+    live = sys.stdout.isatty() and not verbose
+
+    def status(message):
+        if live:
+            print("\r\033[K", end="")
+        print("[{}/{}]".format(ndone, ntotal), message, flush=True)
+
+    while pending or running:
+        while pending and len(running) < workers:
+            candidate, output_file = pending.pop(0)
+            command = ["python3", "lhe2root.py", "--" + argument, output_file, candidate]
+            running[subprocess.Popen(command, stdout=lhe2root_output, stderr=lhe2root_output)] = (candidate, time.time())
+            #the events are counted once the conversion is running, so that the workers don't wait for a read of every file
+            status("started {} (N: {:e} events)".format(os.path.relpath(candidate), lhefile_methods.count_events(candidate)))
+
+        time.sleep(poll_interval)
+
+        for process in list(running):
+            if process.poll() is None:
+                continue
+            candidate, start_time = running.pop(process)
+            ndone += 1
+            if process.returncode:
+                failures[candidate] = process.returncode
+                status("FAILED  {} (exit code {}, {:.0f} s)".format(os.path.relpath(candidate), process.returncode, time.time() - start_time))
+            else:
+                status("done    {} ({:.0f} s)".format(os.path.relpath(candidate), time.time() - start_time))
+
+        if live and running:
+            now = time.time()
+            print("\r\033[Krunning: " + ", ".join("{} ({:.0f} s)".format(os.path.basename(candidate), now - start_time)
+                                                   for candidate, start_time in running.values()), end="", flush=True)
+
+    return failures
+
+
+def recursively_convert(current_directory, output_directory, argument, clean=False, verbose=False, exceptions=set(), write="", workers=1):
     """This function will recurse through every directory and subdirectory in the place you call it, 
     and attempt to convert those files to ROOT files using lhe2root
 
@@ -107,6 +220,8 @@ def recursively_convert(current_directory, output_directory, argument, clean=Fal
         Name your folders carefully!
     write : str, optional
         If a string, this will be the file that you will write the cross sections to. The file will be comma-separated, by default ""
+    workers : int, optional
+        The number of conversions to run in parallel, by default 1
 
     Returns
     -------
@@ -117,6 +232,8 @@ def recursively_convert(current_directory, output_directory, argument, clean=Fal
     ------
     FileNotFoundError
         If the output directory is not found/not a directory raises an error
+    RuntimeError
+        If any of the conversions failed. The cross sections are still written out first
     """
     
     if output_directory[-1] != '/':
@@ -126,64 +243,32 @@ def recursively_convert(current_directory, output_directory, argument, clean=Fal
         raise FileNotFoundError(output_directory + " is not a directory!")
     
     cross_sections = {}
+    conversions = find_conversions(current_directory, output_directory, clean, exceptions)
     
-    for candidate in os.listdir(current_directory):
-        # print(candidate)
-        candidate = os.fsdecode(candidate)
-        
-        candidate_filename = candidate[:candidate.rfind('.')]
-                
-        candidate = current_directory + '/' + candidate
-        # print(candidate)
-        
-        is_exempt = False
-        for exemption in exceptions:
-            if exemption in candidate:
-                is_exempt = True
+    for candidate, output_file in conversions:
+        cross_section, uncertainty = get_cross_section_from_LHE_file(candidate) #these are currently strings!
         
+        cross_sections[os.path.dirname(candidate) + '/' + os.path.basename(output_file)] = (cross_section, uncertainty)
         
-        if (os.path.isdir(candidate)) and (not is_exempt): #convert all the LHE files in every directory below you
-            one_folder_below = recursively_convert(candidate, argument, clean, verbose, exceptions)
-            cross_sections.update(one_folder_below)
-        
-        if candidate.split('.')[-1] != 'lhe':
-            if clean and candidate.split['.'][-1] == '.root':
-                lhe_constants.print_msg_box("Removing " + candidate, title="Cleaning directory " + current_directory)
-                os.remove(candidate)
-                
-            continue
+        titlestr = "Generating ROOT file for ./" + os.path.relpath(candidate)
         
-        else:
-            output_filename = 'LHE_' + candidate_filename + '.root'
-            
-            running_str = "python3 lhe2root.py --" + argument + " " + output_directory + output_filename + ' '
-            running_str += candidate
-            
-            if not verbose:
-                running_str += ' > /dev/null 2>&1'
-            
-            cross_section, uncertainty = get_cross_section_from_LHE_file(candidate) #these are currently strings!
-            
-            cross_sections[current_directory + '/' + output_filename] = (cross_section, uncertainty)
-            
-            titlestr = "Generating ROOT file for ./" + os.path.relpath(candidate)
-            
-            number_events = len(lhefile_methods.get_all_events(candidate))
-            
-            lhe_constants.print_msg_box("Input name: " + candidate.split('/')[-1] + #This is the big message box seen per LHE file found
-                "\nOutput: " + str(os.path.relpath(output_directory + output_filename)) + 
-                "\nArgument: " + argument + 
-                "\n\u03C3: " + cross_section + " \u00b1 " + uncertainty + 
-                "\nN: " + "{:e}".format(number_events) + " events",
-                title=titlestr, width=len(titlestr))
-            
-            os.system(running_str)
+        lhe_constants.print_msg_box("Input name: " + candidate.split('/')[-1] + #This is the big message box seen per LHE file found
+            "\nOutput: " + str(os.path.relpath(output_file)) + 
+            "\nArgument: " + argument + 
+            "\n\u03C3: " + cross_section + " \u00b1 " + uncertainty,
+            title=titlestr, width=len(titlestr))
+    
+    failures = run_conversions(conversions, argument, workers=workers, verbose=verbose)
     
     if write:
         with open(output_directory + write, "w+") as f:
             f.write("Filename, Cross Section, Uncertainty\n")
             for fname, (crosssection, uncertainty) in cross_sections.items():
                 f.write(fname + ', ' + crosssection + ', ' + uncertainty + '\n')
+    
+    if failures:
+        raise RuntimeError("{} of {} conversions failed:\n".format(len(failures), len(conversions)) +
+                           "\n".join("{} (exit code {})".format(candidate, code) for candidate, code in failures.items()))
                 
     return cross_sections
 
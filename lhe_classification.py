@@ -0,0 +1,241 @@
+import collections
+import numpy as np
+
+#PDG id sets used to classify particles
+QUARKS = frozenset(range(1, 7))
+LEPTONS = frozenset(range(11, 17))
+GLUON = 21
+PHOTON = 22
+JET_IDS = QUARKS | {GLUON} #ids that are written as 0 (unknown jet) when the flavor is not used
+FINAL_STATE_IDS = QUARKS | LEPTONS | {GLUON, PHOTON}
+HIGGS_LIKE = frozenset((25, 39)) #the decay chains of these are the daughters
+VECTOR_BOSONS = frozenset((23, 24))
+STABLEHIGGS_ASSOCIATED = frozenset((0, 1, 2, 3, 4, 5, GLUON)) | LEPTONS
+OFFSHELL_ASSOCIATED = frozenset((0, 1, 2, 3, 4, 5, GLUON))
+
+CATEGORIES = ("daughters", "associated", "mothers")
+
+#The particles of one event. momenta holds the (px, py, pz, E) of each particle and is not needed for the classification.
+ParticleColumns = collections.namedtuple("ParticleColumns", "ids statuses mother1s mother2s momenta", defaults=(None,))
+
+#A condition on a particle. Every field that is not None has to be satisfied:
+#  statuses, ids, absids: the particle's status, id and |id| have to be in the set
+#  fromhiggs: whether following the particle's single mothers (mother1 == mother2) reaches a HIGGS_LIKE particle
+#             before reaching a particle with two different mothers
+#  parentabsids: the particle has a single mother and its |id| is in the set
+#  grandparentids, notgrandparentids: the id of the single mother's mother1 is (not) in the set (0 if there is none)
+Selection = collections.namedtuple(
+    "Selection", "statuses ids absids fromhiggs parentabsids grandparentids notgrandparentids", defaults=(None,) * 7
+)
+
+#A classification rule is an ordered tuple of (category, Selection) pairs. Each particle goes into the first category it matches.
+HWITHDECAY = (
+    ("mothers", Selection(statuses={-1})),
+    ("daughters", Selection(statuses={1}, absids=FINAL_STATE_IDS, fromhiggs=True)),
+    ("associated", Selection(statuses={1}, absids=FINAL_STATE_IDS, fromhiggs=False)),
+)
+VHHIGGSDECAY = (
+    ("mothers", Selection(statuses={-1})),
+    ("associated", Selection(statuses={1}, absids=FINAL_STATE_IDS, parentabsids=VECTOR_BOSONS, notgrandparentids={25})),
+    ("daughters", Selection(statuses={1}, absids=FINAL_STATE_IDS, parentabsids={23}, grandparentids={25})),
+)
+HWITHDECAYONLY = (
+    ("associated", Selection(absids={PHOTON})),
+    ("daughters", Selection(absids=LEPTONS)),
+)
+STABLEHIGGS = (
+    ("mothers", Selection(statuses={-1})),
+    ("daughters", Selection(ids={25})),
+    ("associated", Selection(statuses={1}, absids=STABLEHIGGS_ASSOCIATED)),
+)
+STABLEHIGGSVH = (
+    ("mothers", Selection(statuses={-1})),
+    ("daughters", Selection(ids={25})),
+    ("associated", Selection(statuses={1}, absids=FINAL_STATE_IDS, parentabsids=VECTOR_BOSONS, notgrandparentids={25})),
+)
+STABLEHIGGSZHHAWK = (
+    ("mothers", Selection(statuses={-1})),
+    ("daughters", Selection(ids={25})),
+    ("associated", Selection(statuses={1}, absids=STABLEHIGGS_ASSOCIATED | {PHOTON})),
+)
+OFFSHELL4L = (
+    ("mothers", Selection(statuses={-1})),
+    ("daughters", Selection(statuses={1}, absids=LEPTONS)),
+    ("associated", Selection(statuses={1}, absids=OFFSHELL_ASSOCIATED)),
+)
+
+
+def _needsancestry(rule):
+    return any(
+        selection.fromhiggs is not None or selection.parentabsids is not None
+        or selection.grandparentids is not None or selection.notgrandparentids is not None
+        for _, selection in rule
+    )
+
+
+def build_ancestry(particles):
+    """Resolves the mother graph of one event in a single pass
+
+    Parameters
+    ----------
+    particles : ParticleColumns
+        The ids, statuses and (1-based) mothers of the particles in the event
+
+    Returns
+    -------
+    Tuple[list[int], list[int], list[bool]]
+        For every particle: the id of its single mother (0 if mother1 != mother2 or it has none),
+        the id of that mother's mother1 (0 if there is none), and whether its chain of single mothers reaches a HIGGS_LIKE particle
+
+    Raises
+    ------
+    ValueError
+        If the chain of mothers loops back on itself
+    """
+    ids, mother1s, mother2s = particles.ids, particles.mother1s, particles.mother2s
+    nparticles = len(ids)
+    parentids, grandparentids = [0] * nparticles, [0] * nparticles
+    fromhiggs = [None] * nparticles
+    for i in range(nparticles):
+        mother1 = mother1s[i]
+        if mother1 == mother2s[i] and mother1:
+            parentids[i] = ids[mother1 - 1]
+            grandmother = mother1s[mother1 - 1]
+            grandparentids[i] = ids[grandmother - 1] if grandmother else 0
+
+        #follow the single mothers until the answer is known, then fill it in for the whole chain
+        chain, j = [], i
+        while fromhiggs[j] is None:
+            mother1 = mother1s[j]
+            if mother1 != mother2s[j] or not mother1:
+                fromhiggs[j] = False
+            elif ids[mother1 - 1] in HIGGS_LIKE:
+                fromhiggs[j] = True
+            else:
+                chain.append(j)
+                j = mother1 - 1
+                if len(chain) > nparticles:
+                    raise ValueError("The mothers of particle {} form a loop".format(i + 1))
+        for k in chain:
+            fromhiggs[k] = fromhiggs[j]
+
+    return parentids, grandparentids, fromhiggs
+
+
+def _matches(selection, particleid, status, parentid, grandparentid, fromhiggs):
+    return (
+        (selection.statuses is None or status in selection.statuses)
+        and (selection.ids is None or particleid in selection.ids)
+        and (selection.absids is None or abs(particleid) in selection.absids)
+        and (selection.fromhiggs is None or fromhiggs == selection.fromhiggs)
+        and (selection.parentabsids is None or abs(parentid) in selection.parentabsids)
+        and (selection.grandparentids is None or grandparentid in selection.grandparentids)
+        and (selection.notgrandparentids is None or grandparentid not in selection.notgrandparentids)
+    )
+
+
+def classify_particles(rule, particles):
+    """Classifies the particles of one event
+
+    Parameters
+    ----------
+    rule : tuple
+        The classification rule, an ordered tuple of (category, Selection) pairs (i.e. HWITHDECAY)
+    particles : ParticleColumns
+        The ids, statuses and (1-based) mothers of the particles in the event
+
+    Returns
+    -------
+    dict
+        The (0-based, in file order) indices of the particles in each of CATEGORIES
+    """
+    selected = {category: [] for category in CATEGORIES}
+    nparticles = len(particles.ids)
+    if _needsancestry(rule):
+        parentids, grandparentids, fromhiggs = build_ancestry(particles)
+    else:
+        parentids = grandparentids = fromhiggs = [None] * nparticles
+
+    for i, (particleid, status, parentid, grandparentid, higgschain) in enumerate(zip(particles.ids, particles.statuses, parentids, grandparentids, fromhiggs)):
+        for category, selection in rule:
+            if _matches(selection, particleid, status, parentid, grandparentid, higgschain):
+                selected[category].append(i)
+                break
+    return selected
+
+
+def build_batch_ancestry(batch):
+    """Resolves the mother graphs of a whole batch of events at once, see build_ancestry
+
+    Parameters
+    ----------
+    batch : lhe_columnar.EventBatch
+        The events
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        The same three columns as build_ancestry, for every particle in the batch
+    """
+    ids, mother1s, mother2s = batch.id, batch.mother1, batch.mother2
+    eventstarts = np.repeat(batch.offsets[:-1], batch.nparticles)
+    single = (mother1s == mother2s) & (mother1s > 0)
+    parent = np.where(single, eventstarts + mother1s - 1, 0)
+    parentids = np.where(single, ids[parent], 0)
+    grandmother1s = mother1s[parent]
+    grandparentids = np.where(single & (grandmother1s > 0), ids[eventstarts + grandmother1s - 1], 0)
+
+    higgsparent = single & np.isin(parentids, list(HIGGS_LIKE))
+    fromhiggs = higgsparent.copy()
+    pending = np.flatnonzero(single & ~higgsparent)
+    target = parent[pending]
+    for _ in range(len(ids) + 1):
+        if not len(pending):
+            break
+        ended = ~single[target] | higgsparent[target]
+        fromhiggs[pending[ended]] = higgsparent[target[ended]]
+        pending, target = pending[~ended], parent[target[~ended]]
+    else:
+        raise ValueError("The mothers of some particles form a loop")
+
+    return parentids, grandparentids, fromhiggs
+
+
+def classify_batch(rule, batch):
+    """Classifies every particle in a batch of events at once, with the same result as classify_particles
+
+    Parameters
+    ----------
+    rule : tuple
+        The classification rule, an ordered tuple of (category, Selection) pairs (i.e. HWITHDECAY)
+    batch : lhe_columnar.EventBatch
+        The events
+
+    Returns
+    -------
+    numpy.ndarray
+        For every particle, the index in CATEGORIES of its category, or -1 if it is in none of them
+    """
+    ids, statuses = batch.id, batch.status
+    if _needsancestry(rule):
+        parentids, grandparentids, fromhiggs = build_batch_ancestry(batch)
+
+    categories = np.full(len(ids), -1, dtype=np.int8)
+    for category, selection in rule:
+        mask = categories == -1
+        if selection.statuses is not None:
+            mask &= np.isin(statuses, list(selection.statuses))
+        if selection.ids is not None:
+            mask &= np.isin(ids, list(selection.ids))
+        if selection.absids is not None:
+            mask &= np.isin(np.abs(ids), list(selection.absids))
+        if selection.fromhiggs is not None:
+            mask &= fromhiggs == selection.fromhiggs
+        if selection.parentabsids is not None:
+            mask &= np.isin(np.abs(parentids), list(selection.parentabsids))
+        if selection.grandparentids is not None:
+            mask &= np.isin(grandparentids, list(selection.grandparentids))
+        if selection.notgrandparentids is not None:
+            mask &= ~np.isin(grandparentids, list(selection.notgrandparentids))
+        categories[mask] = CATEGORIES.index(category)
+    return categories
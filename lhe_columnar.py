@@ -0,0 +1,119 @@
+import collections
+import itertools
+import numpy as np
+import lhefile_methods
+
+#The columns of the event header line <NUP IDPRUP XWGTUP SCALUP AQEDUP AQCDUP> that are kept
+EVENT_COLUMNS = ("nparticles", "weight", "scale")
+#The columns of a particle line <IDUP ISTUP MOTHUP(2) ICOLUP(2) PUP(5) VTIMUP SPINUP> that are kept
+PARTICLE_COLUMNS = ("id", "status", "mother1", "mother2", "px", "py", "pz", "E", "m")
+
+HEADER_TOKENS = 6
+PARTICLE_TOKENS = 13
+_PARTICLE_COLUMN_INDICES = (0, 1, 2, 3, 6, 7, 8, 9, 10)
+_INTEGER_COLUMNS = {"id", "status", "mother1", "mother2"}
+
+#The particles of event i are entries offsets[i]:offsets[i+1] of every particle column.
+#mother1/mother2 are 1-based indices within the event, exactly as written in the LHE file.
+EventBatch = collections.namedtuple("EventBatch", ("offsets", "linenumbers") + EVENT_COLUMNS + PARTICLE_COLUMNS)
+
+
+def _particle_block(event):
+    """Cuts an <event> block down to the header line and the particle lines
+
+    Parameters
+    ----------
+    event : bytes
+        Everything from <event> to </event>
+
+    Returns
+    -------
+    bytes
+        The header line followed by the particle lines, without tags or comments
+    """
+    start = event.index(b"\n") + 1 #skip the <event> line
+    end = event.find(b"<", start) #the particles end at the first tag (<rwgt>, <mgrwt>, </event>, ...)
+    block = event[start:end]
+    if b"#" in block:
+        block = b"\n".join(line for line in block.split(b"\n") if line.split(b"#")[0].strip())
+    return block.strip()
+
+
+def parse_event_batch(events, linenumbers=None):
+    """Parses a list of LHE events into flat NumPy columns in one go.
+    The only work done per event is to locate the particle lines. All the numbers are converted at once.
+
+    Parameters
+    ----------
+    events : list[bytes]
+        The event blocks, as yielded by lhefile_methods.iter_event_blocks
+    linenumbers : list[int], optional
+        The line number of the </event> tag of each event, used in error messages, by default None
+
+    Returns
+    -------
+    EventBatch
+        The parsed columns
+
+    Raises
+    ------
+    ValueError
+        If the number of particle lines in an event does not match its header
+    """
+    if linenumbers is None:
+        linenumbers = [None] * len(events)
+
+    blocks = [_particle_block(event) for event in events]
+    nparticles = np.array([int(block.split(None, 1)[0]) for block in blocks], dtype=np.int64)
+    for block, n, linenumber in zip(blocks, nparticles, linenumbers):
+        if block.count(b"\n") != n:
+            raise ValueError("Wrong number of particles! Should be {}, have {} (event ending on line {})".format(n, block.count(b"\n"), linenumber))
+
+    values = np.array(b"\n".join(blocks).split(), dtype=np.float64)
+    ntokens = HEADER_TOKENS + PARTICLE_TOKENS * nparticles
+    if len(values) != ntokens.sum():
+        raise ValueError("Expected {} numbers per particle line, found a malformed line in the events ending on lines {}-{}".format(PARTICLE_TOKENS, linenumbers[0], linenumbers[-1]))
+
+    eventstarts = np.cumsum(ntokens) - ntokens
+    header = values[eventstarts[:, None] + np.arange(HEADER_TOKENS)]
+    isparticle = np.ones(len(values), dtype=bool)
+    isparticle[eventstarts[:, None] + np.arange(HEADER_TOKENS)] = False
+    particles = values[isparticle].reshape(-1, PARTICLE_TOKENS)
+
+    columns = {
+        "offsets": np.concatenate(([0], np.cumsum(nparticles))),
+        "linenumbers": np.array(linenumbers),
+        "nparticles": nparticles,
+        "weight": header[:, 2],
+        "scale": header[:, 3],
+    }
+    for name, index in zip(PARTICLE_COLUMNS, _PARTICLE_COLUMN_INDICES):
+        column = particles[:, index]
+        columns[name] = column.astype(np.int64) if name in _INTEGER_COLUMNS else column
+    return EventBatch(**columns)
+
+
+def iter_batches(f, batch_size, blocksize=lhefile_methods.DEFAULT_BLOCKSIZE):
+    """Streams an LHE file and yields its events as EventBatch objects
+
+    Parameters
+    ----------
+    f : file
+        An LHE file opened in binary mode
+    batch_size : int
+        The number of events per batch (the last batch may be smaller)
+    blocksize : int, optional
+        The number of bytes to read at a time, by default lhefile_methods.DEFAULT_BLOCKSIZE
+
+    Yields
+    ------
+    EventBatch
+        The parsed columns for each batch of events
+    """
+    eventblocks = lhefile_methods.iter_event_blocks(f, blocksize)
+    while True:
+        batch = list(itertools.islice(eventblocks, batch_size))
+        if not batch:
+            return
+        linenumbers, events = zip(*batch)
+        yield parse_event_batch(events, linenumbers)
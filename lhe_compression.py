@@ -0,0 +1,362 @@
+import bz2
+import collections
+import concurrent.futures
+import gzip
+import io
+import itertools
+import lzma
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError: #only needed for .zst files
+    zstandard = None
+
+#The magic bytes at the start of each supported compression format
+COMPRESSION_MAGIC = {
+    "gzip": b"\x1f\x8b",
+    "bz2": b"BZh",
+    "xz": b"\xfd7zXZ\x00",
+    "zstd": b"\x28\xb5\x2f\xfd",
+}
+#File name suffixes that compressed LHE files usually have
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+CHUNKSIZE = 1 << 20 #the size of the decompressed chunks handed from the background thread to the reader
+PARALLEL_TASKSIZE = 1 << 20 #the amount of compressed data decompressed by a single task in parallel mode
+
+_ZSTD_SKIPPABLE_MAGIC = range(0x184D2A50, 0x184D2A60)
+
+
+def detect_compression(lhefile):
+    """Detects the compression of a file from its magic bytes
+
+    Parameters
+    ----------
+    lhefile : str
+        The file you are working with
+
+    Returns
+    -------
+    Union[str, None]
+        "gzip", "bz2", "xz" or "zstd", or None if the file is not compressed
+    """
+    with open(lhefile, "rb") as f:
+        head = f.read(max(len(magic) for magic in COMPRESSION_MAGIC.values()))
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def strip_compression_suffix(filename):
+    """Removes a compression suffix (.gz, .zst, ...) from a file name, if there is one
+
+    Parameters
+    ----------
+    filename : str
+        The file name
+
+    Returns
+    -------
+    str
+        The file name without its compression suffix
+    """
+    for suffix in COMPRESSION_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def open_lhe(lhefile, threads=None):
+    """Opens an LHE file for binary reading, decompressing it on the fly if needed.
+    The compression is detected from the magic bytes, not from the file name.
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+    threads : int, optional
+        The number of threads used to decompress files made of many independent gzip members (bgzip) or zstd frames (pzstd),
+        by default os.cpu_count()
+
+    Returns
+    -------
+    file
+        A binary file object. For compressed files this is a DecompressedFile.
+    """
+    compression = detect_compression(lhefile)
+    if compression is None:
+        return open(lhefile, "rb")
+    return DecompressedFile(lhefile, compression, threads)
+
+
+def _read_chunks(f):
+    """Reads a file object in chunks of CHUNKSIZE until it runs out"""
+    while True:
+        chunk = f.read(CHUNKSIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bgzf_member_size(data, offset):
+    """Gets the total size of the gzip member starting at offset from its BGZF "BC" extra field
+
+    Parameters
+    ----------
+    data : mmap.mmap
+        The compressed file
+    offset : int
+        The offset of the member
+
+    Returns
+    -------
+    Union[int, None]
+        The size of the member, or None if it does not have a BGZF extra field
+    """
+    if data[offset:offset+4] != b"\x1f\x8b\x08\x04": #gzip, deflate, FEXTRA set
+        return None
+    xlen, = struct.unpack_from("<H", data, offset + 10)
+    position, end = offset + 12, offset + 12 + xlen
+    while position + 4 <= end:
+        subfieldid, subfieldlength = data[position:position+2], struct.unpack_from("<H", data, position + 2)[0]
+        if subfieldid == b"BC" and subfieldlength == 2:
+            return struct.unpack_from("<H", data, position + 4)[0] + 1
+        position += 4 + subfieldlength
+    return None
+
+
+def _bgzf_members(data):
+    """Yields the (start, end) offsets of every member of a BGZF (blocked gzip) file"""
+    offset = 0
+    while offset < len(data):
+        size = _bgzf_member_size(data, offset)
+        if size is None:
+            raise ValueError("Gzip member at byte {} has no BGZF block size".format(offset))
+        yield offset, offset + size
+        offset += size
+
+
+def _zstd_frames(data):
+    """Yields the (start, end) offsets of every zstd frame, walking the frame and block headers without decompressing anything"""
+    offset = 0
+    while offset < len(data):
+        magic, = struct.unpack_from("<I", data, offset)
+        if magic in _ZSTD_SKIPPABLE_MAGIC:
+            offset += 8 + struct.unpack_from("<I", data, offset + 4)[0]
+            continue
+        if data[offset:offset+4] != COMPRESSION_MAGIC["zstd"]:
+            raise ValueError("Expected a zstd frame at byte {}".format(offset))
+        descriptor = data[offset + 4]
+        singlesegment = descriptor >> 5 & 1
+        contentsizebytes = (singlesegment, 2, 4, 8)[descriptor >> 6]
+        dictionaryidbytes = (0, 1, 2, 4)[descriptor & 3]
+        position = offset + 5 + (not singlesegment) + dictionaryidbytes + contentsizebytes
+        while True:
+            blockheader = int.from_bytes(data[position:position+3], "little")
+            blocktype, blocksize = blockheader >> 1 & 3, blockheader >> 3
+            position += 3 + (1 if blocktype == 1 else blocksize) #RLE blocks store a single byte
+            if blockheader & 1:
+                break
+        if descriptor >> 2 & 1:
+            position += 4 #content checksum
+        yield offset, position
+        offset = position
+
+
+def _group(ranges):
+    """Groups consecutive (start, end) ranges into lists that cover at least PARALLEL_TASKSIZE bytes"""
+    group, size = [], 0
+    for start, end in ranges:
+        group.append((start, end))
+        size += end - start
+        if size >= PARALLEL_TASKSIZE:
+            yield group
+            group, size = [], 0
+    if group:
+        yield group
+
+
+def _decompress_gzip_members(data, members):
+    return b"".join(zlib.decompress(data[start:end], 31) for start, end in members)
+
+
+def _decompress_zstd_frames(data, frames):
+    decompressor = zstandard.ZstdDecompressor()
+    return b"".join(decompressor.decompressobj().decompress(data[start:end]) for start, end in frames)
+
+
+def _parallel_chunks(data, groups, decompress, threads):
+    """Decompresses groups of independent members on a pool of threads, yielding the results in order.
+    zlib and zstandard release the GIL while they work, so the threads really run at the same time.
+    At most 2*threads groups are in flight, which keeps the memory use bounded."""
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        for group in groups:
+            pending.append(pool.submit(decompress, data, group))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _decompressed_chunks(lhefile, compression, threads):
+    """Yields the decompressed contents of a file in chunks
+
+    Parameters
+    ----------
+    lhefile : str
+        The compressed file
+    compression : str
+        The compression, as returned by detect_compression
+    threads : int
+        The number of threads to use for files made of many independent members or frames
+
+    Yields
+    ------
+    bytes
+        The next chunk of decompressed data
+    """
+    if compression == "bz2":
+        with bz2.open(lhefile, "rb") as f:
+            yield from _read_chunks(f)
+    elif compression == "xz":
+        with lzma.open(lhefile, "rb") as f:
+            yield from _read_chunks(f)
+    elif compression == "gzip":
+        with open(lhefile, "rb") as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if threads > 1 and _bgzf_member_size(data, 0) is not None:
+                yield from _parallel_chunks(data, _group(_bgzf_members(data)), _decompress_gzip_members, threads)
+                return
+        #plain gzip (a single member, or members that can only be found by inflating them) is decompressed as a stream
+        with gzip.open(lhefile, "rb") as f:
+            yield from _read_chunks(f)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("Reading zstd compressed LHE files needs the zstandard package")
+        with open(lhefile, "rb") as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            frames = _zstd_frames(data)
+            firstframes = [next(frames, None), next(frames, None)]
+            if threads > 1 and firstframes[1] is not None:
+                yield from _parallel_chunks(data, _group(itertools.chain(firstframes, frames)), _decompress_zstd_frames, threads)
+                return
+        with open(lhefile, "rb") as raw:
+            yield from _read_chunks(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True))
+    else:
+        raise ValueError("Unknown compression " + str(compression))
+
+
+class DecompressedFile(object):
+    """A read-only binary file object with the decompressed contents of a compressed LHE file.
+    Decompression runs on a background thread a few chunks ahead of the reader, so it overlaps with parsing.
+    Seeking forward skips ahead in the stream, and seeking backward starts decompressing again from the beginning.
+    """
+
+    def __init__(self, lhefile, compression, threads=None, prefetch=8):
+        """
+        Parameters
+        ----------
+        lhefile : str
+            The compressed file
+        compression : str
+            The compression, as returned by detect_compression
+        threads : int, optional
+            The number of threads to use for files made of many independent members or frames, by default os.cpu_count()
+        prefetch : int, optional
+            The maximum number of decompressed chunks waiting to be read, by default 8
+        """
+        self.name = lhefile
+        self.compression = compression
+        self.threads = threads or os.cpu_count() or 1
+        self.prefetch = prefetch
+        self.closed = False
+        self._start()
+
+    def _start(self):
+        self._queue = queue.Queue(self.prefetch)
+        self._stop = threading.Event()
+        self._buffer = b""
+        self._position = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._produce, args=(self._queue, self._stop), daemon=True)
+        self._thread.start()
+
+    def _produce(self, chunkqueue, stop):
+        chunks = _decompressed_chunks(self.name, self.compression, self.threads)
+        try:
+            for chunk in chunks:
+                if not self._put(chunkqueue, stop, chunk):
+                    return
+            self._put(chunkqueue, stop, None)
+        except BaseException as e:
+            self._put(chunkqueue, stop, e)
+        finally:
+            chunks.close()
+
+    @staticmethod
+    def _put(chunkqueue, stop, item):
+        while not stop.is_set():
+            try:
+                chunkqueue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(self, n=-1):
+        chunks, size = [self._buffer], len(self._buffer)
+        while (n is None or n < 0 or size < n) and not self._eof:
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            else:
+                chunks.append(item)
+                size += len(item)
+        data = b"".join(chunks)
+        if n is not None and n >= 0:
+            data, self._buffer = data[:n], data[n:]
+        else:
+            self._buffer = b""
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can't seek from the end of a compressed file")
+        if offset < self._position:
+            self._stop.set()
+            self._start()
+        while self._position < offset:
+            if not self.read(min(offset - self._position, CHUNKSIZE)):
+                break
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._stop.set()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
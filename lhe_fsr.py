@@ -0,0 +1,128 @@
+import numpy as np
+
+import lhe_classification
+import lhe_kinematics
+
+DEFAULT_CHUNKSIZE = 1000 #the number of events whose photons are matched at once
+
+
+def match_photons(leptons, leptonmask, photons, photonmask, maxdeltar=None):
+    """Finds the nearest lepton (in DeltaR) to every photon, for a whole chunk of events at once
+
+    Parameters
+    ----------
+    leptons : numpy.ndarray
+        The lepton four-vectors, shape (nevents, nleptons, 4), padded to the largest number of leptons in an event
+    leptonmask : numpy.ndarray
+        Which entries of leptons are real leptons and not padding, shape (nevents, nleptons)
+    photons : numpy.ndarray
+        The photon four-vectors, shape (nevents, nphotons, 4), padded the same way
+    photonmask : numpy.ndarray
+        Which entries of photons are real photons, shape (nevents, nphotons)
+    maxdeltar : float, optional
+        Only match photons to leptons closer than this, by default None (the nearest lepton, however far)
+
+    Returns
+    -------
+    numpy.ndarray
+        For every photon, the index of its lepton, or -1 if it isn't matched (padding, no leptons, or outside maxdeltar).
+        Shape (nevents, nphotons).
+    """
+    if not leptons.shape[1]:
+        return np.full(photonmask.shape, -1)
+    deltar = lhe_kinematics.deltar(photons[:, :, None, :], leptons[:, None, :, :])
+    deltar = np.where(leptonmask[:, None, :], deltar, np.inf)
+    nearest = np.argmin(deltar, axis=2)
+    mindeltar = np.take_along_axis(deltar, nearest[:, :, None], axis=2)[:, :, 0]
+    matched = photonmask & np.isfinite(mindeltar)
+    if maxdeltar is not None:
+        matched &= mindeltar < maxdeltar
+    return np.where(matched, nearest, -1)
+
+
+def _pad(vectors, n):
+    """Stacks per-event lists of four-vectors into a (nevents, n, 4) array and its mask"""
+    padded = np.zeros((len(vectors), n, 4))
+    mask = np.zeros((len(vectors), n), dtype=bool)
+    for i, eventvectors in enumerate(vectors):
+        if eventvectors:
+            padded[i, :len(eventvectors)] = eventvectors
+            mask[i, :len(eventvectors)] = True
+    return padded, mask
+
+
+class PhotonMerger(object):
+    """Adds final state radiation photons to their nearest lepton, before the particles are handed to MELA.
+    The photons are the associated particles with id 22. Every photon is matched to the nearest lepton before any photon is added,
+    so events with several photons give the same result regardless of the order of the photons.
+    """
+
+    def __init__(self, target="daughters", maxdeltar=None, keepphotons=True, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Parameters
+        ----------
+        target : str, optional
+            The collection the leptons are in: "daughters" (i.e. Prophecy4f H -> 4l, where every daughter is a lepton)
+            or "associated" (i.e. HAWK ZH, where the photons are merged into the other associated particles), by default "daughters"
+        maxdeltar : float, optional
+            Only merge photons within this DeltaR of a lepton, by default None (always merge into the nearest lepton)
+        keepphotons : bool, optional
+            Keep the merged photons in the associated particles, by default True. Photons that aren't merged are always kept.
+        chunksize : int, optional
+            The number of events that LHEFileBase collects before merging their photons together, by default DEFAULT_CHUNKSIZE
+        """
+        if target not in ("daughters", "associated"):
+            raise ValueError("Can only merge photons into the daughters or the associated particles, not " + str(target))
+        self.target = target
+        self.maxdeltar = maxdeltar
+        self.keepphotons = keepphotons
+        self.chunksize = chunksize
+
+    def merge(self, particles):
+        """Merges the photons of a chunk of events
+
+        Parameters
+        ----------
+        particles : list[tuple]
+            (daughters, associated, mothers) for every event, each a list of (id, (px, py, pz, E)) as returned by
+            LHEEvent.extracteventparticles (mothers can be None)
+
+        Returns
+        -------
+        list[tuple]
+            The new (daughters, associated, mothers) for every event, the same objects for events without photons
+        """
+        targetindex = lhe_classification.CATEGORIES.index(self.target)
+        photonindices, leptonindices = [], []
+        for eventparticles in particles:
+            associated = eventparticles[1]
+            photonindices.append([i for i, (particleid, _) in enumerate(associated) if particleid == lhe_classification.PHOTON])
+            leptonindices.append([
+                i for i, (particleid, _) in enumerate(eventparticles[targetindex])
+                if targetindex != 1 or particleid != lhe_classification.PHOTON
+            ])
+        nphotons = max((len(_) for _ in photonindices), default=0)
+        if not nphotons:
+            return list(particles)
+
+        photons, photonmask = _pad([[eventparticles[1][i][1] for i in indices] for eventparticles, indices in zip(particles, photonindices)], nphotons)
+        leptons, leptonmask = _pad(
+            [[eventparticles[targetindex][i][1] for i in indices] for eventparticles, indices in zip(particles, leptonindices)],
+            max(len(_) for _ in leptonindices),
+        )
+        matches = match_photons(leptons, leptonmask, photons, photonmask, self.maxdeltar)
+        merged = leptons.copy()
+        events, photonslots = np.nonzero(matches >= 0)
+        np.add.at(merged, (events, matches[events, photonslots]), photons[events, photonslots])
+
+        result = list(particles)
+        for i in np.unique(events):
+            eventparticles = [list(_) if _ is not None else None for _ in particles[i]]
+            target = eventparticles[targetindex]
+            for slot, j in enumerate(leptonindices[i]):
+                target[j] = (target[j][0], tuple(merged[i, slot].tolist()))
+            if not self.keepphotons:
+                mergedphotons = {photonindices[i][slot] for slot in photonslots[events == i]}
+                eventparticles[1] = [particle for j, particle in enumerate(eventparticles[1]) if j not in mergedphotons]
+            result[i] = tuple(eventparticles)
+        return result
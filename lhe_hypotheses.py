@@ -0,0 +1,200 @@
+import collections
+
+#One probability written to the output.
+#  name: the branch it goes into
+#  hypothesis: the TVar hypothesis passed to setProcess, by name (i.e. "SelfDefine_spin0")
+#  couplings: the couplings set before computing it, as ((name, value), ...)
+#  subtract: the names of earlier terms that are subtracted from the result, which turns a mixture into an interference term
+Term = collections.namedtuple("Term", "name hypothesis couplings subtract", defaults=((),))
+
+#MELA resets the couplings after every probability, so every term lists all of the couplings it needs
+DECAY_TERMS = (
+    Term("pg2", "SelfDefine_spin0", (("ghz2", 1),)),
+    Term("pg1", "HSMHiggs", (("ghz1", 2),)),
+    Term("pg4", "SelfDefine_spin0", (("ghz4", 1),)),
+    Term("pg1g4", "SelfDefine_spin0", (("ghz1", 1), ("ghz4", 1)), ("pg1", "pg4")),
+    Term("pg1g2", "SelfDefine_spin0", (("ghz1", 1), ("ghz2", 1)), ("pg1", "pg2")),
+)
+
+PRODUCTION_TERMS = (
+    Term("pg2", "SelfDefine_spin0", (("ghz1", 0), ("ghz2", 1))),
+    Term("pg1", "HSMHiggs", (("ghz1", 1),)),
+    Term("pg4", "SelfDefine_spin0", (("ghz4", 1),)),
+    Term("pg1g4", "SelfDefine_spin0", (("ghz1", 1), ("ghz4", 1)), ("pg1", "pg4")),
+    Term("pg1g2", "SelfDefine_spin0", (("ghz1", 1), ("ghz2", 1)), ("pg1", "pg2")),
+    Term("pg2za", "SelfDefine_spin0", (("ghz1", 0), ("ghzgs2", 1))),
+    Term("pg4za", "SelfDefine_spin0", (("ghz1", 0), ("ghzgs4", 1))),
+    Term("pg1g2za", "SelfDefine_spin0", (("ghz1", 1), ("ghzgs2", 1)), ("pg1", "pg2za")),
+    Term("pg1g4za", "SelfDefine_spin0", (("ghz1", 1), ("ghzgs4", 1)), ("pg1", "pg4za")),
+    Term("pg2aa", "SelfDefine_spin0", (("ghz1", 0), ("ghgsgs2", 1))),
+    Term("pg4aa", "SelfDefine_spin0", (("ghz1", 0), ("ghgsgs4", 1))),
+    Term("pg1g2aa", "SelfDefine_spin0", (("ghz1", 1), ("ghgsgs2", 1)), ("pg1", "pg2aa")),
+    Term("pg1g4aa", "SelfDefine_spin0", (("ghz1", 1), ("ghgsgs4", 1)), ("pg1", "pg4aa")),
+)
+
+#The discriminants computed from the probabilities, and the terms that each of them needs
+DISCRIMINANTS = collections.OrderedDict((
+    ("D0minus", ("pg1", "pg4")),
+    ("D0hplus", ("pg1", "pg2")),
+    ("DCP", ("pg1g4", "pg1", "pg4")),
+    ("Dint", ("pg1g2", "pg1", "pg2")),
+))
+
+
+def select_terms(terms, names):
+    """Picks the terms needed to compute some of the outputs
+
+    Parameters
+    ----------
+    terms : tuple[Term]
+        All of the terms (i.e. PRODUCTION_TERMS)
+    names : iterable[str]
+        The outputs that are needed: term names and DISCRIMINANTS. Other names are ignored.
+
+    Returns
+    -------
+    tuple[Term]
+        The terms in names, the terms the discriminants in names need, and the terms that those subtract, in the order of terms
+    """
+    byname = {term.name: term for term in terms}
+    pending = []
+    for name in names:
+        pending.extend(DISCRIMINANTS.get(name, (name,)))
+    needed = set()
+    while pending:
+        name = pending.pop()
+        if name in byname and name not in needed:
+            needed.add(name)
+            pending.extend(byname[name].subtract)
+    return tuple(term for term in terms if term.name in needed)
+
+
+def _configuration(term):
+    """The MELA setup a term needs, ignoring couplings that are set to 0 (they are 0 after the reset anyway)"""
+    return term.hypothesis, tuple(sorted((coupling, value) for coupling, value in term.couplings if value))
+
+
+class HypothesisPlan(object):
+    """A table of terms compiled into the smallest list of MELA calls that gives all of them.
+    Terms that need the same hypothesis and couplings share one call.  An interference term needs a call of its own
+    with the mixture of couplings, from which the pure terms that were already computed are subtracted.
+    """
+
+    def __init__(self, terms, compute, TVar, matrixelement="JHUGen"):
+        """
+        Parameters
+        ----------
+        terms : tuple[Term]
+            The terms to compute (i.e. PRODUCTION_TERMS)
+        compute : str
+            The MELA function that computes the probabilities, "computeP" or "computeProdP"
+        TVar : module
+            mela.TVar, which the hypothesis names are looked up in
+        matrixelement : str, optional
+            The matrix element passed to setProcess, by default "JHUGen"
+
+        Raises
+        ------
+        ValueError
+            If a term subtracts a term that does not come before it, or two terms have the same name
+        """
+        self.terms = tuple(terms)
+        self.compute = compute
+        self.matrixelement = getattr(TVar, matrixelement)
+
+        self.configurations = []
+        self._termcalls = []
+        calls = {}
+        names = set()
+        for term in self.terms:
+            if term.name in names:
+                raise ValueError("Term {} appears twice".format(term.name))
+            missing = set(term.subtract) - names
+            if missing:
+                raise ValueError("Term {} subtracts {}, which have to come before it".format(term.name, ", ".join(sorted(missing))))
+            names.add(term.name)
+
+            configuration = _configuration(term)
+            if configuration not in calls:
+                calls[configuration] = len(self.configurations)
+                hypothesis, couplings = configuration
+                self.configurations.append((getattr(TVar, hypothesis), couplings))
+            self._termcalls.append(calls[configuration])
+
+    @property
+    def ncalls(self):
+        """The number of MELA calls per event"""
+        return len(self.configurations)
+
+    @property
+    def calllabels(self):
+        """A name for each MELA call, in the order of configurations: the compute function and the terms the call is used for"""
+        labels = [[] for _ in self.configurations]
+        for term, call in zip(self.terms, self._termcalls):
+            labels[call].append(term.name)
+        return tuple("{}[{}]".format(self.compute, ",".join(names)) for names in labels)
+
+    def summary(self):
+        """A one line description of the MELA calls the plan makes, and how many are saved compared to one call per term"""
+        summary = "{}: {} terms from {} MELA calls per event".format(self.compute, len(self.terms), self.ncalls)
+        if self.ncalls < len(self.terms):
+            summary += " ({} saved by terms with the same hypothesis and couplings)".format(len(self.terms) - self.ncalls)
+        return summary
+
+    def call(self, event, process, configuration):
+        """Makes one MELA call of the plan for the current event
+
+        Parameters
+        ----------
+        event : Mela
+            The Mela object (or LHEFile_* object) with the event set up
+        process : int
+            The TVar production process passed to setProcess
+        configuration : tuple
+            One of configurations: the TVar hypothesis and the (coupling, value) pairs
+
+        Returns
+        -------
+        float
+            The probability
+        """
+        hypothesis, couplings = configuration
+        event.setProcess(hypothesis, self.matrixelement, process)
+        for coupling, value in couplings:
+            setattr(event, coupling, value)
+        return getattr(event, self.compute)()
+
+    def combine(self, results):
+        """Computes every term from the results of the MELA calls
+
+        Parameters
+        ----------
+        results : sequence[float]
+            The result of each call, in the order of configurations
+
+        Returns
+        -------
+        dict
+            The value of each term, by name, in the order of the terms
+        """
+        values = {}
+        for term, call in zip(self.terms, self._termcalls):
+            values[term.name] = results[call] - sum(values[name] for name in term.subtract)
+        return values
+
+    def evaluate(self, event, process):
+        """Computes every term for the current event
+
+        Parameters
+        ----------
+        event : Mela
+            The Mela object (or LHEFile_* object) with the event set up
+        process : int
+            The TVar production process passed to setProcess
+
+        Returns
+        -------
+        dict
+            The value of each term, by name, in the order of the terms
+        """
+        return self.combine([self.call(event, process, configuration) for configuration in self.configurations])
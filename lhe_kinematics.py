@@ -0,0 +1,129 @@
+import numpy as np
+
+#Four-vectors are arrays whose last axis is (px, py, pz, E), so the same functions work on one particle (shape (4,)),
+#on the particles of one event (shape (n, 4)) or on a whole chunk of events (shape (nevents, n, 4)).
+#Sums of four-vectors are just numpy sums over the particle axis.
+PX, PY, PZ, E = range(4)
+
+_INFINITE_ETA = 1e11 #what TLorentzVector.Eta returns for particles along the beam axis
+
+
+def fourvectors(particles, n=None):
+    """Gets the ids and four-vectors of a particle collection
+
+    Parameters
+    ----------
+    particles : iterable
+        (id, momentum) pairs, where the momentum is a (px, py, pz, E) sequence or a TLorentzVector
+        (i.e. a SimpleParticleCollection_t or a list from LHEEvent.extracteventparticles)
+    n : int, optional
+        Return exactly n particles, dropping the extra ones or padding with id 0 and zero four-vectors, by default all of them
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        The ids, shape (n,), and the four-vectors, shape (n, 4)
+    """
+    ids, momenta = [], []
+    for particleid, momentum in particles:
+        if hasattr(momentum, "Px"):
+            momentum = (momentum.Px(), momentum.Py(), momentum.Pz(), momentum.E())
+        ids.append(particleid)
+        momenta.append(momentum)
+    if n is not None:
+        ids = ids[:n] + [0] * (n - len(ids))
+        momenta = momenta[:n] + [(0, 0, 0, 0)] * (n - len(momenta))
+    return np.array(ids, dtype=np.int64), np.array(momenta, dtype=np.float64).reshape(-1, 4)
+
+
+def pt(p):
+    """The transverse momentum"""
+    return np.hypot(p[..., PX], p[..., PY])
+
+
+def phi(p):
+    """The azimuthal angle, in [-pi, pi]"""
+    return np.arctan2(p[..., PY], p[..., PX])
+
+
+def eta(p):
+    """The pseudorapidity, with the TLorentzVector convention of +-1e11 for particles along the beam axis and 0 for zero momentum"""
+    transverse, pz = pt(p), p[..., PZ]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = np.arcsinh(pz / transverse)
+    return np.where(transverse > 0, result, np.sign(pz) * _INFINITE_ETA)
+
+
+def rapidity(p):
+    """The rapidity, 0.5 ln((E + pz) / (E - pz))"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 0.5 * np.log((p[..., E] + p[..., PZ]) / (p[..., E] - p[..., PZ]))
+
+
+def mass(p):
+    """The invariant mass, 0 where the mass squared is negative (off-shell by rounding) instead of TLorentzVector's -sqrt(-m^2)"""
+    masssquared = p[..., E]**2 - p[..., PX]**2 - p[..., PY]**2 - p[..., PZ]**2
+    return np.sqrt(np.maximum(masssquared, 0))
+
+
+def deltaphi(p1, p2):
+    """phi(p1) - phi(p2), wrapped into [-pi, pi) like TLorentzVector.DeltaPhi"""
+    return np.mod(phi(p1) - phi(p2) + np.pi, 2 * np.pi) - np.pi
+
+
+def deltar(p1, p2):
+    """sqrt(deltaeta^2 + deltaphi^2), like TLorentzVector.DeltaR"""
+    return np.hypot(eta(p1) - eta(p2), deltaphi(p1, p2))
+
+
+if __name__ == "__main__":
+    import unittest
+    try:
+        import ROOT
+    except ImportError:
+        ROOT = None
+
+    def _randomfourvectors(rng, n):
+        """Random four-vectors, followed by the edge cases: along the beam axis, at rest, and with a (slightly) negative mass squared"""
+        momenta = rng.normal(0, 100, (n, 3))
+        masses = rng.choice((0, 0.1, 4.7, 91.1876, 125.), n)
+        p = np.column_stack((momenta, np.sqrt((momenta**2).sum(axis=1) + masses**2)))
+        edgecases = np.array((
+            (0, 0, 250, 250), (0, 0, -250, 300), (0, 0, 0, 125),
+            (30, -40, 120, 130 * (1 - 1e-7)), (-3, 4, 0, 4.9),
+        ))
+        return np.concatenate((p, edgecases))
+
+    def _tlorentzvector(p):
+        return ROOT.TLorentzVector(*p)
+
+    @unittest.skipIf(ROOT is None, "needs ROOT")
+    class TestKinematics(unittest.TestCase):
+        """Compares every function with TLorentzVector, within float32 precision since that is what the branches are written as"""
+        rtol, atol = 1e-6, 1e-5
+
+        def setUp(self):
+            rng = np.random.default_rng(0)
+            self.p1, self.p2 = _randomfourvectors(rng, 1000), _randomfourvectors(rng, 1000)
+
+        def compare(self, function, tlvfunction, *vectors):
+            expected = [tlvfunction(*(_tlorentzvector(p) for p in ps)) for ps in zip(*vectors)]
+            np.testing.assert_allclose(function(*vectors), expected, rtol=self.rtol, atol=self.atol, err_msg=function.__name__)
+
+        def testPt(self): self.compare(pt, lambda v: v.Pt(), self.p1)
+        def testEta(self): self.compare(eta, lambda v: v.Eta(), self.p1)
+        def testPhi(self): self.compare(phi, lambda v: v.Phi(), self.p1)
+        def testRapidity(self): self.compare(rapidity, lambda v: v.Rapidity(), self.p1[:-5]) #the edge cases are infinite or nan
+        def testDeltaPhi(self): self.compare(deltaphi, lambda v1, v2: v1.DeltaPhi(v2), self.p1, self.p2)
+        def testDeltaR(self): self.compare(deltar, lambda v1, v2: v1.DeltaR(v2), self.p1[:-5], self.p2[:-5]) #+-1e11 eta is too large for the precision
+
+        def testMass(self):
+            #TLorentzVector gives -sqrt(-m^2) for a negative mass squared, which is clamped to 0 here
+            self.compare(mass, lambda v: max(v.M(), 0), self.p1)
+            self.assertLess(_tlorentzvector(self.p1[-2]).M(), 0)
+
+        def testEtaEdgeCases(self):
+            np.testing.assert_array_equal(eta(self.p1[-5:-2]), [_tlorentzvector(p).Eta() for p in self.p1[-5:-2]])
+            np.testing.assert_array_equal(eta(self.p1[-5:-2]), [_INFINITE_ETA, -_INFINITE_ETA, 0])
+
+    unittest.main()
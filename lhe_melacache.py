@@ -0,0 +1,157 @@
+import hashlib
+import sqlite3
+import struct
+
+DEFAULT_MAXENTRIES = 10000000
+COMMIT_EVERY = 1000 #the number of new results, or of cache hits, collected before they are written to the file
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    value BLOB NOT NULL,
+    lastused INTEGER NOT NULL
+)
+"""
+
+
+def event_key(inputevent):
+    """Hashes the particle content of an event
+
+    Parameters
+    ----------
+    inputevent : lhefile.InputEvent
+        The daughters, associated particles, mothers and isgen that are handed to MELA
+
+    Returns
+    -------
+    bytes
+        A 16 byte hash of the ids and four-momenta of every particle, in order, and of isgen
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for collection in inputevent[:3]:
+        if collection is None:
+            h.update(b"N")
+            continue
+        h.update(b"C")
+        for particle in collection:
+            momentum = particle.second
+            h.update(struct.pack("<q4d", particle.first, momentum.Px(), momentum.Py(), momentum.Pz(), momentum.E()))
+    h.update(b"G" if inputevent[3] else b"R")
+    return h.digest()
+
+
+class MelaCache(object):
+    """An on-disk (sqlite) cache of MELA results, keyed by the particle content of the event and by what was computed.
+    When the cache holds more than maxentries results, the least recently used ones are removed.
+
+    The key does not know how Mela was set up (sqrt(s), Higgs mass, ...), so use a separate file
+    (or a different context) for every setup.
+    """
+
+    def __init__(self, filename, maxentries=DEFAULT_MAXENTRIES, context=""):
+        """
+        Parameters
+        ----------
+        filename : str
+            The cache file, created if it doesn't exist
+        maxentries : int, optional
+            The maximum number of results kept in the file, by default DEFAULT_MAXENTRIES
+        context : str, optional
+            Anything else the results depend on, added to every key, by default ""
+        """
+        self.filename = filename
+        self.maxentries = maxentries
+        self.context = context.encode()
+        self.hits = self.misses = 0
+
+        self._connection = sqlite3.connect(filename, timeout=600) #parallel jobs share the file
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+        self._clock = self._connection.execute("SELECT COALESCE(MAX(lastused), 0) FROM results").fetchone()[0]
+        self._newresults = {}
+        self._usedkeys = []
+
+    def _key(self, eventkey, name):
+        return hashlib.blake2b(eventkey + b"\0" + self.context + b"\0" + repr(name).encode(), digest_size=16).digest()
+
+    def lookup(self, eventkey, name, compute):
+        """Gets a result from the cache, or computes and stores it if it isn't there
+
+        Parameters
+        ----------
+        eventkey : bytes
+            The hash of the event, from event_key
+        name : tuple
+            Everything that identifies the computation, i.e. ("computeVHAngles", process)
+        compute : callable
+            Computes the result, a float or a sequence of floats, if it is not in the cache
+
+        Returns
+        -------
+        Union[float, tuple[float]]
+            The result, with the same shape that compute returns
+        """
+        key = self._key(eventkey, name)
+        self._clock += 1
+        if key in self._newresults:
+            self.hits += 1
+            return self._unpack(self._newresults[key][0])
+        row = self._connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.hits += 1
+            self._usedkeys.append((self._clock, key))
+            if len(self._usedkeys) >= COMMIT_EVERY:
+                self.commit()
+            return self._unpack(row[0])
+
+        self.misses += 1
+        result = compute()
+        self._newresults[key] = self._pack(result), self._clock
+        if len(self._newresults) >= COMMIT_EVERY:
+            self.commit()
+        return result
+
+    @staticmethod
+    def _pack(result):
+        try:
+            values = tuple(float(_) for _ in result)
+            return b"T" + struct.pack("<{}d".format(len(values)), *values)
+        except TypeError:
+            return b"F" + struct.pack("<d", float(result))
+
+    @staticmethod
+    def _unpack(value):
+        values = struct.unpack("<{}d".format((len(value) - 1) // 8), value[1:])
+        return values if value[:1] == b"T" else values[0]
+
+    def commit(self):
+        """Writes the new results to the file and removes the least recently used ones if there are too many"""
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results (key, value, lastused) VALUES (?, ?, ?)",
+                ((key, value, lastused) for key, (value, lastused) in self._newresults.items()),
+            )
+            self._connection.executemany("UPDATE results SET lastused = MAX(lastused, ?) WHERE key = ?", self._usedkeys)
+            nentries = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if nentries > self.maxentries:
+                self._connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY lastused LIMIT ?)", (nentries - self.maxentries,)
+                )
+        self._newresults = {}
+        self._usedkeys = []
+
+    def summary(self):
+        """A one line description of how often the cache was used"""
+        total = self.hits + self.misses
+        return "MELA cache {}: {} of {} results found ({:.1%})".format(self.filename, self.hits, total, self.hits / total if total else 0)
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,133 @@
+import collections
+
+import lhe_fsr
+import lhefile
+
+#The MELA angle calculations: the Mela function, the branches its results go into, in order, and whether it takes the production process
+Angles = collections.namedtuple("Angles", "function names needsprocess")
+VH_ANGLES = Angles("computeVHAngles", ("mV", "mVstar", "costheta1", "costheta2", "Phi", "costhetastar", "Phi1"), True)
+VBF_ANGLES = Angles("computeVBFAngles", ("q2V1", "q2V2", "costheta1", "costheta2", "Phi", "costhetastar", "Phi1"), False)
+DECAY_ANGLES = Angles("computeDecayAngles", ("M4L", "MZ1", "MZ2", "costheta1d", "costheta2d", "Phid", "costhetastard", "Phi1d"), False)
+
+#The groups of kinematic branches that a mode fills, see lhe2root.fillkinematics
+HIGGS = "higgs" #ptH, pxH, pyH, pzH, EH, rapH from the sum of the daughters
+DAUGHTERS = "daughters" #the four-vectors, pt and ids of the first four daughters
+PHOTON = "photon" #the four-vector of the first associated particle (the FSR photon), in pxph1, ...
+JETS = "jets" #the four-vectors of the first two associated particles, in pxj1, ...
+RAPHJJ = "rapHJJ" #the rapidity of the Higgs and the first two associated particles
+DPHIJJ = "Dphijj" #the azimuthal angle between the two jets
+PTV = "ptV" #the pt of the first two associated particles
+HJJPZ = "HJJpz" #the pz of the daughters and all associated particles
+
+#The branches in each group of kinematic branches
+KINEMATIC_BRANCHES = {
+    HIGGS: ("ptH", "pxH", "pyH", "pzH", "EH", "rapH"),
+    DAUGHTERS: tuple("{}dau{}".format(name, k) for k in range(1, 5) for name in ("pt", "px", "py", "pz", "E", "flav")),
+    PHOTON: ("pxph1", "pyph1", "pzph1", "Eph1"),
+    JETS: ("pxj1", "pyj1", "pzj1", "Ej1", "pxj2", "pyj2", "pzj2", "Ej2"),
+    RAPHJJ: ("rapHJJ",),
+    DPHIJJ: ("Dphijj",),
+    PTV: ("ptV",),
+    HJJPZ: ("HJJpz",),
+}
+#The groups that are computed from the four-vectors stored by another group
+KINEMATIC_DEPENDENCIES = {RAPHJJ: (JETS,), DPHIJJ: (JETS,), PTV: (JETS,)}
+
+#One production mode of lhe2root.py.
+#  name: the command line flag (without --)
+#  lhefileclass: the LHEFile_* class that reads the events
+#  process: the TVar production process, by name, or a (hadronic, leptonic) pair of names that is picked from the flavor of the associated particles
+#  angles: the Angles computed with MELA, in order
+#  branches: the float branches the mode adds to the ones every mode has
+#  kinematics: the groups of kinematic branches it fills
+#  photonmerger: a function of the command line arguments that returns the lhe_fsr.PhotonMerger to use, or None
+#  readweights: whether the reweighting weights are written to the weights branch, instead of the event weight to weight
+Mode = collections.namedtuple(
+    "Mode", "name lhefileclass process angles branches kinematics photonmerger readweights",
+    defaults=((), (), frozenset(), None, False),
+)
+
+VH_BRANCHES = ("mV", "mVstar", "pxj1", "pyj1", "pzj1", "Ej1", "pxj2", "pyj2", "pzj2", "Ej2", "ptV")
+VBF_BRANCHES = ("q2V1", "q2V2", "Dphijj")
+
+MODES = collections.OrderedDict()
+
+
+def register(mode):
+    """Adds a production mode, which makes it available as a command line flag of lhe2root.py
+
+    Parameters
+    ----------
+    mode : Mode
+        The mode
+
+    Returns
+    -------
+    Mode
+        The same mode
+
+    Raises
+    ------
+    ValueError
+        If there is already a mode with the same name
+    """
+    if mode.name in MODES:
+        raise ValueError("There is already a mode called " + mode.name)
+    MODES[mode.name] = mode
+    return mode
+
+
+def selected_mode(args):
+    """Gets the mode whose flag is set in the parsed lhe2root.py arguments
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The arguments
+
+    Returns
+    -------
+    Mode
+        The mode
+
+    Raises
+    ------
+    ValueError
+        If the number of modes that are set is not one
+    """
+    modes = [mode for name, mode in MODES.items() if getattr(args, name, False)]
+    if len(modes) != 1:
+        raise ValueError("Expected exactly one production mode, got {}".format(", ".join(mode.name for mode in modes) or "none"))
+    return modes[0]
+
+
+def _mergeintoleptons(args):
+    return lhe_fsr.PhotonMerger("associated", args.fsr_deltar, keepphotons=False)
+
+
+def _mergeintodaughters(args):
+    return lhe_fsr.PhotonMerger("daughters", args.fsr_deltar) if args.merge_photon else None
+
+
+register(Mode("vbf", lhefile.LHEFile_StableHiggs, "JJVBF", (VBF_ANGLES,), VBF_BRANCHES, frozenset((HIGGS, JETS, RAPHJJ, DPHIJJ, HJJPZ))))
+register(Mode(
+    "vbf_withdecay", lhefile.LHEFile_Hwithdecay, "JJVBF", (VBF_ANGLES, DECAY_ANGLES), VBF_BRANCHES, frozenset((HIGGS, DAUGHTERS, JETS, HJJPZ))
+))
+register(Mode("zh", lhefile.LHEFile_StableHiggsVH, ("Had_ZH", "Lep_ZH"), (VH_ANGLES,), VH_BRANCHES, frozenset((HIGGS, JETS, RAPHJJ, PTV))))
+register(Mode(
+    "zh_withdecay", lhefile.LHEFile_VHHiggsdecay, ("Had_ZH", "Lep_ZH"), (VH_ANGLES, DECAY_ANGLES), VH_BRANCHES, frozenset((HIGGS, DAUGHTERS))
+))
+register(Mode("zh_lep", lhefile.LHEFile_StableHiggs, "Lep_ZH", (VH_ANGLES,), VH_BRANCHES, frozenset((HIGGS,))))
+register(Mode(
+    "zh_lep_hawk", lhefile.LHEFile_StableHiggsZHHAWK, "Lep_ZH", (VH_ANGLES,), VH_BRANCHES, frozenset((HIGGS, JETS, RAPHJJ, PTV)),
+    photonmerger=_mergeintoleptons,
+))
+register(Mode(
+    "wh_withdecay", lhefile.LHEFile_VHHiggsdecay, ("Had_WH", "Lep_WH"), (VH_ANGLES, DECAY_ANGLES), VH_BRANCHES, frozenset((HIGGS, DAUGHTERS))
+))
+register(Mode("wh_lep", lhefile.LHEFile_StableHiggs, "Lep_WH", (VH_ANGLES,), VH_BRANCHES, frozenset((HIGGS,))))
+register(Mode("wh", lhefile.LHEFile_StableHiggsVH, ("Had_WH", "Lep_WH"), (VH_ANGLES,), VH_BRANCHES, frozenset((HIGGS, JETS, RAPHJJ, PTV))))
+register(Mode(
+    "ggH4l", lhefile.LHEFile_HwithdecayOnly, "ZZGG", (DECAY_ANGLES,), kinematics=frozenset((DAUGHTERS, PHOTON)), photonmerger=_mergeintodaughters
+))
+register(Mode("ggH4lMG", lhefile.LHEFile_Hwithdecay, None, (DECAY_ANGLES,), kinematics=frozenset((HIGGS, DAUGHTERS)), readweights=True))
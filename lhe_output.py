@@ -0,0 +1,453 @@
+import abc
+import os
+import numpy as np
+
+BACKENDS = ("root", "uproot", "parquet", "arrow", "hdf5")
+#The backend used for each output file extension, when it isn't given explicitly
+EXTENSIONS = {".root": "root", ".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow", ".h5": "hdf5", ".hdf5": "hdf5"}
+DEFAULT_CHUNKSIZE = 10000 #events per basket; the buffer holds this many events, so it also bounds the memory use
+
+#ROOT leaf type codes for the column types
+_LEAFTYPES = {np.dtype("f4"): "F", np.dtype("f8"): "D", np.dtype("i4"): "I", np.dtype("i8"): "L"}
+
+_ROOTHELPERS = """
+#include <cstdint>
+#include <cstring>
+#include "TTree.h"
+TBranch* lhe_output_branch(TTree* t, const char* name, std::uintptr_t address, const char* leaflist) {
+  return t->Branch(name, reinterpret_cast<void*>(address), leaflist);
+}
+int lhe_output_setaddress(TTree* t, const char* name, std::uintptr_t address) {
+  return t->SetBranchAddress(name, reinterpret_cast<void*>(address));
+}
+void lhe_output_fillrows(TTree* t, std::uintptr_t record, std::uintptr_t chunk, std::size_t recordsize, std::size_t n) {
+  for (std::size_t i = 0; i < n; i++) {
+    std::memcpy(reinterpret_cast<void*>(record), reinterpret_cast<const char*>(chunk) + i * recordsize, recordsize);
+    t->Fill();
+  }
+}
+"""
+
+
+def record_dtype(columns):
+    """Makes the NumPy record type for the output columns
+
+    Parameters
+    ----------
+    columns : list[tuple]
+        (name, type, shape) for every column, i.e. ("weight", "f4", ()) or ("LHEDaughterPt", "f4", (4,))
+
+    Returns
+    -------
+    numpy.dtype
+        A structured type with one field per column
+    """
+    return np.dtype([(name, dtype, shape) for name, dtype, shape in columns])
+
+
+def backend_for_filename(filename):
+    """Picks the output backend from the file extension (see EXTENSIONS), "root" if the extension is not known
+
+    Parameters
+    ----------
+    filename : str
+        The output file
+
+    Returns
+    -------
+    str
+        One of BACKENDS
+    """
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower(), "root")
+
+
+class OutputWriter(object, metaclass=abc.ABCMeta):
+    """Collects events into preallocated NumPy column buffers and writes them chunksize events at a time.
+    The values of the current event go into the arrays returned by views(), and fill() adds the event to the buffer.
+    If prepare is set, it is called with the buffered events (a structured array) right before they are written,
+    so that columns can be computed for the whole chunk at once.
+    """
+    prepare = None
+    #whether the writer can open a file it wrote before with resume=True and add to it.  Checkpoints are only useful for the ones that can:
+    #the others can't continue from them, and their files (i.e. Parquet without its footer) aren't readable after a failure anyway
+    supportsresume = False
+
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            The output file
+        columns : list[tuple]
+            (name, type, shape) for every column, see record_dtype
+        written : set[str], optional
+            The columns that are written to the file, by default all of them
+        chunksize : int, optional
+            The number of events buffered before they are written, by default DEFAULT_CHUNKSIZE
+        treename : str, optional
+            The name of the output tree (or table), by default "tree"
+        metadata : dict, optional
+            str to str key-value pairs stored with the output (i.e. the cross section), by default None
+        """
+        self.filename = filename
+        self.treename = treename
+        self.metadata = dict(metadata or {})
+        self.dtype = record_dtype(columns)
+        self.written = [name for name in self.dtype.names if written is None or name in written]
+        self.record = np.zeros(1, self.dtype)
+        self._chunk = np.zeros(max(chunksize, 1), self.dtype)
+        self._row = 0
+        self._nwritten = 0
+
+    def views(self):
+        """Gets writable arrays for the columns of the current event
+
+        Returns
+        -------
+        dict
+            One array per column name. Scalar columns are one element arrays, so the value is set with views[name][0] = value.
+        """
+        return {name: self.record[name] if not self.dtype[name].shape else self.record[name][0] for name in self.dtype.names}
+
+    @property
+    def entries(self):
+        """The number of events filled so far, including the ones in the file before resuming"""
+        return self._nwritten + self._row
+
+    def fill(self):
+        """Adds the current event to the buffer, writing the buffer out when it is full"""
+        self._chunk[self._row] = self.record[0]
+        self._row += 1
+        if self._row == len(self._chunk):
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered events"""
+        if self._row:
+            if self.prepare is not None:
+                self.prepare(self._chunk[:self._row])
+            self._write(self._chunk[:self._row])
+            self._nwritten += self._row
+            self._row = 0
+
+    def checkpoint(self):
+        """Writes the buffered events and makes sure that what is in the file so far can be read back"""
+        self.flush()
+
+    @abc.abstractmethod
+    def _write(self, chunk):
+        pass
+
+    @abc.abstractmethod
+    def _close(self):
+        pass
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ROOTWriter(OutputWriter):
+    """Writes a TTree with PyROOT. The rows of a chunk are copied into the branch addresses and filled in a compiled loop."""
+    supportsresume = True
+
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+        """
+        Parameters
+        ----------
+        resume : bool, optional
+            Open the tree that is already in filename and add to it, by default False
+
+        See OutputWriter for the other parameters. The metadata goes into the tree's UserInfo as TNamed objects.
+        """
+        super(ROOTWriter, self).__init__(filename, columns, written, chunksize, treename, metadata)
+        import ROOT
+        if not hasattr(ROOT, "lhe_output_fillrows"):
+            ROOT.gInterpreter.Declare(_ROOTHELPERS)
+        self._ROOT = ROOT
+        self._current = np.zeros(1, self.dtype) #the branch addresses point into this record
+        address = self._current.ctypes.data
+
+        if resume:
+            self._file = ROOT.TFile(filename, "UPDATE")
+            self._tree = self._file.Get(treename)
+            if not self._tree:
+                raise IOError("{} doesn't have a tree called {} to resume".format(filename, treename))
+            for name in self.written:
+                if not self._tree.GetBranch(name):
+                    raise ValueError("The tree being resumed doesn't have a branch called {}, was it made with different options?".format(name))
+                ROOT.lhe_output_setaddress(self._tree, name, address + self.dtype.fields[name][1])
+            self._nwritten = self._tree.GetEntries()
+        else:
+            self._file = ROOT.TFile(filename, "RECREATE")
+            self._tree = ROOT.TTree(treename, treename)
+            for name in self.written:
+                ROOT.lhe_output_branch(self._tree, name, address + self.dtype.fields[name][1], self._leaflist(name))
+            for key, value in self.metadata.items():
+                self._tree.GetUserInfo().Add(ROOT.TNamed(key, value))
+
+    def _leaflist(self, name):
+        field = self.dtype[name]
+        shape = "".join("[{}]".format(n) for n in field.shape)
+        return "{}{}/{}".format(name, shape, _LEAFTYPES[field.base])
+
+    def _write(self, chunk):
+        chunk = np.ascontiguousarray(chunk)
+        self._ROOT.lhe_output_fillrows(self._tree, self._current.ctypes.data, chunk.ctypes.data, self.dtype.itemsize, len(chunk))
+
+    def checkpoint(self):
+        super(ROOTWriter, self).checkpoint()
+        self._tree.AutoSave("SaveSelf")
+
+    def _close(self):
+        self._file.Write("", self._ROOT.TObject.kOverwrite) #replaces any autosaved copy of the tree, so the file has one tree
+        self._file.Close()
+
+
+class UprootWriter(OutputWriter):
+    """Writes a TTree with uproot, one basket per chunk, without needing ROOT for the writing itself
+    (lhe2root.py still imports ROOT and MELA, which the LHEFile_* classes read the events with)
+    """
+
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+        """
+        Parameters
+        ----------
+        resume : bool, optional
+            Not supported: uproot can't add to a tree in an existing file
+
+        See OutputWriter for the other parameters. The metadata is not written.
+        """
+        super(UprootWriter, self).__init__(filename, columns, written, chunksize, treename, metadata)
+        if resume:
+            raise ValueError("The uproot output backend can't resume, use the root backend")
+        import uproot
+        self._file = uproot.recreate(filename)
+        self._tree = self._file.mktree(treename, {name: self.dtype[name] for name in self.written})
+
+    def _write(self, chunk):
+        self._tree.extend({name: np.ascontiguousarray(chunk[name]) for name in self.written})
+
+    def _close(self):
+        self._file.close()
+
+
+def _arrow_schema(pyarrow, dtype, names, metadata):
+    """The Arrow schema for the columns: scalars stay scalars and fixed size arrays become fixed size list columns"""
+    fields = []
+    for name in names:
+        field = dtype[name]
+        arrowtype = pyarrow.from_numpy_dtype(field.base)
+        if field.shape:
+            arrowtype = pyarrow.list_(arrowtype, int(np.prod(field.shape)))
+        fields.append(pyarrow.field(name, arrowtype))
+    return pyarrow.schema(fields, metadata=metadata or None)
+
+
+def _arrow_batch(pyarrow, chunk, schema):
+    """Converts a chunk of records to an Arrow record batch"""
+    arrays = []
+    for field in schema:
+        column = np.ascontiguousarray(chunk[field.name])
+        if column.ndim > 1:
+            arrays.append(pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(column.reshape(-1)), int(np.prod(column.shape[1:]))))
+        else:
+            arrays.append(pyarrow.array(column))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ArrowWriterBase(OutputWriter):
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+        super(_ArrowWriterBase, self).__init__(filename, columns, written, chunksize, treename, metadata)
+        if resume:
+            raise ValueError("The {} output backend can't resume, use the root backend".format(self.backend))
+        import pyarrow
+        self._pyarrow = pyarrow
+        self._schema = _arrow_schema(pyarrow, self.dtype, self.written, self.metadata)
+
+
+class ParquetWriter(_ArrowWriterBase):
+    """Writes a Parquet file with pyarrow, one zstd compressed row group per chunk.
+    Fixed size arrays (weights, per-particle quantities) become list columns, and the metadata goes into the file's key-value metadata.
+    """
+    backend = "parquet"
+
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+        """See OutputWriter for the parameters. resume is not supported."""
+        super(ParquetWriter, self).__init__(filename, columns, written, chunksize, treename, metadata, resume)
+        import pyarrow.parquet
+        self._writer = pyarrow.parquet.ParquetWriter(filename, self._schema, compression="zstd")
+
+    def _write(self, chunk):
+        self._writer.write_batch(_arrow_batch(self._pyarrow, chunk, self._schema), row_group_size=len(chunk))
+
+    def _close(self):
+        self._writer.close()
+
+
+class ArrowWriter(_ArrowWriterBase):
+    """Writes an uncompressed Arrow IPC (Feather v2) file with pyarrow, one record batch per chunk, so it can be memory mapped
+    and read by pandas or polars without copying. The metadata goes into the schema's key-value metadata.
+    """
+    backend = "arrow"
+
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+        """See OutputWriter for the parameters. resume is not supported."""
+        super(ArrowWriter, self).__init__(filename, columns, written, chunksize, treename, metadata, resume)
+        import pyarrow.ipc
+        self._writer = pyarrow.ipc.new_file(filename, self._schema)
+
+    def _write(self, chunk):
+        self._writer.write_batch(_arrow_batch(self._pyarrow, chunk, self._schema))
+
+    def _close(self):
+        self._writer.close()
+
+
+class HDF5Writer(OutputWriter):
+    """Writes one resizable, chunked dataset per column into the group treename of an HDF5 file with h5py.
+    Fixed size arrays become 2D datasets, and the metadata goes into the group's attributes.
+    """
+
+    def __init__(self, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+        """See OutputWriter for the parameters. resume is not supported."""
+        super(HDF5Writer, self).__init__(filename, columns, written, chunksize, treename, metadata)
+        if resume:
+            raise ValueError("The hdf5 output backend can't resume, use the root backend")
+        import h5py
+        self._file = h5py.File(filename, "w")
+        group = self._file.create_group(treename)
+        for key, value in self.metadata.items():
+            group.attrs[key] = value
+        self._datasets = {}
+        for name in self.written:
+            field = self.dtype[name]
+            self._datasets[name] = group.create_dataset(
+                name, shape=(0,) + field.shape, maxshape=(None,) + field.shape, dtype=field.base,
+                chunks=(len(self._chunk),) + field.shape, compression="gzip",
+            )
+
+    def _write(self, chunk):
+        for name, dataset in self._datasets.items():
+            start = dataset.shape[0]
+            dataset.resize(start + len(chunk), axis=0)
+            dataset[start:] = chunk[name]
+
+    def _close(self):
+        self._file.close()
+
+
+_WRITERS = {"root": ROOTWriter, "uproot": UprootWriter, "parquet": ParquetWriter, "arrow": ArrowWriter, "hdf5": HDF5Writer}
+
+
+def open_writer(backend, filename, columns, written=None, chunksize=DEFAULT_CHUNKSIZE, treename="tree", metadata=None, resume=False):
+    """Makes an OutputWriter for one of BACKENDS
+
+    Parameters
+    ----------
+    backend : str
+        One of BACKENDS, or None to pick it from the file extension (see backend_for_filename)
+
+    See ROOTWriter for the other parameters
+
+    Returns
+    -------
+    OutputWriter
+        The writer
+    """
+    if backend is None:
+        backend = backend_for_filename(filename)
+    if backend not in _WRITERS:
+        raise ValueError("Unknown output backend {}, choose from {}".format(backend, ", ".join(BACKENDS)))
+    return _WRITERS[backend](filename, columns, written, chunksize, treename, metadata, resume)
+
+
+def supports_resume(backend):
+    """Whether the writer for one of BACKENDS can resume (see OutputWriter.supportsresume)
+
+    Parameters
+    ----------
+    backend : str
+        One of BACKENDS
+
+    Returns
+    -------
+    bool
+        True if checkpoints and --resume work with this backend
+    """
+    return _WRITERS[backend].supportsresume
+
+
+def merge_outputs(backend, outputfile, inputfiles, treename="tree", chunksize=DEFAULT_CHUNKSIZE):
+    """Concatenates the trees in inputfiles, in order, into outputfile
+
+    Parameters
+    ----------
+    backend : str
+        One of BACKENDS, the format and library used to read and write the files
+    outputfile : str
+        The merged file
+    inputfiles : list[str]
+        The files to merge, which all have the same branches
+    treename : str, optional
+        The name of the tree, by default "tree"
+    chunksize : int, optional
+        The number of events copied at a time by the uproot, parquet and hdf5 backends, by default DEFAULT_CHUNKSIZE
+    """
+    if backend == "root":
+        import ROOT
+        chain = ROOT.TChain(treename)
+        for inputfile in inputfiles:
+            chain.Add(inputfile)
+        newf = ROOT.TFile(outputfile, "RECREATE")
+        chain.CloneTree(-1, "fast")
+        newf.Write()
+        newf.Close()
+    elif backend in ("parquet", "arrow"):
+        import pyarrow.ipc, pyarrow.parquet
+        if backend == "parquet":
+            sources = [pyarrow.parquet.ParquetFile(inputfile) for inputfile in inputfiles]
+            schema = sources[0].schema_arrow
+            writer = pyarrow.parquet.ParquetWriter(outputfile, schema, compression="zstd")
+            batches = (batch for source in sources for batch in source.iter_batches(batch_size=chunksize))
+        else:
+            sources = [pyarrow.ipc.open_file(pyarrow.memory_map(inputfile)) for inputfile in inputfiles]
+            schema = sources[0].schema
+            writer = pyarrow.ipc.new_file(outputfile, schema)
+            batches = (source.get_batch(i) for source in sources for i in range(source.num_record_batches))
+        with writer:
+            for batch in batches:
+                writer.write_batch(batch)
+    elif backend == "hdf5":
+        import h5py
+        with h5py.File(outputfile, "w") as newf:
+            group = None
+            for inputfile in inputfiles:
+                with h5py.File(inputfile, "r") as f:
+                    if group is None:
+                        group = newf.create_group(treename)
+                        group.attrs.update(f[treename].attrs)
+                        for name, dataset in f[treename].items():
+                            group.create_dataset(name, shape=(0,) + dataset.shape[1:], maxshape=(None,) + dataset.shape[1:], dtype=dataset.dtype, chunks=dataset.chunks, compression="gzip")
+                    for name, dataset in f[treename].items():
+                        for start in range(0, len(dataset), chunksize):
+                            values = dataset[start:start+chunksize]
+                            target = group[name]
+                            target.resize(len(target) + len(values), axis=0)
+                            target[-len(values):] = values
+    elif backend == "uproot":
+        import uproot
+        with uproot.open(inputfiles[0]) as f:
+            types = {name: array.dtype if array.ndim == 1 else np.dtype((array.dtype, array.shape[1:])) for name, array in f[treename].arrays(library="np", entry_stop=1).items()}
+        with uproot.recreate(outputfile) as newf:
+            tree = newf.mktree(treename, types)
+            for arrays in uproot.iterate([inputfile + ":" + treename for inputfile in inputfiles], library="np", step_size=chunksize):
+                tree.extend(arrays)
+    else:
+        raise ValueError("Unknown output backend {}, choose from {}".format(backend, ", ".join(BACKENDS)))
@@ -0,0 +1,273 @@
+import collections
+import cProfile
+import os
+import pstats
+import re
+import signal
+
+DEFAULT_INTERVAL = 0.001 #seconds of CPU time between samples
+DEFAULT_TOP = 10 #functions printed for each category
+
+CATEGORIES = ("LHE parsing", "MELA", "ROOT I/O", "other")
+
+#MELA is called through cppyy, which the profilers don't see as a separate function, so the time in MELA
+#shows up in the Python functions that call it. These are recognized by their names and by their modules.
+_MELA_FUNCTIONS = re.compile(
+    r"\b(_?setupmelainput|_resetInputEvent|setInputEvent|resetInputEvent|setProcess|computeP|computeProdP|"
+    r"compute\w*Angles|melacall|evaluateplan)\b"
+)
+_IO_FUNCTIONS = re.compile(r"\b(Fill|Write|AutoSave|FlushBaskets)\b")
+_MODULES = collections.OrderedDict((
+    ("MELA", ("lhe_hypotheses", "lhe_melacache", "mela", "pythonmelautils", "sqlite3")),
+    ("ROOT I/O", ("lhe_output", "ROOT", "cppyy", "uproot", "pyarrow", "h5py", "awkward")),
+    ("LHE parsing", (
+        "lhefile", "lhefile_methods", "lhe_classification", "lhe_columnar", "lhe_compression", "lhe_fsr",
+        "re", "gzip", "bz2", "lzma", "zlib", "_compression",
+    )),
+))
+
+
+def parse_window(window):
+    """Parses an event window for --profile-events
+
+    Parameters
+    ----------
+    window : str
+        "start:stop", "start:" or ":stop", counting from 0, with stop not included
+
+    Returns
+    -------
+    Tuple[int, Optional[int]]
+        start and stop, None for no stop
+
+    Raises
+    ------
+    ValueError
+        If the window is not in that format or is empty
+    """
+    try:
+        start, stop = window.split(":")
+        start = int(start) if start.strip() else 0
+        stop = int(stop) if stop.strip() else None
+    except ValueError:
+        raise ValueError("The event window has to be start:stop, i.e. 1000:6000, not " + window)
+    if start < 0 or stop is not None and stop <= start:
+        raise ValueError("The event window {} is empty".format(window))
+    return start, stop
+
+
+def category(filename, function):
+    """Sorts a function into one of CATEGORIES
+
+    Parameters
+    ----------
+    filename : str
+        The file the function is defined in, "~" for built-in functions
+    function : str
+        The function name, as in pstats (i.e. "<method 'Fill' of 'TTree' objects>" for built-ins)
+
+    Returns
+    -------
+    str
+        The category
+    """
+    if _MELA_FUNCTIONS.search(function):
+        return "MELA"
+    if _IO_FUNCTIONS.search(function):
+        return "ROOT I/O"
+    parts = os.path.normpath(filename).split(os.sep)
+    modules = set(parts[:-1]) | {os.path.splitext(parts[-1])[0]}
+    for name, categorymodules in _MODULES.items():
+        if modules.intersection(categorymodules):
+            return name
+    return "other"
+
+
+def _label(filename, lineno, function):
+    if filename == "~":
+        return function
+    return "{}:{}({})".format(os.path.basename(filename), lineno, function)
+
+
+class _Sampler(object):
+    """Records the Python stack every interval seconds of CPU time, with SIGPROF (so only on Unix, and only in the main thread)"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._previoushandler = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+
+    def enable(self):
+        self._previoushandler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previoushandler or signal.SIG_DFL)
+
+
+class EventWindowProfiler(object):
+    """Profiles a window of events, i.e. events 1000 to 6000 to skip the warm-up, instead of the whole program
+    (which would be dominated by setting up Mela).
+
+    Give it to an LHEFile_* class (profiler=...), or wrap any event loop with iterate.  The profiler is on from
+    just before event start is read until just before event stop is read, so the window includes the parsing of
+    its events and whatever the loop does with them.  With several input files, the events keep counting up across files.
+
+    The deterministic profiler (cProfile) writes a pstats file, the sampling profiler a collapsed stack file
+    (one "outer;...;inner count" line per stack, the input format of flamegraph.pl and speedscope).
+    """
+
+    def __init__(self, filename, start=0, stop=None, sampling=False, interval=DEFAULT_INTERVAL):
+        """
+        Parameters
+        ----------
+        filename : str
+            The file the profile is written to
+        start : int, optional
+            The first event that is profiled, by default 0
+        stop : int, optional
+            The first event after the window, by default None (to the end)
+        sampling : bool, optional
+            Sample the stack every interval instead of recording every function call, by default False.
+            Sampling slows the conversion down much less, but is less precise for short windows.
+        interval : float, optional
+            Seconds of CPU time between samples, by default DEFAULT_INTERVAL
+        """
+        self.filename = filename
+        self.start = start
+        self.stop = stop
+        self.sampling = sampling
+        self.interval = interval
+        self.events = 0
+        self.enabled = False
+        self._profiler = _Sampler(interval) if sampling else cProfile.Profile()
+
+    def enable(self):
+        if not self.enabled:
+            self._profiler.enable()
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            self._profiler.disable()
+            self.enabled = False
+
+    def iterate(self, events):
+        """Yields the events, profiling the ones in the window
+
+        Parameters
+        ----------
+        events : iterable
+            The events, i.e. an LHEFile_* object
+
+        Yields
+        ------
+        object
+            The same events
+        """
+        iterator = iter(events)
+        while True:
+            if self.events == self.start:
+                self.enable()
+            if self.events == self.stop:
+                self.disable()
+            try:
+                event = next(iterator)
+            except StopIteration:
+                return
+            yield event
+            self.events += 1
+
+    def selftimes(self):
+        """The time spent in each function itself (not in the functions it calls)
+
+        Returns
+        -------
+        dict
+            seconds for each (category, label), where label is "file.py:line(function)"
+        """
+        times = collections.Counter()
+        if self.sampling:
+            for stack, count in self._profiler.stacks.items():
+                #the category of a sample comes from the innermost frame that has one,
+                #so that i.e. the regexes run by lhefile count as LHE parsing
+                stackcategory = next((_ for _ in (category(filename, function) for filename, _, function in reversed(stack)) if _ != "other"), "other")
+                times[stackcategory, _label(*stack[-1])] += count * self.interval
+        else:
+            stats = pstats.Stats(self._profiler).stats
+            categories = {}
+
+            def resolve(key):
+                #functions without a category of their own (i.e. the C functions that the regexes run in) take the category
+                #of the caller they spend most of their time under, like the innermost frame rule for samples
+                if key not in categories:
+                    categories[key] = category(key[0], key[2])
+                    if categories[key] == "other" and key in stats and stats[key][4]:
+                        callers = stats[key][4]
+                        categories[key] = resolve(max(callers, key=lambda caller: callers[caller][3]))
+                return categories[key]
+
+            for key, (_, _, tottime, _, _) in stats.items():
+                times[resolve(key), _label(*key)] += tottime
+        return times
+
+    def report(self, n=DEFAULT_TOP):
+        """The top functions in each category, by their own time
+
+        Parameters
+        ----------
+        n : int, optional
+            The number of functions listed for each category, by default DEFAULT_TOP
+
+        Returns
+        -------
+        list[str]
+            The lines of the report
+        """
+        times = self.selftimes()
+        total = sum(times.values())
+        lines = ["Profile of {} events ({}): {:.3f} s".format(self.profiledevents, "sampled" if self.sampling else "deterministic", total)]
+        for name in CATEGORIES:
+            functions = sorted(((seconds, label) for (functioncategory, label), seconds in times.items() if functioncategory == name), reverse=True)
+            categorytotal = sum(seconds for seconds, _ in functions)
+            if not functions:
+                continue
+            lines.append("{}: {:.3f} s ({:.1%})".format(name, categorytotal, categorytotal / total if total else 0))
+            for seconds, label in functions[:n]:
+                lines.append("  {:10.3f} s  {}".format(seconds, label))
+        return lines
+
+    @property
+    def profiledevents(self):
+        """The number of events in the window that were profiled"""
+        end = self.events if self.stop is None else min(self.events, self.stop)
+        return max(end - self.start, 0)
+
+    def write(self):
+        """Writes the profile to filename: a pstats file, or collapsed stacks when sampling"""
+        if self.sampling:
+            with open(self.filename, "w") as f:
+                for stack, count in sorted(self._profiler.stacks.items()):
+                    f.write("{} {}\n".format(";".join(_label(*frame) for frame in stack), count))
+        else:
+            self._profiler.dump_stats(self.filename)
+
+    def close(self):
+        """Stops profiling and writes the profile"""
+        self.disable()
+        self.write()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
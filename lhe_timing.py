@@ -0,0 +1,213 @@
+import collections
+import json
+import math
+import sys
+import time
+
+DEFAULT_PROGRESS_INTERVAL = 10. #seconds between progress lines
+
+#Durations are histogrammed in logarithmic bins, so that the percentiles take the same memory however many events there are.
+#The bins go from 100 ns to 1000 s with 20 bins per factor of 10, so a percentile is within about 12% of the exact value.
+_MINEXPONENT = -7
+_BINSPERDECADE = 20
+_NBINS = (3 - _MINEXPONENT) * _BINSPERDECADE + 1
+
+PERCENTILES = (50, 90, 99)
+
+
+class Stage(object):
+    """The timings of one stage: how often it ran, its total time, its slowest call, and the histogram that the percentiles come from"""
+
+    __slots__ = ("count", "total", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.histogram = [0] * _NBINS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if seconds > 0:
+            index = int((math.log10(seconds) - _MINEXPONENT) * _BINSPERDECADE)
+            self.histogram[min(max(index, 0), _NBINS - 1)] += 1
+        else:
+            self.histogram[0] += 1
+
+    def combine(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def percentile(self, q):
+        """The q-th percentile of the durations, in seconds (the upper edge of the bin it falls in)"""
+        if not self.count:
+            return 0.
+        needed = q / 100 * self.count
+        cumulative = 0
+        for index, n in enumerate(self.histogram):
+            cumulative += n
+            if cumulative >= needed and n:
+                return min(10 ** (_MINEXPONENT + (index + 1) / _BINSPERDECADE), self.max)
+        return self.max
+
+    def summary(self):
+        result = collections.OrderedDict((("count", self.count), ("total", self.total), ("mean", self.total / self.count if self.count else 0.)))
+        for q in PERCENTILES:
+            result["p{}".format(q)] = self.percentile(q)
+        result["max"] = self.max
+        return result
+
+
+class StageTimer(object):
+    """Instrumentation for lhe2root.py: the time spent in each stage of the event loop, the number of MELA calls,
+    and the throughput, with a progress line printed every so often.
+
+    Nothing here is called when the instrumentation is off, so it costs nothing then.
+    """
+
+    def __init__(self, nevents=None, progressinterval=DEFAULT_PROGRESS_INTERVAL, label="", stream=None):
+        """
+        Parameters
+        ----------
+        nevents : int, optional
+            The number of events that will be processed, for the ETA, by default None (unknown)
+        progressinterval : float, optional
+            Seconds between progress lines, by default DEFAULT_PROGRESS_INTERVAL, 0 or None for none at all
+        label : str, optional
+            Printed at the start of every progress line (i.e. the output file of a parallel job), by default ""
+        stream : file, optional
+            Where the progress lines go, by default sys.stderr
+        """
+        self.nevents = nevents
+        self.progressinterval = progressinterval
+        self.label = label
+        self.stream = stream
+        self.stages = collections.OrderedDict()
+        self.melacalls = collections.Counter()
+        self.events = 0
+        self.elapsed = 0.
+        self._start = self._lastprogress = self._mark = None
+
+    def __getstate__(self):
+        #sent back from the worker processes of convertparallel, without the stream
+        state = self.__dict__.copy()
+        state["stream"] = None
+        return state
+
+    def start(self):
+        """Starts the clock for the throughput and for lap"""
+        self._start = self._lastprogress = self._mark = time.perf_counter()
+
+    def mark(self):
+        """Starts the clock for the next lap"""
+        self._mark = time.perf_counter()
+
+    def lap(self, stage):
+        """Records the time since the last mark or lap as stage"""
+        now = time.perf_counter()
+        self.add(stage, now - self._mark)
+        self._mark = now
+
+    def add(self, stage, seconds):
+        """Records that stage took seconds once"""
+        try:
+            self.stages[stage].add(seconds)
+        except KeyError:
+            self.stages[stage] = Stage()
+            self.stages[stage].add(seconds)
+
+    def wrap(self, stage, function):
+        """Wraps function so that every call to it is recorded as stage"""
+        clock = time.perf_counter
+        add = self.add
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(stage, clock() - start)
+        timed.__name__ = getattr(function, "__name__", stage)
+        return timed
+
+    def countmela(self, name, ncalls=1):
+        """Records ncalls MELA calls for name (a MELA function, or a function and hypothesis)"""
+        self.melacalls[name] += ncalls
+
+    def event(self):
+        """Records that one more event is done, and prints the progress line if it is time for it"""
+        self.events += 1
+        now = time.perf_counter()
+        self.elapsed = now - self._start
+        if self.progressinterval and now - self._lastprogress >= self.progressinterval:
+            self._lastprogress = now
+            print(self.progressline(), file=self.stream or sys.stderr, flush=True)
+
+    def finish(self):
+        if self._start is not None:
+            self.elapsed = time.perf_counter() - self._start
+
+    @property
+    def rate(self):
+        """Events per second"""
+        return self.events / self.elapsed if self.elapsed else 0.
+
+    @property
+    def eta(self):
+        """The estimated seconds left, or None if the number of events isn't known"""
+        if self.nevents is None or not self.rate:
+            return None
+        return max(self.nevents - self.events, 0) / self.rate
+
+    def progressline(self):
+        """A one line description of how far the conversion is"""
+        line = "{}{} events".format(self.label + ": " if self.label else "", self.events)
+        if self.nevents:
+            line += " of {} ({:.1%})".format(self.nevents, self.events / self.nevents)
+        line += ", {:.1f} events/s".format(self.rate)
+        if self.eta is not None:
+            line += ", ETA {}".format(_formatduration(self.eta))
+        total = sum(stage.total for stage in self.stages.values())
+        if total:
+            slowest = max(self.stages, key=lambda name: self.stages[name].total)
+            line += ", {:.0%} in {}".format(self.stages[slowest].total / total, slowest)
+        return line
+
+    def combine(self, other):
+        """Adds the timings of another StageTimer, i.e. from another job of the same conversion, which ran at the same time"""
+        for name, stage in other.stages.items():
+            self.stages.setdefault(name, Stage()).combine(stage)
+        self.melacalls.update(other.melacalls)
+        self.events += other.events
+        self.elapsed = max(self.elapsed, other.elapsed)
+        if self.nevents is not None and other.nevents is not None:
+            self.nevents += other.nevents
+        else:
+            self.nevents = None
+
+    def summary(self):
+        """Everything that was recorded, as a JSON-serializable dict. Times are in seconds."""
+        return collections.OrderedDict((
+            ("events", self.events),
+            ("expected_events", self.nevents),
+            ("elapsed", self.elapsed),
+            ("events_per_second", self.rate),
+            ("stages", collections.OrderedDict((name, stage.summary()) for name, stage in self.stages.items())),
+            ("mela_calls", collections.OrderedDict(sorted(self.melacalls.items()))),
+        ))
+
+    def write(self, filename):
+        """Writes summary() to filename as JSON"""
+        with open(filename, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def _formatduration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
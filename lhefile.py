@@ -1,10 +1,10 @@
 import abc
 import collections
-import re
+import itertools
 
 if __name__ == "__main__":
-  import argparse, itertools, sys, unittest
-  from .mela import TVar
+  import argparse, sys, unittest
+  from mela import TVar
   parser = argparse.ArgumentParser()
   parser.add_argument('--lhefile-hwithdecay')
   parser.add_argument('--lhefile-hwithdecayonly')  
@@ -13,22 +13,61 @@ if __name__ == "__main__":
   parser.add_argument('unittest_args', nargs='*')
   args = parser.parse_args()
 
+import numpy as np
 import ROOT
 
 from mela import Mela, SimpleParticle_t, SimpleParticleCollection_t
 
+import lhe_classification
+import lhe_columnar
+import lhe_compression
+import lhefile_methods
+
 InputEvent = collections.namedtuple("InputEvent", "daughters associated mothers isgen")
 
+def jetids(ids, hidejetflavor):
+  """
+  Replace quark and gluon ids with 0, which means unknown jet, if hidejetflavor is True
+  """
+  if not hidejetflavor: return ids
+  return [0 if abs(id) in lhe_classification.JET_IDS else id for id in ids]
+
+def particlecollection(particles):
+  """
+  Build a SimpleParticleCollection_t straight from (id, (px, py, pz, E)) pairs, without going through LHE text
+  """
+  collection = SimpleParticleCollection_t([])
+  for id, momentum in particles:
+    collection.push_back(SimpleParticle_t(int(id), ROOT.TLorentzVector(*momentum)))
+  return collection
+
+def inputeventfrombatch(batch, categories, i, isgen, hidejetflavor=True):
+  """
+  Build the MELA input of event i of an lhe_columnar.EventBatch straight from its columns.
+  categories has to be the output of lhe_classification.classify_batch for the batch.
+  Unlike the LHEEvent classes, this doesn't check the number of particles in each category.
+  """
+  start, stop = batch.offsets[i], batch.offsets[i+1]
+  ids = jetids(batch.id[start:stop].tolist(), hidejetflavor and not isgen)
+  momenta = np.stack([batch.px[start:stop], batch.py[start:stop], batch.pz[start:stop], batch.E[start:stop]], axis=1).tolist()
+  eventcategories = categories[start:stop]
+  daughters, associated, mothers = (
+    particlecollection((ids[j], momenta[j]) for j in np.flatnonzero(eventcategories == k))
+    for k in range(len(lhe_classification.CATEGORIES))
+  )
+  if not isgen or not list(mothers): mothers = None
+  return InputEvent(daughters, associated, mothers, isgen)
+
 class LHEEvent(object, metaclass=abc.ABCMeta):
+  """
+  One event from an LHE file.  The event weight is read right away, but the weights dict
+  and the particle collections are only built the first time they are used.
+  """
   def __init__(self, event, isgen):
-    lines = event.split("\n")
-
-    self.weights = {}
-    for line in lines:
-      if "<wgt" not in line: continue
-      match = re.match("<wgt id='(.*)'>([0-9+Ee.-]*)</wgt>", line)
-      if match: self.weights[match.group(1)] = float(match.group(2))
+    self.event = event
+    self.isgen = isgen
 
+    lines = event.split("\n")
     lines = [line for line in lines if not ("<" in line or ">" in line or not line.split("#")[0].strip())]
     nparticles, _, weight, _, _, _ = lines[0].split()
 
@@ -36,128 +75,120 @@ class LHEEvent(object, metaclass=abc.ABCMeta):
     self.weight = float(weight)
     if nparticles != len(lines)-1:
       raise ValueError("Wrong number of particles! Should be {}, have {}".format(nparticles, len(lines)-1))
-
-    daughters, associated, mothers = (SimpleParticleCollection_t(_) for _ in self.extracteventparticles(lines[1:], isgen))
-    if not list(mothers): mothers = None
-    self.daughters, self.associated, self.mothers, self.isgen = self.inputevent = InputEvent(daughters, associated, mothers, isgen)
+    self.lines = lines
+
+    self._weights = None
+    self._particles = None
+    self._inputevent = None
+
+  @property
+  def weights(self):
+    if self._weights is None:
+      self._weights = {weightid: float(value) for weightid, value in lhefile_methods.WEIGHT_REGEX.findall(self.event)}
+    return self._weights
+
+  @property
+  def particles(self):
+    """
+    daughters, associated, mothers as lists of (id, (px, py, pz, E)), before they are made into MELA particle collections.
+    Setting this (i.e. after merging photons, see lhe_fsr) changes what inputevent builds.
+    """
+    if self._particles is None:
+      self._particles = self.extracteventparticles(self.lines[1:], self.isgen)
+    return self._particles
+  @particles.setter
+  def particles(self, particles):
+    self._particles = tuple(particles)
+    self._inputevent = None
+
+  @property
+  def inputevent(self):
+    if self._inputevent is None:
+      daughters, associated, mothers = (particlecollection(_) if _ is not None else None for _ in self.particles)
+      if mothers is not None and not list(mothers): mothers = None
+      self._inputevent = InputEvent(daughters, associated, mothers, self.isgen)
+    return self._inputevent
+
+  @property
+  def daughters(self): return self.inputevent.daughters
+  @property
+  def associated(self): return self.inputevent.associated
+  @property
+  def mothers(self): return self.inputevent.mothers
 
   @abc.abstractmethod
-  def extracteventparticles(cls, lines, isgen): "has to be a classmethod that returns daughters, associated, mothers"
+  def extracteventparticles(cls, lines, isgen): "has to be a classmethod that returns daughters, associated, mothers as lists of (id, (px, py, pz, E))"
+
+  #the lhe_classification rule that sorts the particles into daughters, associated and mothers
+  classificationrule = None
+  #whether quark and gluon ids are written as 0 (unknown jet) when isgen is False
+  hidejetflavor = True
+
+  @classmethod
+  def parseparticles(cls, lines):
+    """
+    Parse the particle lines into ids, statuses, mothers and (px, py, pz, E), splitting each line only once
+    """
+    fields = [line.split() for line in lines]
+    ids, statuses, mother1s, mother2s = (tuple(int(f[i]) for f in fields) for i in range(4))
+    momenta = tuple(tuple(float(_) for _ in f[6:10]) for f in fields)
+    return lhe_classification.ParticleColumns(ids, statuses, mother1s, mother2s, momenta)
+
+  @classmethod
+  def classifyparticles(cls, lines, isgen, particles=None):
+    """
+    Sort the particles into daughters, associated and mothers according to cls.classificationrule.
+    The mother graph is resolved once for the whole event, see lhe_classification.
+    Each particle is returned as (id, (px, py, pz, E)), ready for particlecollection.
+    """
+    if particles is None: particles = cls.parseparticles(lines)
+    selected = lhe_classification.classify_particles(cls.classificationrule, particles)
+    ids = jetids(particles.ids, cls.hidejetflavor and not isgen)
+    return tuple([(ids[i], particles.momenta[i]) for i in selected[category]] for category in lhe_classification.CATEGORIES)
 
   def __iter__(self):
     return iter(self.inputevent)
 
 class LHEEvent_Hwithdecay(LHEEvent):
+  classificationrule = lhe_classification.HWITHDECAY
   @classmethod
   def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    ids = [None]
-    mother1s = [None]
-    mother2s = [None]
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      ids.append(id)
-      if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-        line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      mother1s.append(mother1)
-      mother2s.append(mother2)
-      if status == -1:
-        mothers.append(line)
-      elif status == 1 and (1 <= abs(id) <= 6 or 11 <= abs(id) <= 16 or abs(id) in (21, 22)):
-        while True:
-          if mother1 != mother2 or mother1 is None:
-            associated.append(line)
-            break
-          if ids[mother1] in (25, 39):
-            daughters.append(line)
-            break
-          mother2 = mother2s[mother1]
-          mother1 = mother1s[mother1]
-
+    daughters, associated, mothers = cls.classifyparticles(lines, isgen)
     if not isgen: mothers = None
     return daughters, associated, mothers
 
 
 class LHEEvent_VHHiggsdecay(LHEEvent):
+  classificationrule = lhe_classification.VHHIGGSDECAY
+  hidejetflavor = False
   @classmethod
   def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    ids = [None]
-    mother1s = [None]
-    mother2s = [None]
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      ids.append(id)
-      
-      #if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-      #  line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      mother1s.append(mother1)
-      mother2s.append(mother2)
-      if status == -1:
-        mothers.append(line)
-      elif status == 1 and (1 <= abs(id) <= 6 or 11 <= abs(id) <= 16 or abs(id) in (21, 22)):
-        
-          if mother1 is None or ids is None or mother1s[mother1] is None :
-            #associated.append(line)
-            continue
-          
-          if mother1 == mother2 and abs(ids[mother1]) in (23,24) and  not ids[mother1s[mother1]] == 25 :
-            associated.append(line)
-            
-          
-          if mother1 == mother2 and abs(ids[mother1]) == 23 and  ids[mother1s[mother1]] == 25:
-            daughters.append(line)
-            
+    daughters, associated, mothers = cls.classifyparticles(lines, isgen)
     if not isgen: mothers = None
     return daughters, associated, mothers
 
 
   
 class LHEEvent_HwithdecayOnly(LHEEvent):
+  classificationrule = lhe_classification.HWITHDECAYONLY
   @classmethod
   def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    ids = [None]
-    mother1s = [None]
-    mother2s = [None]
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      ids.append(id)
-      if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-        line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      mother1s.append(mother1)
-      mother2s.append(mother2)
-      if(abs(id) == 22 ):
-        associated.append(line)
-      #1 <= abs(id) <= 6 or
-      if ( 11 <= abs(id) <= 16 ):
-          daughters.append(line)
-          #if args.merge_photon:
-          #  print line
-
+    daughters, associated, mothers = cls.classifyparticles(lines, isgen)
     if not isgen: mothers = None
-
     return daughters, associated, mothers
 
 
 
   
 class LHEEvent_StableHiggs(LHEEvent):
+  classificationrule = lhe_classification.STABLEHIGGS
   @classmethod
   def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-        line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      if status == -1:
-        mothers.append(line)
-      if id == 25:
-        if status != 1:
-          raise ValueError("Higgs has status {}, expected it to be 1\n\n".format(status) + "\n".join(lines))
-        daughters.append(line)
-      if abs(id) in (0, 1, 2, 3, 4, 5, 11, 12, 13, 14, 15, 16, 21) and status == 1:
-        associated.append(line)
+    particles = cls.parseparticles(lines)
+    for id, status in zip(particles.ids, particles.statuses):
+      if id == 25 and status != 1:
+        raise ValueError("Higgs has status {}, expected it to be 1\n\n".format(status) + "\n".join(lines))
+    daughters, associated, mothers = cls.classifyparticles(lines, isgen, particles)
 
     if len(daughters) != 1:
       raise ValueError("More than one H in the event??\n\n"+"\n".join(lines))
@@ -172,68 +203,17 @@ class LHEEvent_StableHiggs(LHEEvent):
   nassociatedparticles = None
 
 class LHEEvent_StableHiggsVH(LHEEvent):
+  classificationrule = lhe_classification.STABLEHIGGSVH
+  hidejetflavor = False
   @classmethod
   def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    ids = [None]
-    mother1s = [None]
-    mother2s = [None]
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      ids.append(id)
-
-      #if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-      #  line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      mother1s.append(mother1)
-      mother2s.append(mother2)
-      if status == -1:
-        mothers.append(line)
-      elif id == 25:
-        daughters.append(line)
-      elif status == 1 and (1 <= abs(id) <= 6 or 11 <= abs(id) <= 16 or abs(id) in (21, 22)):
-
-          if mother1 is None or ids is None or mother1s[mother1] is None :
-            #associated.append(line)
-            continue
-
-          if mother1 == mother2 and abs(ids[mother1]) in (23,24) and not ids[mother1s[mother1]] == 25 :
-            associated.append(line)
- 
-          #elif mother1!= mother2:
-            #associated.append(line)
-
+    daughters, associated, mothers = cls.classifyparticles(lines, isgen)
     if not isgen: mothers = None
     return daughters, associated, mothers
 
 
-class LHEEvent_StableHiggsZHHAWK(LHEEvent):
-  @classmethod
-  def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-        line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      if status == -1:
-        mothers.append(line)
-      if id == 25:
-        if status != 1:
-          raise ValueError("Higgs has status {}, expected it to be 1\n\n".format(status) + "\n".join(lines))
-        daughters.append(line)
-      if abs(id) in (0, 1, 2, 3, 4, 5, 11, 12, 13, 14, 15, 16, 21,22) and status == 1:
-        associated.append(line)
-
-    if len(daughters) != 1:
-      raise ValueError("More than one H in the event??\n\n"+"\n".join(lines))
-    if cls.nassociatedparticles is not None and len(associated) != cls.nassociatedparticles:
-      raise ValueError("Wrong number of associated particles (expected {}, found {})\n\n".format(cls.nassociatedparticles, len(associated))+"\n".join(lines))
-    if len(mothers) != 2:
-      raise ValueError("{} mothers in the event??\n\n".format(len(mothers))+"\n".join(lines))
-
-    if not isgen: mothers = None
-    return daughters, associated, mothers
-
-  nassociatedparticles = None
+class LHEEvent_StableHiggsZHHAWK(LHEEvent_StableHiggs):
+  classificationrule = lhe_classification.STABLEHIGGSZHHAWK
 
 
   
@@ -244,19 +224,10 @@ class LHEEvent_JHUGenttH(LHEEvent_StableHiggs):
   nassociatedparticles = 6
 
 class LHEEvent_Offshell4l(LHEEvent):
+  classificationrule = lhe_classification.OFFSHELL4L
   @classmethod
   def extracteventparticles(cls, lines, isgen):
-    daughters, mothers, associated = [], [], []
-    for line in lines:
-      id, status, mother1, mother2 = (int(_) for _ in line.split()[0:4])
-      if (1 <= abs(id) <= 6 or abs(id) == 21) and not isgen:
-        line = line.replace(str(id), "0", 1)  #replace the first instance of the jet id with 0, which means unknown jet
-      if status == -1:
-        mothers.append(line)
-      if abs(id) in (11, 12, 13, 14, 15, 16) and status == 1:
-        daughters.append(line)
-      if abs(id) in (0, 1, 2, 3, 4, 5, 21) and status == 1:
-        associated.append(line)
+    daughters, associated, mothers = cls.classifyparticles(lines, isgen)
 
     if len(daughters) != 4:
       raise ValueError("Wrong number of daughters (expected {}, found {})\n\n".format(4, len(daughters))+"\n".join(lines))
@@ -289,19 +260,27 @@ class LHEFileBase(object, metaclass=abc.ABCMeta):
   __melas = {}
 
   def __init__(self, filename, *melaargs, **kwargs):
+    self._lheevent = None
+    self._linenumber = None
+    self._melainputset = False
     self.isgen = kwargs.pop("isgen", True)
     reusemela = kwargs.pop("reusemela", False)
-    gzip = kwargs.pop("gzip", False)
+    kwargs.pop("gzip", None) #compressed files are now detected automatically, this is only kept so that old scripts still work
+    decompressionthreads = kwargs.pop("decompressionthreads", None)
+    self.photonmerger = kwargs.pop("photonmerger", None)
+    self.profiler = kwargs.pop("profiler", None)
+    self.blocksize = kwargs.pop("blocksize", lhefile_methods.DEFAULT_BLOCKSIZE)
     if kwargs: raise ValueError("Unknown kwargs: " + ", ".join(kwargs))
     self.filename = filename
+    self._index = None
+    self._weightids = None
+    self._weightparser = None
     if reusemela and melaargs in self.__melas:
       self.mela = self.__melas[melaargs]
     else:
       self.__melas[melaargs] = self.mela = Mela(*melaargs)
 
-    openfunction = open
-    if gzip: from gzip import GzipFile as openfunction
-    self.f = openfunction(self.filename)
+    self.f = lhe_compression.open_lhe(self.filename, decompressionthreads)
   def __enter__(self, *args, **kwargs):
     self.f.__enter__(*args, **kwargs)
     return self
@@ -309,42 +288,210 @@ class LHEFileBase(object, metaclass=abc.ABCMeta):
     return self.f.__exit__(*args, **kwargs)
 
   def __iter__(self):
-    event = ""
-    for linenumber, line in enumerate(self.f, start=1):
-      if "<event>" not in line and not event:
-        continue
-      event += line
-      if "</event>" in line:
+    return self._profiled(self._iterevents(lhefile_methods.iter_event_blocks(self.f, self.blocksize)))
+
+  @property
+  def index(self):
+    """
+    The byte offset of every event, from the .lheidx sidecar file (built on first use)
+    """
+    if self._index is None:
+      self._index = lhefile_methods.load_event_index(self.filename, self.blocksize)
+    return self._index
+
+  def tell(self):
+    """
+    How many bytes of the (decompressed) file have been read so far, which is ahead of the current event by up to one block.
+    Unlike the index, this doesn't need an extra pass through the file.
+    """
+    return self.f.tell()
+
+  def __len__(self):
+    return len(self.index.offsets)
+
+  def __getitem__(self, i):
+    nevents = len(self)
+    if i < 0: i += nevents
+    if not 0 <= i < nevents: raise IndexError("Event {} is out of range for a file with {} events".format(i, nevents))
+    self._resetInputEvent()
+    event = lhefile_methods.read_event(self.f, self.index, i)
+    linenumber = self.index.linenumbers[i] + event.count(b"\n")
+    try:
+      self._setInputEvent(event.decode(), linenumber)
+      if self.photonmerger is not None:
+        self._lheevent.particles, = self.photonmerger.merge([self._lheevent.particles])
+    except:
+      print("On line", linenumber)
+      raise
+    return self
+
+  def islice(self, start, stop=None):
+    """
+    Iterate through events start, ..., stop-1 (or to the end of the file), seeking straight to the first one
+    """
+    nevents = len(self)
+    if stop is None or stop > nevents: stop = nevents
+    if start >= stop: return
+    self.f.seek(self.index.offsets[start])
+    eventblocks = lhefile_methods.iter_event_blocks(self.f, self.blocksize, linenumber=self.index.linenumbers[start])
+    yield from self._profiled(self._iterevents(itertools.islice(eventblocks, stop - start)))
+
+  def _profiled(self, events):
+    """
+    Profile the events in the profiler's window, if there is a profiler (an lhe_profile.EventWindowProfiler)
+    """
+    if self.profiler is None: return events
+    return self.profiler.iterate(events)
+
+  def _iterevents(self, eventblocks):
+    if self.photonmerger is not None:
+      yield from self._itermergedevents(eventblocks)
+      return
+    for linenumber, event in eventblocks:
+      try:
+        self._setInputEvent(event.decode(), linenumber)
+        yield self
+      except GeneratorExit:
+        raise
+      except:
+        print("On line", linenumber)
+        raise
+      finally:
+        self._resetInputEvent()
+
+  def _itermergedevents(self, eventblocks):
+    """
+    Like _iterevents, but parses photonmerger.chunksize events ahead so that their photons are merged together, before any of them goes to MELA
+    """
+    while True:
+      chunk = []
+      for linenumber, event in itertools.islice(eventblocks, self.photonmerger.chunksize):
         try:
-          self._setInputEvent(event)
-          yield self
-          event = ""
-        except GeneratorExit:
-          raise
+          lheevent = self.lheeventclass(event.decode(), self.isgen)
+          lheevent.particles
         except:
           print("On line", linenumber)
           raise
+        chunk.append((linenumber, lheevent))
+      if not chunk: return
+
+      merged = self.photonmerger.merge([lheevent.particles for _, lheevent in chunk])
+      for (linenumber, lheevent), particles in zip(chunk, merged):
+        lheevent.particles = particles
+        self._setLHEEvent(lheevent, linenumber)
+        try:
+          yield self
         finally:
-          try:
-            self.mela.resetInputEvent()
-          except:
-            pass
-
-  def _setInputEvent(self, event):
-    lheevent = self.lheeventclass(event, self.isgen)
-    self.daughters = lheevent.daughters
-    self.associated = lheevent.associated
-    self.mothers = lheevent.mothers
-    self.weight = lheevent.weight
-    self.weights = lheevent.weights
-    self.setInputEvent(*lheevent)
+          self._resetInputEvent()
+
+  def iter_batches(self, batch_size=10000):
+    """
+    Iterate through the file in batches of events parsed into flat NumPy columns (see lhe_columnar.EventBatch).
+    This does not touch MELA, and the particle ids are the ones in the file, regardless of isgen.
+    """
+    return lhe_columnar.iter_batches(self.f, batch_size, self.blocksize)
+
+  def iter_inputevents(self, batch_size=10000):
+    """
+    Iterate through the MELA inputs (InputEvent) of the events, built straight from the columnar batches
+    without parsing any text per particle. This skips the sanity checks in lheeventclass.
+    """
+    rule, hidejetflavor = self.lheeventclass.classificationrule, self.lheeventclass.hidejetflavor
+    for batch in self.iter_batches(batch_size):
+      categories = lhe_classification.classify_batch(rule, batch)
+      for i in range(len(batch.nparticles)):
+        yield inputeventfrombatch(batch, categories, i, self.isgen, hidejetflavor)
+
+  @property
+  def weightids(self):
+    """
+    The ids of the reweighting weights, in the order they are declared in the file.
+    This can be set to a different order (or a subset) to change the columns returned by readweights.
+    """
+    if self._weightids is None:
+      self._weightids = lhefile_methods.get_weight_ids(self.filename)
+    return self._weightids
+  @weightids.setter
+  def weightids(self, weightids):
+    self._weightids = list(weightids)
+    self._weightparser = None
+
+  def readweights(self, out=None):
+    """
+    Parse the <rwgt> block of the current event into an array with one entry per weight id, in the order of weightids
+    """
+    if self._weightparser is None:
+      self._weightparser = lhefile_methods.WeightParser(self.weightids)
+    return self._weightparser.parse(self._event, out)
+
+  def _setInputEvent(self, event, linenumber=None):
+    """
+    Make event the current event.  Nothing is handed to MELA yet: that happens in _setupmelainput,
+    the first time a MELA method is used for this event.
+    """
+    self._setLHEEvent(self.lheeventclass(event, self.isgen), linenumber)
+
+  def _setLHEEvent(self, lheevent, linenumber=None):
+    self._event = lheevent.event
+    self._linenumber = linenumber
+    self._melainputset = False
+    self._lheevent = lheevent
+
+  def _setupmelainput(self):
+    if self._melainputset or self._lheevent is None: return
+    self.mela.setInputEvent(*self.inputevent)
+    self._melainputset = True
+
+  def setupmelainput(self):
+    """
+    Hand the current event to MELA now, instead of in the first MELA call (i.e. to time it on its own)
+    """
+    self._setupmelainput()
+
+  def _resetInputEvent(self):
+    if not self._melainputset: return
+    self._melainputset = False
+    try:
+      self.mela.resetInputEvent()
+    except:
+      pass
+
+  @property
+  def inputevent(self):
+    try:
+      return self._lheevent.inputevent
+    except ValueError:
+      print("On line", self._linenumber)
+      raise
+
+  @property
+  def daughters(self): return self.inputevent.daughters
+  @property
+  def associated(self): return self.inputevent.associated
+  @property
+  def mothers(self): return self.inputevent.mothers
+  @property
+  def particles(self): return self._lheevent.particles
+  @property
+  def weight(self): return self._lheevent.weight
+  @property
+  def weights(self): return self._lheevent.weights
 
   @classmethod
   def _LHEclassattributes(cls):
-    return "filename", "f", "mela", "isgen", "daughters", "mothers", "associated", "weight", "weights"
+    return (
+      "filename", "f", "blocksize", "photonmerger", "profiler", "_index", "_event", "_linenumber", "_lheevent", "_melainputset", "weightids", "_weightids", "_weightparser",
+      "mela", "isgen", "inputevent", "particles", "daughters", "mothers", "associated", "weight", "weights",
+    )
 
   def __getattr__(self, attr):
     if attr == "mela": raise RuntimeError("Something is wrong, trying to access mela before it's created")
+    if attr in self._LHEclassattributes(): raise AttributeError(attr)
+    if attr in ("setInputEvent", "resetInputEvent"):
+      #calling these by hand takes over from the automatic setup
+      self._melainputset = attr == "setInputEvent"
+    else:
+      self._setupmelainput()
     return getattr(self.mela, attr)
   def __setattr__(self, attr, value):
     if attr in self._LHEclassattributes():
@@ -372,6 +519,103 @@ class LHEFile_VHHiggsdecay(LHEFileBase):
   lheeventclass = LHEEvent_VHHiggsdecay
   
 if __name__ == '__main__':
+  #The particle classification of the LHEEvent_* classes before the lhe_classification rule tables,
+  #as (0-based) indices of the daughters, associated particles and mothers.  The rules have to agree with these.
+  #None means that the old class raised an error for the event.
+  def _finalstate(id):
+    return 1 <= abs(id) <= 6 or 11 <= abs(id) <= 16 or abs(id) in (21, 22)
+
+  def _referencehwithdecay(ids, statuses, mother1s, mother2s):
+    daughters, associated, mothers = [], [], []
+    ids, mother1s, mother2s = [None]+list(ids), [None]+list(mother1s), [None]+list(mother2s)
+    for i, status in enumerate(statuses):
+      mother1, mother2 = mother1s[i+1], mother2s[i+1]
+      if status == -1:
+        mothers.append(i)
+      elif status == 1 and _finalstate(ids[i+1]):
+        while True:
+          if mother1 != mother2 or mother1 is None:
+            associated.append(i)
+            break
+          if ids[mother1] in (25, 39):
+            daughters.append(i)
+            break
+          mother2 = mother2s[mother1]
+          mother1 = mother1s[mother1]
+    return daughters, associated, mothers
+
+  def _referencevhdecay(stablehiggs):
+    def classify(ids, statuses, mother1s, mother2s):
+      daughters, associated, mothers = [], [], []
+      ids, mother1s, mother2s = [None]+list(ids), [None]+list(mother1s), [None]+list(mother2s)
+      for i, status in enumerate(statuses):
+        id, mother1, mother2 = ids[i+1], mother1s[i+1], mother2s[i+1]
+        if status == -1:
+          mothers.append(i)
+        elif stablehiggs and id == 25:
+          daughters.append(i)
+        elif status == 1 and _finalstate(id):
+          if mother1s[mother1] is None: continue
+          if mother1 == mother2 and abs(ids[mother1]) in (23, 24) and not ids[mother1s[mother1]] == 25:
+            associated.append(i)
+          if not stablehiggs and mother1 == mother2 and abs(ids[mother1]) == 23 and ids[mother1s[mother1]] == 25:
+            daughters.append(i)
+      return daughters, associated, mothers
+    return classify
+
+  def _referencehwithdecayonly(ids, statuses, mother1s, mother2s):
+    daughters, associated = [], []
+    for i, id in enumerate(ids):
+      if abs(id) == 22: associated.append(i)
+      if 11 <= abs(id) <= 16: daughters.append(i)
+    return daughters, associated, []
+
+  def _referencestablehiggs(associatedids):
+    def classify(ids, statuses, mother1s, mother2s):
+      daughters, associated, mothers = [], [], []
+      for i, (id, status) in enumerate(zip(ids, statuses)):
+        if status == -1: mothers.append(i)
+        if id == 25:
+          if status != 1: return None
+          daughters.append(i)
+        if abs(id) in associatedids and status == 1: associated.append(i)
+      return daughters, associated, mothers
+    return classify
+
+  def _referenceoffshell4l(ids, statuses, mother1s, mother2s):
+    daughters, associated, mothers = [], [], []
+    for i, (id, status) in enumerate(zip(ids, statuses)):
+      if status == -1: mothers.append(i)
+      if abs(id) in (11, 12, 13, 14, 15, 16) and status == 1: daughters.append(i)
+      if abs(id) in (0, 1, 2, 3, 4, 5, 21) and status == 1: associated.append(i)
+    return daughters, associated, mothers
+
+  REFERENCECLASSIFICATIONS = (
+    (LHEEvent_Hwithdecay, _referencehwithdecay),
+    (LHEEvent_VHHiggsdecay, _referencevhdecay(stablehiggs=False)),
+    (LHEEvent_HwithdecayOnly, _referencehwithdecayonly),
+    (LHEEvent_StableHiggs, _referencestablehiggs((0, 1, 2, 3, 4, 5, 11, 12, 13, 14, 15, 16, 21))),
+    (LHEEvent_StableHiggsVH, _referencevhdecay(stablehiggs=True)),
+    (LHEEvent_StableHiggsZHHAWK, _referencestablehiggs((0, 1, 2, 3, 4, 5, 11, 12, 13, 14, 15, 16, 21, 22))),
+    (LHEEvent_Offshell4l, _referenceoffshell4l),
+  )
+
+  def randomevent(rng):
+    """
+    The text of an event with random ids, statuses and mothers.  The mothers of each particle come before it,
+    so the graph has no loops, and px is the index of the particle so that it can be recognized after the classification.
+    """
+    nparticles = int(rng.integers(1, 16))
+    lines = ["<event>", "{} 1 1.0 125.0 0.0078125 0.118".format(nparticles)]
+    for i in range(nparticles):
+      id = int(rng.choice((0, 1, -2, 3, -5, 6, 11, -12, 13, -15, 16, 21, 22, 23, -24, 24, 25, 39)))
+      status = int(rng.choice((-1, 1, 1, 2)))
+      mother1 = int(rng.integers(0, i+1))
+      mother2 = mother1 if rng.uniform() < 0.7 else int(rng.integers(0, i+1))
+      lines.append("{} {} {} {} 0 0 {} 0.0 0.0 1.0 0.0 0.0 9.0".format(id, status, mother1, mother2, float(i)))
+    lines.append("</event>")
+    return "\n".join(lines) + "\n"
+
   class TestLHEFiles(unittest.TestCase):
     @unittest.skipUnless(args.lhefile_hwithdecay, "needs --lhefile-hwithdecay argument")
     def testHwithDecay(self):
@@ -408,4 +652,33 @@ if __name__ == '__main__':
         for event, i in zip(f, list(range(10))):
           pass
 
+    def testClassificationRules(self):
+      rng = np.random.default_rng(0)
+      for _ in range(10000):
+        event = randomevent(rng)
+        lines = [line for line in event.split("\n")[2:] if line and "<" not in line]
+        for eventclass, reference in REFERENCECLASSIFICATIONS:
+          particles = eventclass.parseparticles(lines)
+          expected = reference(particles.ids, particles.statuses, particles.mother1s, particles.mother2s)
+          if expected is None: continue #the old class raised, and so does extracteventparticles
+          classified = eventclass.classifyparticles(lines, True, particles)
+          found = tuple([int(momentum[0]) for _, momentum in category] for category in classified)
+          self.assertEqual(found, tuple(expected), eventclass.__name__+"\n"+event)
+
+    def testClassifyBatch(self):
+      rng = np.random.default_rng(1)
+      events = [randomevent(rng) for _ in range(10000)]
+      batch = lhe_columnar.parse_event_batch([event.encode() for event in events])
+      for eventclass, _ in REFERENCECLASSIFICATIONS:
+        rule = eventclass.classificationrule
+        categories = lhe_classification.classify_batch(rule, batch)
+        for i, event in enumerate(events):
+          start, stop = batch.offsets[i], batch.offsets[i+1]
+          particles = lhe_classification.ParticleColumns(*(column[start:stop].tolist() for column in (batch.id, batch.status, batch.mother1, batch.mother2)))
+          selected = lhe_classification.classify_particles(rule, particles)
+          expected = np.full(stop - start, -1)
+          for k, category in enumerate(lhe_classification.CATEGORIES):
+            expected[selected[category]] = k
+          np.testing.assert_array_equal(categories[start:stop], expected, eventclass.__name__+"\n"+event)
+
   unittest.main(argv=[sys.argv[0]]+args.unittest_args)
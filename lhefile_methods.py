@@ -1,6 +1,503 @@
+import collections
+import itertools
+import os
 import re
+from array import array
+import numpy as np
+import lhe_compression
 import lhe_constants
 
+EVENT_START = b"<event>"
+EVENT_END = b"</event>"
+DEFAULT_BLOCKSIZE = 1 << 22 #4 MiB per read keeps the number of Python-level iterations per event tiny
+
+INDEX_SUFFIX = ".lheidx"
+INDEX_VERSION = 1
+#offsets, lengths and linenumbers (the line of each <event> tag) are arrays with one entry per event.
+#size and mtime (in ns) describe the LHE file the index was built from.
+EventIndex = collections.namedtuple("EventIndex", "offsets lengths linenumbers size mtime")
+
+WEIGHT_REGEX = re.compile(r"""<wgt\s+id=['"]([^'"]*)['"]\s*>\s*([0-9+Ee.-]+)\s*</wgt>""") #one reweighting entry in an event's <rwgt> block
+INITRWGT_REGEX = re.compile(r"<initrwgt>(.*?)</initrwgt>", re.DOTALL)
+WEIGHT_ID_REGEX = re.compile(r"""<weight\s+id=['"]([^'"]*)['"]""") #one weight declaration in the <initrwgt> block
+INIT_REGEX = re.compile(r"<init>(.*?)</init>", re.DOTALL)
+#the tags of the <initrwgt> block, in order: <weightgroup ...> (group 1 has its attributes), </weightgroup> and <weight id=...> (group 2 has the id)
+INITRWGT_TAG_REGEX = re.compile(r"""<weightgroup\b([^>]*)>|</weightgroup>|<weight\s+id=['"]([^'"]*)['"]""")
+GENERATOR_REGEX = re.compile(r"<generator\b([^>]*)>", re.IGNORECASE)
+MGVERSION_REGEX = re.compile(r"<MGVersion>\s*#?\s*(\S+)\s*</MGVersion>", re.DOTALL)
+ATTRIBUTE_REGEX = re.compile(r"""(\w+)\s*=\s*['"]([^'"]*)['"]""")
+
+#The header of an LHE file, everything before the first <event>, see read_header.
+#  text: the header itself
+#  beams and energies: the PDG ids (IDBMUP) and energies in GeV (EBMUP) of the two beams
+#  pdfgroups and pdfsets: the PDFLIB group (PDFGUP) and set (PDFSUP) of each beam
+#  weightingstrategy: IDWTUP
+#  processes: one Process per line of the <init> block after the first
+#  weightgroups: the weight ids of each <weightgroup> in the <initrwgt> block by group name (weights outside of a group are under ""),
+#                or None if there is no <initrwgt> block
+#  generators: the version of each program that wrote the file, by name, from the <generator> tags and MadGraph's <MGVersion>
+#The fields from the <init> block are None for files without one.
+LHEHeader = collections.namedtuple(
+    "LHEHeader", "text beams energies pdfgroups pdfsets weightingstrategy processes weightgroups generators"
+)
+#One process of the <init> block: IDPRUP, XSECUP, XERRUP and XMAXUP
+Process = collections.namedtuple("Process", "id crosssection error maxweight")
+_HEADERS = {} #read_header's cache: (size, mtime, LHEHeader) by the real path of the file
+
+
+def _scan_event_blocks(f, blocksize, linenumber):
+    """The generator behind iter_event_blocks, which also keeps track of where each event starts
+
+    Parameters
+    ----------
+    f : file
+        An LHE file opened in binary mode
+    blocksize : int
+        The number of bytes to read at a time
+    linenumber : int
+        The line number of the first byte that will be read
+
+    Yields
+    ------
+    Tuple[int, int, bytes]
+        The line number of the </event> tag, the offset of <event> from where reading started, and the event itself
+    """
+    buffer = b""
+    bufferoffset = 0 #the offset of the start of the buffer from where reading started
+    while True:
+        block = f.read(blocksize)
+        if not block:
+            return
+        buffer += block
+
+        position = 0
+        while True:
+            begin = buffer.find(EVENT_START, position)
+            if begin == -1:
+                keep = max(position, len(buffer) - len(EVENT_START) + 1) #a tag can be split across two blocks
+                break
+            end = buffer.find(EVENT_END, begin)
+            if end == -1:
+                keep = begin
+                break
+            linenumber += buffer.count(b"\n", position, end)
+            position = end + len(EVENT_END)
+            yield linenumber, bufferoffset + begin, buffer[begin:position]
+
+        linenumber += buffer.count(b"\n", position, keep)
+        bufferoffset += keep
+        buffer = buffer[keep:]
+
+
+def iter_event_blocks(f, blocksize=DEFAULT_BLOCKSIZE, linenumber=1):
+    """This function streams an LHE file in large binary blocks and yields every <event> block in it.
+    Event boundaries are found with bulk byte searches, so nothing is done per line.
+
+    Parameters
+    ----------
+    f : file
+        An LHE file opened in binary mode (anything with a read(n) method that returns bytes)
+    blocksize : int, optional
+        The number of bytes to read at a time, by default DEFAULT_BLOCKSIZE
+    linenumber : int, optional
+        The line number of the first byte that will be read, for files that have been seeked into, by default 1
+
+    Yields
+    ------
+    Tuple[int, bytes]
+        The line number of the </event> tag, and everything from <event> up to and including </event>
+    """
+    for eventlinenumber, _, event in _scan_event_blocks(f, blocksize, linenumber):
+        yield eventlinenumber, event
+
+
+def get_index_filename(lhefile):
+    """Gets the name of the sidecar file that stores the event index of an LHE file
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+
+    Returns
+    -------
+    str
+        The name of the index file
+    """
+    return lhefile + INDEX_SUFFIX
+
+
+def build_event_index(lhefile, blocksize=DEFAULT_BLOCKSIZE):
+    """Builds the event index of an LHE file in one streaming pass
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+    blocksize : int, optional
+        The number of bytes to read at a time, by default DEFAULT_BLOCKSIZE
+
+    Returns
+    -------
+    EventIndex
+        The byte offset, length and starting line number of every event, along with the size and mtime of the file it describes
+    """
+    offsets, lengths, linenumbers = array("q"), array("q"), array("q")
+    stat = os.stat(lhefile)
+    with lhe_compression.open_lhe(lhefile) as f:
+        for linenumber, offset, event in _scan_event_blocks(f, blocksize, 1):
+            offsets.append(offset)
+            lengths.append(len(event))
+            linenumbers.append(linenumber - event.count(b"\n"))
+
+    return EventIndex(
+        np.frombuffer(offsets, dtype=np.int64), np.frombuffer(lengths, dtype=np.int64), np.frombuffer(linenumbers, dtype=np.int64),
+        stat.st_size, stat.st_mtime_ns
+    )
+
+
+def _load_saved_index(lhefile):
+    """The event index from the sidecar file, or None if there is none or the LHE file has changed size or mtime since it was written"""
+    stat = os.stat(lhefile)
+    try:
+        with np.load(get_index_filename(lhefile)) as saved:
+            if (saved["version"] == INDEX_VERSION and saved["size"] == stat.st_size and saved["mtime"] == stat.st_mtime_ns):
+                return EventIndex(saved["offsets"], saved["lengths"], saved["linenumbers"], int(saved["size"]), int(saved["mtime"]))
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def load_event_index(lhefile, blocksize=DEFAULT_BLOCKSIZE, save=True):
+    """Loads the event index of an LHE file from its sidecar file.
+    If there is no sidecar, or the LHE file has changed size or mtime since it was written, the index is rebuilt (and saved).
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+    blocksize : int, optional
+        The number of bytes to read at a time if the index has to be rebuilt, by default DEFAULT_BLOCKSIZE
+    save : bool, optional
+        Whether to write a rebuilt index to the sidecar file, by default True.
+        Directories that are not writable simply do not get a sidecar.
+
+    Returns
+    -------
+    EventIndex
+        The event index
+    """
+    index = _load_saved_index(lhefile)
+    if index is not None:
+        return index
+
+    index = build_event_index(lhefile, blocksize)
+    if save:
+        try:
+            indexfile = get_index_filename(lhefile)
+            temporaryfile = indexfile + ".{}.tmp".format(os.getpid())
+            with open(temporaryfile, "wb") as f:
+                np.savez(f, version=INDEX_VERSION, size=index.size, mtime=index.mtime,
+                         offsets=index.offsets, lengths=index.lengths, linenumbers=index.linenumbers)
+            os.replace(temporaryfile, indexfile) #so that parallel jobs never read a half-written index
+        except OSError:
+            pass
+    return index
+
+
+def count_events(lhefile, blocksize=DEFAULT_BLOCKSIZE, stream=True):
+    """Counts the events in an LHE file without parsing or keeping them.
+    If the file has an up to date event index sidecar (see load_event_index), the count comes from there.
+    Otherwise the file is streamed in blocks and the </event> tags are counted with bulk byte searches,
+    so the memory use is constant and the speed is close to the speed of reading (or decompressing) the file.
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with, compressed or not
+    blocksize : int, optional
+        The number of bytes to read at a time, by default DEFAULT_BLOCKSIZE
+    stream : bool, optional
+        Whether to stream the file if there is no up to date sidecar, by default True
+
+    Returns
+    -------
+    Union[int, None]
+        The number of complete events (a truncated last event is not counted, like in iter_event_blocks),
+        or None if stream is False and there is no up to date sidecar
+    """
+    index = _load_saved_index(lhefile)
+    if index is not None:
+        return len(index.offsets)
+    if not stream:
+        return None
+
+    count = 0
+    tail = b"" #the end of the previous block, in case a tag is split across two blocks
+    with lhe_compression.open_lhe(lhefile) as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                return count
+            block = tail + block
+            count += block.count(EVENT_END)
+            tail = block[-(len(EVENT_END) - 1):]
+
+
+def read_event(f, index, n):
+    """Reads event n of an LHE file by seeking straight to it
+
+    Parameters
+    ----------
+    f : file
+        The LHE file, opened in binary mode
+    index : EventIndex
+        The event index of the file
+    n : int
+        The (0-based) event number
+
+    Returns
+    -------
+    bytes
+        Everything from <event> up to and including </event>
+    """
+    f.seek(index.offsets[n])
+    return f.read(index.lengths[n])
+
+
+def get_event(lhefile, n):
+    """Gets event n of an LHE file without reading the rest of the file, using (and creating if needed) the event index
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+    n : int
+        The (0-based) event number
+
+    Returns
+    -------
+    str
+        The event sequence as a string (everything between <event> and </event>)
+    """
+    index = load_event_index(lhefile)
+    with lhe_compression.open_lhe(lhefile) as f:
+        return read_event(f, index, n).decode()
+
+
+def read_until_first_event(lhefile, blocksize=1 << 16):
+    """Reads an LHE file only up to its first <event>, without touching the rest of the file
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+    blocksize : int, optional
+        The number of bytes to read at a time, by default 64 kiB
+
+    Returns
+    -------
+    str
+        Everything before the first <event> (the whole file if there are no events)
+    """
+    head = b""
+    with lhe_compression.open_lhe(lhefile) as f:
+        while True:
+            block = f.read(blocksize)
+            head += block
+            eventstart = head.find(EVENT_START, max(0, len(head) - len(block) - len(EVENT_START)))
+            if eventstart != -1:
+                return head[:eventstart].decode()
+            if not block:
+                return head.decode()
+
+
+def _parse_init(lhefile, header):
+    """The LHEHeader fields from the <init> block, from beams to processes"""
+    init = INIT_REGEX.search(header)
+    if not init:
+        return (None,) * 6
+    lines = [line.split() for line in init.group(1).strip().splitlines() if line.strip() and not line.strip().startswith(("<", "#"))]
+    try:
+        beams = (int(lines[0][0]), int(lines[0][1]))
+        energies = (float(lines[0][2]), float(lines[0][3]))
+        pdfgroups = (int(lines[0][4]), int(lines[0][5]))
+        pdfsets = (int(lines[0][6]), int(lines[0][7]))
+        weightingstrategy = int(lines[0][8])
+        nprocesses = int(lines[0][9])
+        processes = tuple(Process(int(line[3]), float(line[0]), float(line[1]), float(line[2])) for line in lines[1:nprocesses+1])
+    except (IndexError, ValueError):
+        raise ValueError("Malformed <init> block in " + lhefile)
+    if len(processes) != nprocesses:
+        raise ValueError("Malformed <init> block in " + lhefile)
+    return beams, energies, pdfgroups, pdfsets, weightingstrategy, processes
+
+
+def _parse_initrwgt(header):
+    """The weightgroups field of LHEHeader"""
+    initrwgt = INITRWGT_REGEX.search(header)
+    if not initrwgt:
+        return None
+    weightgroups = collections.OrderedDict()
+    group = ""
+    for match in INITRWGT_TAG_REGEX.finditer(initrwgt.group(1)):
+        if match.group(2) is not None:
+            weightgroups.setdefault(group, []).append(match.group(2))
+        elif match.group(1) is not None:
+            attributes = dict(ATTRIBUTE_REGEX.findall(match.group(1)))
+            group = attributes.get("name", attributes.get("type", "")) #older MadGraph versions call the name "type"
+            weightgroups.setdefault(group, [])
+        else:
+            group = ""
+    return collections.OrderedDict((name, tuple(weightids)) for name, weightids in weightgroups.items())
+
+
+def _parse_generators(header):
+    """The generators field of LHEHeader"""
+    generators = collections.OrderedDict()
+    for match in GENERATOR_REGEX.finditer(header):
+        attributes = dict(ATTRIBUTE_REGEX.findall(match.group(1)))
+        if "name" in attributes:
+            generators[attributes["name"]] = attributes.get("version")
+    mgversion = MGVERSION_REGEX.search(header)
+    if mgversion:
+        generators.setdefault("MadGraph", mgversion.group(1))
+    return generators
+
+
+def read_header(lhefile):
+    """Reads and parses the header of an LHE file (everything before the first <event>), without touching the events.
+    The result is cached for each file, so asking again is free until the file changes size or mtime.
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+
+    Returns
+    -------
+    LHEHeader
+        The beams, PDFs, processes, reweighting weights and generators declared in the header, and its text
+
+    Raises
+    ------
+    ValueError
+        If the <init> block is malformed
+    """
+    path = os.path.realpath(lhefile)
+    stat = os.stat(path)
+    cached = _HEADERS.get(path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    text = read_until_first_event(lhefile)
+    header = LHEHeader(text, *_parse_init(lhefile, text), weightgroups=_parse_initrwgt(text), generators=_parse_generators(text))
+    _HEADERS[path] = (stat.st_size, stat.st_mtime_ns, header)
+    return header
+
+
+def get_weight_ids(lhefile):
+    """Gets the ids of the reweighting weights of an LHE file, in the order they are declared in the <initrwgt> header.
+    Files without an <initrwgt> block get the ids in the order they appear in the first event's <rwgt> block.
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+
+    Returns
+    -------
+    list[str]
+        The weight ids (empty if the file has no reweighting weights)
+    """
+    weightgroups = read_header(lhefile).weightgroups
+    if weightgroups is not None:
+        return [weightid for weightids in weightgroups.values() for weightid in weightids]
+
+    with lhe_compression.open_lhe(lhefile) as f:
+        for _, event in iter_event_blocks(f):
+            return [weightid for weightid, _ in WEIGHT_REGEX.findall(event.decode())]
+    return []
+
+
+class WeightParser(object):
+    """Parses the <rwgt> block of events straight into a dense array of weights with a fixed column order.
+    The weights are nearly always written in the same order in every event, so the order seen in the first event
+    is remembered and each event only needs one tuple comparison to confirm it before the values are placed.
+    """
+
+    def __init__(self, weightids):
+        """
+        Parameters
+        ----------
+        weightids : list[str]
+            The weight ids, in the order of the columns of the output array. Any other weights in the events are ignored.
+        """
+        self.weightids = tuple(weightids)
+        self._columns = {weightid: column for column, weightid in enumerate(self.weightids)}
+        self._eventorder = None
+        self._selected = None
+        self._permutation = None
+
+    def parse(self, event, out=None):
+        """Parses the weights of one event
+
+        Parameters
+        ----------
+        event : str
+            The event text
+        out : numpy.ndarray, optional
+            The array to write the weights into, by default a new float64 array
+
+        Returns
+        -------
+        numpy.ndarray
+            The weights, with one entry per weight id
+
+        Raises
+        ------
+        ValueError
+            If any of the weight ids is missing from the event
+        """
+        if out is None:
+            out = np.empty(len(self.weightids))
+        matches = WEIGHT_REGEX.findall(event)
+        eventids = tuple(weightid for weightid, _ in matches)
+        if eventids != self._eventorder:
+            missing = set(self.weightids) - set(eventids)
+            if missing:
+                raise ValueError("Weights {} are missing from the event".format(sorted(missing)))
+            self._eventorder = eventids
+            self._selected = np.array([i for i, weightid in enumerate(eventids) if weightid in self._columns], dtype=np.intp)
+            self._permutation = np.array([self._columns[weightid] for weightid in eventids if weightid in self._columns], dtype=np.intp)
+        out[self._permutation] = np.array([value for _, value in matches], dtype=np.float64)[self._selected]
+        return out
+
+
+def get_cross_section(lhefile):
+    """Gets the total cross section of an LHE file from its <init> block, reading only the (cached) header.
+    The cross sections (XSECUP) of the processes are summed and their uncertainties (XERRUP) are added in quadrature.
+
+    Parameters
+    ----------
+    lhefile : str
+        The LHE file you are working with
+
+    Returns
+    -------
+    Tuple[float, float]
+        The cross section and its uncertainty, in the units of the file (usually pb)
+
+    Raises
+    ------
+    ValueError
+        If the file has no <init> block or it is malformed
+    """
+    processes = read_header(lhefile).processes
+    if processes is None:
+        raise ValueError(lhefile + " has no <init> block")
+    return sum(process.crosssection for process in processes), sum(process.error**2 for process in processes) ** 0.5
+
 
 def get_all_events(lhefile):
     """This function opens and collects every LHE event and puts them in a list to return
@@ -16,34 +513,66 @@ def get_all_events(lhefile):
         A list of every event sequence as strings from the file (AKA everything between <event> and </event>)
     """
 
-    with open(lhefile) as f:
-        f = f.read()
+    with lhe_compression.open_lhe(lhefile) as f:
+        f = f.read().decode()
         all_matches = re.findall(lhe_constants.event_selection_regex, f)
         all_matches = [item[0] for item in all_matches]
         return all_matches
     
-def get_non_event_portions(lhefile):
+def _read_after_last_event(lhefile, blocksize):
+    """Everything after the last </event> (empty if there are no events).
+    Uncompressed files are read backwards from the end, compressed ones are streamed keeping only what follows the last </event> seen so far."""
+    if lhe_compression.detect_compression(lhefile) is None:
+        with open(lhefile, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            tail = b""
+            while position > 0:
+                size = min(blocksize, position)
+                position -= size
+                f.seek(position)
+                tail = f.read(size) + tail
+                end = tail.rfind(EVENT_END, 0, size + len(EVENT_END) - 1) #only the new block, and a tag split across the two
+                if end != -1:
+                    return tail[end+len(EVENT_END):]
+        return b""
+
+    tail = b""
+    seen = False
+    with lhe_compression.open_lhe(lhefile) as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            tail += block
+            end = tail.rfind(EVENT_END, max(0, len(tail) - len(block) - len(EVENT_END) + 1))
+            if end != -1:
+                seen = True
+                tail = tail[end+len(EVENT_END):]
+            elif not seen:
+                tail = tail[-(len(EVENT_END) - 1):] #a tag can be split across two blocks
+    return tail if seen else b""
+
+
+def get_non_event_portions(lhefile, blocksize=DEFAULT_BLOCKSIZE):
     """This function gets everything in an LHE file that is not an event 
-    (everything before the first <event> and everything after the last </event>)
+    (everything before the first <event> and everything after the last </event>).
+    The start comes from read_header and the end is read backwards from the end of the file, so the events are not read
+    (compressed files have to be streamed through to the end, but nothing is kept in memory).
 
     Parameters
     ----------
     lhefile : str
         The LHE file you are working with
+    blocksize : int, optional
+        The number of bytes to read at a time, by default DEFAULT_BLOCKSIZE
 
     Returns
     -------
     Tuple[str, str]
         Two strings of everything before the first <event> and everything after the last </event>
     """
-    with open(lhefile) as f:
-        f = f.read()
-        f_start = f[:f.find("<event>")] #everything until the first event
-        f_end = f[f.rfind("</event>") + len("</event>"):] #everything after the last event
-        return f_start, f_end
+    return read_header(lhefile).text, _read_after_last_event(lhefile, blocksize).decode()
 
 def cut_down_to_size(lhefile, n, verbose=False):
-    """Cuts the number of events in an LHE file down to n events while preserving other aspects of the file
+    """Cuts the number of events in an LHE file down to n events while preserving other aspects of the file.
+    The events are streamed, and reading stops after the first n
 
     Parameters
     ----------
@@ -64,22 +593,17 @@ def cut_down_to_size(lhefile, n, verbose=False):
     ValueError
         n must be <= the number of events in the file
     """
-    all_events = get_all_events(lhefile)
-    start_of_file, end_of_file = get_non_event_portions(lhefile)
-    
-    orig_num = len(all_events)
-    
     n = int(n)
-    
-    if n == orig_num:
-        return start_of_file + ("\n".join(all_events)) + end_of_file
-    elif n > orig_num:
+    start_of_file, end_of_file = get_non_event_portions(lhefile)
+
+    #only the first n events are read
+    with lhe_compression.open_lhe(lhefile) as f:
+        events = [event.decode() for _, event in itertools.islice(iter_event_blocks(f), n)]
+
+    if len(events) < n:
         raise ValueError("n must be less than or equal to the number of events already in the file!")
-    
+
     if verbose:
-        print(orig_num, "events ->", n, "events")
-    
-    all_events = all_events[:n]
+        print(count_events(lhefile), "events ->", n, "events")
 
-    
-    return start_of_file + ("\n".join(all_events)) + end_of_file #this would ideally be placed directly into a file
\ No newline at end of file
+    return start_of_file + ("\n".join(events)) + end_of_file #this would ideally be placed directly into a file
@@ -1,4 +1,5 @@
 import argparse
+import lhe_compression
 import lhefile_methods
 
 
@@ -15,7 +16,7 @@ if __name__ == '__main__':
     for file in args.filenames:
         to_write = lhefile_methods.cut_down_to_size(file, args.num)
         
-        filename = file.split('/')[-1]
+        filename = lhe_compression.strip_compression_suffix(file.split('/')[-1]) #the sliced file is written uncompressed
         filepath = "/".join(file.split('/')[:-1])
         # print(filepath, filename)
         